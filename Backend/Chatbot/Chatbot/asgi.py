@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Chatbot.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings
+
+if settings.WARMUP_ON_START:
+    from chatapi.warmup import start_background_warmup
+    start_background_warmup()
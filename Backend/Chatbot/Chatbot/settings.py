@@ -37,6 +37,7 @@ ALLOWED_HOSTS = ['*']
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'corsheaders',
     'django.contrib.admin',
     'django.contrib.auth',
@@ -87,17 +88,58 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Chatbot.wsgi.application'
+ASGI_APPLICATION = 'Chatbot.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=sqlite (default) or postgres.
+# SQLite runs in WAL mode so readers never wait for the writer; writers queue on
+# the busy timeout instead of failing with "database is locked". PostgreSQL
+# keeps connections open for DB_CONN_MAX_AGE seconds, or with POSTGRES_POOL=True
+# uses a psycopg connection pool (preferred under ASGI, where persistent
+# connections are not reused between requests).
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'chatbot'),
+            'USER': os.getenv('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.getenv('POSTGRES_POOL', 'False') == 'True':
+        DATABASES['default']['CONN_MAX_AGE'] = 0   # Django refuses persistent connections together with a pool
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.getenv('POSTGRES_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.getenv('POSTGRES_POOL_MAX_SIZE', '20')),
+                'timeout': float(os.getenv('POSTGRES_POOL_TIMEOUT', '10')),
+            }
+        }
+else:
+    SQLITE_WAL = os.getenv('SQLITE_WAL', 'True') == 'True'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', '20')),
+                # Take the write lock when a transaction starts, so it waits on the
+                # busy timeout rather than failing when upgrading a read lock
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': ('PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;' if SQLITE_WAL else '')
+                                + 'PRAGMA cache_size=-20000',
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -211,3 +253,123 @@ SITE_ID = 1
 ACCOUNT_LOGIN_METHODS = {"email"}
 ACCOUNT_SIGNUP_FIELDS = ["email*"]
 
+
+# Semantic answer cache (chatapi/cache.py)
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'True') == 'True'
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '512'))
+
+# Direct-answer fast path: stream the stored KnowledgeBase answer without the LLM
+DIRECT_ANSWER_ENABLED = os.getenv('DIRECT_ANSWER_ENABLED', 'True') == 'True'
+DIRECT_ANSWER_THRESHOLD = float(os.getenv('DIRECT_ANSWER_THRESHOLD', '0.95'))
+
+# Chat history sent to the LLM: last N turns verbatim plus a rolling summary
+CHAT_HISTORY_TURNS = int(os.getenv('CHAT_HISTORY_TURNS', '4'))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv('CHAT_HISTORY_TOKEN_BUDGET', '1024'))
+CHAT_SUMMARY_ENABLED = os.getenv('CHAT_SUMMARY_ENABLED', 'True') == 'True'
+CHAT_SUMMARY_BATCH_MESSAGES = int(os.getenv('CHAT_SUMMARY_BATCH_MESSAGES', '8'))
+
+# LLM generation admission control (chatapi/scheduler.py)
+LLM_MAX_CONCURRENT_GENERATIONS = int(os.getenv('LLM_MAX_CONCURRENT_GENERATIONS', '2'))
+LLM_MAX_QUEUED_GENERATIONS = int(os.getenv('LLM_MAX_QUEUED_GENERATIONS', '32'))
+LLM_QUEUE_RETRY_AFTER = int(os.getenv('LLM_QUEUE_RETRY_AFTER', '10'))
+LLM_QUEUE_POLL_SECONDS = float(os.getenv('LLM_QUEUE_POLL_SECONDS', '1'))
+
+# Query/document embedding cache (chatapi/embedding.py)
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'True') == 'True'
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', str(BASE_DIR / 'embedding_cache.sqlite3'))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MEMORY_ENTRIES', '4096'))
+EMBEDDING_CACHE_DISK_ENTRIES = int(os.getenv('EMBEDDING_CACHE_DISK_ENTRIES', '200000'))
+
+# KnowledgeBase -> vector store change sync
+VECTOR_SYNC_BATCH_SIZE = int(os.getenv('VECTOR_SYNC_BATCH_SIZE', '256'))
+
+# Bulk knowledge-base ingestion (chatapi/ingest.py)
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', '500'))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv('INGEST_EMBED_BATCH_SIZE', '1024'))
+INGEST_STREAM_BATCH_SIZE = int(os.getenv('INGEST_STREAM_BATCH_SIZE', '2000'))
+
+# Background ingestion jobs, processed by `python manage.py ingest_worker`
+INGEST_ASYNC_JOBS = os.getenv('INGEST_ASYNC_JOBS', 'True') == 'True'
+INGEST_WORKER_POLL_SECONDS = float(os.getenv('INGEST_WORKER_POLL_SECONDS', '2'))
+# Jobs still 'running' with no progress reported for this long are taken to belong to a dead
+# worker: they are queued again, or failed once they have been claimed INGEST_JOB_MAX_ATTEMPTS times
+INGEST_JOB_STALE_SECONDS = int(os.getenv('INGEST_JOB_STALE_SECONDS', '3600'))
+INGEST_JOB_MAX_ATTEMPTS = int(os.getenv('INGEST_JOB_MAX_ATTEMPTS', '2'))
+
+# Retriever backend: 'chroma' (default) or 'numpy' (memory-mapped brute-force index)
+RETRIEVER_BACKEND = os.getenv('RETRIEVER_BACKEND', 'chroma')
+NUMPY_INDEX_DIR = os.getenv('NUMPY_INDEX_DIR', str(BASE_DIR / 'numpy_index'))
+
+# Batch chat endpoint (/api/chat/batch/)
+BATCH_CHAT_MAX_PROMPTS = int(os.getenv('BATCH_CHAT_MAX_PROMPTS', '500'))
+BATCH_CHAT_CONCURRENCY = int(os.getenv('BATCH_CHAT_CONCURRENCY', '2'))
+
+# Prompt token budget split between template, question, history and context (chatapi/context.py)
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3072'))
+PROMPT_TEMPLATE_TOKENS = int(os.getenv('PROMPT_TEMPLATE_TOKENS', '120'))
+PROMPT_QUESTION_MAX_TOKENS = int(os.getenv('PROMPT_QUESTION_MAX_TOKENS', '256'))
+CONTEXT_MIN_TOKENS = int(os.getenv('CONTEXT_MIN_TOKENS', '256'))
+CONTEXT_MAX_ANSWER_TOKENS = int(os.getenv('CONTEXT_MAX_ANSWER_TOKENS', '400'))
+CONTEXT_MIN_ANSWER_TOKENS = int(os.getenv('CONTEXT_MIN_ANSWER_TOKENS', '32'))
+CONTEXT_DEDUP_JACCARD = float(os.getenv('CONTEXT_DEDUP_JACCARD', '0.85'))
+
+# Ollama backend pool (chatapi/backends.py): comma-separated URLs, least-loaded routing
+OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL', os.getenv('OLLAMA_HOST', 'http://localhost:11434'))
+OLLAMA_LLM_URLS = [u.strip() for u in os.getenv('OLLAMA_LLM_URLS', OLLAMA_BASE_URL).split(',') if u.strip()]
+OLLAMA_EMBED_URLS = [u.strip() for u in os.getenv('OLLAMA_EMBED_URLS', OLLAMA_BASE_URL).split(',') if u.strip()]
+OLLAMA_HEALTH_PROBE_SECONDS = float(os.getenv('OLLAMA_HEALTH_PROBE_SECONDS', '10'))
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv('OLLAMA_FAILURE_THRESHOLD', '3'))
+
+# Warm up models and the vector store when a server process starts (see /ready)
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', 'True') == 'True'
+
+# Prometheus metrics at /metrics (chatapi/metrics.py). Served to the addresses in
+# METRICS_ALLOWED_IPS, or to a scraper sending `Authorization: Bearer <METRICS_TOKEN>`
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Conversations and the history API: a chat without conversation_id continues the
+# latest conversation unless it has been idle this long
+CONVERSATION_IDLE_MINUTES = int(os.getenv('CONVERSATION_IDLE_MINUTES', '30'))
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '50'))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', '200'))
+
+# Share one generation between identical in-flight questions that have no chat history (chatapi/coalesce.py)
+COALESCE_ENABLED = os.getenv('COALESCE_ENABLED', 'True') == 'True'
+
+# When a chat client disconnects mid-answer, keep the partial reply (marked truncated) or drop the exchange
+CHAT_SAVE_PARTIAL_REPLIES = os.getenv('CHAT_SAVE_PARTIAL_REPLIES', 'True') == 'True'
+
+# SSE chat streams (chatapi/streaming.py): batch tokens into one frame per window or size,
+# and gzip the stream for clients that accept it. SSE_COALESCE_MS=0 sends every token at once.
+SSE_COALESCE_MS = int(os.getenv('SSE_COALESCE_MS', '50'))
+SSE_COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', '256'))
+SSE_COMPRESSION = os.getenv('SSE_COMPRESSION', 'False') == 'True'
+SSE_COMPRESSION_LEVEL = int(os.getenv('SSE_COMPRESSION_LEVEL', '6'))
+
+# Chat logs are written by one background thread in batches (chatapi/chatlog.py),
+# so streams never wait on the database write lock. On by default for SQLite.
+CHAT_LOG_WRITER = os.getenv('CHAT_LOG_WRITER', str(DB_ENGINE == 'sqlite')) == 'True'
+CHAT_LOG_BATCH_SIZE = int(os.getenv('CHAT_LOG_BATCH_SIZE', '100'))
+# How long a history read waits for the same user's queued messages to be written
+CHAT_LOG_WAIT_SECONDS = float(os.getenv('CHAT_LOG_WAIT_SECONDS', '2'))
+# A failed batch is retried with doubling delays, then written one exchange at a time
+CHAT_LOG_RETRIES = int(os.getenv('CHAT_LOG_RETRIES', '3'))
+CHAT_LOG_RETRY_SECONDS = float(os.getenv('CHAT_LOG_RETRY_SECONDS', '0.5'))
+
+# Shared retrieval service (chatapi/retrieval_service.py, `manage.py retrieval_service`):
+# when set, workers search over this Unix socket instead of opening the index themselves
+RETRIEVAL_SERVICE_SOCKET = os.getenv('RETRIEVAL_SERVICE_SOCKET', '')
+RETRIEVAL_SERVICE_TIMEOUT = float(os.getenv('RETRIEVAL_SERVICE_TIMEOUT', '30'))
+# How often the service checks the outbox for KB edits made by other processes
+RETRIEVAL_SERVICE_SYNC_SECONDS = float(os.getenv('RETRIEVAL_SERVICE_SYNC_SECONDS', '10'))
+
+# Retrieval cache (chatapi/cache.py): normalized question -> vector, ranked documents and
+# assembled context, dropped whenever the KB version moves
+RETRIEVAL_CACHE_ENABLED = os.getenv('RETRIEVAL_CACHE_ENABLED', 'True') == 'True'
+RETRIEVAL_CACHE_MAX_MB = int(os.getenv('RETRIEVAL_CACHE_MAX_MB', '32'))
+# How often a process re-reads the shared KB version (chatapi/kb_version.py)
+KB_VERSION_CHECK_SECONDS = float(os.getenv('KB_VERSION_CHECK_SECONDS', '1'))
@@ -21,6 +21,7 @@ from django.conf.urls.static import static
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from chatapi.views import ReadyView,MetricsView
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -37,6 +38,8 @@ schema_view = get_schema_view(
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('ready', ReadyView.as_view(), name='ready'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('api/',include('chatapi.urls')),
     path('api/user/',include('user.urls')),
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Chatbot.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+if settings.WARMUP_ON_START:
+    from chatapi.warmup import start_background_warmup
+    start_background_warmup()
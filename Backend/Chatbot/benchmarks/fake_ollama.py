@@ -0,0 +1,214 @@
+"""
+Deterministic stand-in for an Ollama server, for load tests without a GPU,
+models or network access.
+
+    python -m benchmarks.fake_ollama --port 11500 --token-rate 20 --first-token-delay 0.5
+
+Implements GET /api/tags, POST /api/generate (streaming or not) and
+POST /api/embed. Replies depend only on the request and --seed, so two runs
+with the same settings produce the same tokens, vectors and injected errors.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+WORDS = (
+    "the university offers admission fee semester department students campus library "
+    "examination schedule course credit hours faculty office registration form result "
+    "transcript hostel transport scholarship deadline program degree science arts"
+).split()
+
+
+class FakeOllamaConfig:
+    def __init__(self, token_rate=20.0, first_token_delay=0.5, tokens=150, error_rate=0.0,
+                 embed_delay=0.01, embed_error_rate=0.0, dim=768, seed=0):
+        self.token_rate = token_rate
+        self.first_token_delay = first_token_delay
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.embed_delay = embed_delay
+        self.embed_error_rate = embed_error_rate
+        self.dim = dim
+        self.seed = seed
+
+
+def _rng(seed, *parts):
+    digest = hashlib.sha256("\0".join([str(seed), *map(str, parts)]).encode('utf-8')).digest()
+    return random.Random(int.from_bytes(digest[:8], 'big'))
+
+
+def fake_tokens(prompt, count, seed=0):
+    rng = _rng(seed, 'tokens', prompt)
+    return [(" " if i else "") + rng.choice(WORDS) for i in range(count)]
+
+
+def fake_embedding(text, dim, seed=0):
+    """Hashed bag of words, so paraphrases that share words land close together"""
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        rng = _rng(seed, 'embed', word)
+        vector[rng.randrange(dim)] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    config = FakeOllamaConfig()
+    counter = 0
+    counter_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _next_request(self):
+        with self.counter_lock:
+            FakeOllamaHandler.counter += 1
+            return FakeOllamaHandler.counter
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _injected_error(self, rate, kind):
+        if rate and _rng(self.config.seed, kind, self._next_request()).random() < rate:
+            self._json(500, {"error": f"injected {kind} failure"})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('/api/tags', ''):
+            self._json(200, {"models": [{"name": "fake", "model": "fake"}]})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path == '/api/generate':
+            self.generate(self._body())
+        elif self.path == '/api/embed':
+            self.embed(self._body())
+        else:
+            self._json(404, {"error": "not found"})
+
+    def generate(self, body):
+        model = body.get('model', 'fake')
+        prompt = body.get('prompt')
+        if not prompt:
+            # Ollama loads the model and returns at once for an empty prompt
+            self._json(200, {"model": model, "response": "", "done": True, "done_reason": "load"})
+            return
+        if self._injected_error(self.config.error_rate, 'generate'):
+            return
+
+        count = min(self.config.tokens, (body.get('options') or {}).get('num_predict') or self.config.tokens)
+        tokens = fake_tokens(prompt, count, self.config.seed)
+        interval = 1.0 / self.config.token_rate if self.config.token_rate else 0.0
+        started = time.perf_counter()
+
+        if body.get('stream') is False:
+            time.sleep(self.config.first_token_delay + interval * max(count - 1, 0))
+            self._json(200, {"model": model, "response": "".join(tokens), "done": True,
+                             "done_reason": "stop", "eval_count": count})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                # Sleep to a fixed schedule so the rate holds however slow the writes are
+                delay = started + self.config.first_token_delay + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                line = {"model": model, "response": token, "done": False}
+                self.wfile.write((json.dumps(line) + "\n").encode('utf-8'))
+                self.wfile.flush()
+            done = {"model": model, "response": "", "done": True, "done_reason": "stop", "eval_count": count,
+                    "total_duration": int((time.perf_counter() - started) * 1e9)}
+            self.wfile.write((json.dumps(done) + "\n").encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            # The client hung up mid-stream
+            pass
+
+    def embed(self, body):
+        if self._injected_error(self.config.embed_error_rate, 'embed'):
+            return
+        texts = body.get('input') or []
+        if isinstance(texts, str):
+            texts = [texts]
+        if self.config.embed_delay:
+            time.sleep(self.config.embed_delay)
+        self._json(200, {
+            "model": body.get('model', 'fake'),
+            "embeddings": [fake_embedding(text, self.config.dim, self.config.seed) for text in texts],
+        })
+
+
+def make_server(config, host='127.0.0.1', port=0):
+    """Build a threaded fake server; port 0 picks a free port (see server.server_port)"""
+    handler = type('ConfiguredFakeOllamaHandler', (FakeOllamaHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(config, host='127.0.0.1', port=0):
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, name='fake-ollama', daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument('--token-rate', type=float, default=20.0, help="Generated tokens per second")
+    parser.add_argument('--first-token-delay', type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument('--tokens', type=int, default=150, help="Tokens per reply (capped by num_predict)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of generate calls that fail with 500")
+    parser.add_argument('--embed-delay', type=float, default=0.01, help="Seconds per embed call")
+    parser.add_argument('--embed-error-rate', type=float, default=0.0, help="Fraction of embed calls that fail with 500")
+    parser.add_argument('--dim', type=int, default=768, help="Embedding size")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def config_from_args(args):
+    return FakeOllamaConfig(
+        token_rate=args.token_rate,
+        first_token_delay=args.first_token_delay,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        embed_delay=args.embed_delay,
+        embed_error_rate=args.embed_error_rate,
+        dim=args.dim,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic fake Ollama server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11500)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(config_from_args(args), args.host, args.port)
+    print(f"Fake Ollama listening on http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
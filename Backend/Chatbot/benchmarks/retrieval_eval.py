@@ -0,0 +1,208 @@
+"""
+Offline retrieval evaluation against the KnowledgeBase: recall@k, MRR and
+search latency for each combination of k, similarity threshold and
+retriever backend.
+
+    cd Backend/Chatbot
+    python -m benchmarks.retrieval_eval labeled.json --k 1,3,5,10 \\
+        --thresholds 0.5,0.6,0.7 --backends chroma,numpy --output retrieval.json
+
+The labeled set is a JSON array (or JSONL file) of paraphrased questions with
+the KnowledgeBase ids that should answer them:
+
+    [{"question": "how much is the fee for bs cs", "kb_ids": [12, 40]}, ...]
+
+Each backend gets a fresh index in a scratch directory, built from the
+current KnowledgeBase with the configured embeddings, so the live vector
+store is never touched. Question embeddings are computed once and shared by
+every backend, so search latency excludes embedding time. Embedding latency
+is reported on its own.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from .sse_load import summarize
+
+
+def load_labeled_set(path):
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            items = [json.loads(line) for line in f if line.strip()]
+        else:
+            items = json.load(f)
+
+    labeled = []
+    for item in items:
+        ids = item.get('kb_ids', item.get('kb_id'))
+        ids = ids if isinstance(ids, list) else [ids]
+        labeled.append((item['question'], {str(kb_id) for kb_id in ids if kb_id is not None}))
+    return labeled
+
+
+def build_index(backend, directory, embeddings, batch_size):
+    """Fresh index of every KnowledgeBase row for `backend` ('chroma' or 'numpy')"""
+    from chatapi.models import KnowledgeBase
+    from chatapi.utils import COLLECTION_NAME, kb_document
+    from chatapi.vector_index import NumpyVectorIndex
+
+    if backend == 'numpy':
+        store = NumpyVectorIndex(directory, embedding=embeddings)
+    elif backend == 'chroma':
+        from langchain_chroma import Chroma
+        store = Chroma(collection_name=COLLECTION_NAME, persist_directory=directory,
+                       embedding_function=embeddings)
+    else:
+        raise ValueError(f"Unknown retriever backend '{backend}'")
+
+    batch = []
+    for entry in KnowledgeBase.objects.order_by('id').iterator(chunk_size=batch_size):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            store.add_documents(documents=[kb_document(e) for e in batch], ids=[str(e.id) for e in batch])
+            batch = []
+    if batch:
+        store.add_documents(documents=[kb_document(e) for e in batch], ids=[str(e.id) for e in batch])
+    return store
+
+
+def score_query(ranked, relevant, threshold, k):
+    """
+    Apply the same cut as filter_relevant_documents (similarity above the
+    threshold) to the top k. Return (recall, hit, reciprocal rank, kept docs).
+    """
+    kept = [(doc, 1.0 - distance) for doc, distance in ranked[:k] if 1.0 - distance > threshold]
+    ids = [str(doc.metadata.get('id', doc.id)) for doc, _ in kept]
+
+    found = relevant.intersection(ids)
+    recall = len(found) / len(relevant) if relevant else 0.0
+    reciprocal_rank = 0.0
+    for rank, kb_id in enumerate(ids, start=1):
+        if kb_id in relevant:
+            reciprocal_rank = 1.0 / rank
+            break
+    return recall, bool(found), reciprocal_rank, kept
+
+
+def evaluate(labeled, backends, ks, thresholds, batch_size=256):
+    from chatapi.context import assemble_context, estimate_tokens
+    from chatapi.embedding import get_embeddings
+    from chatapi.models import KnowledgeBase
+
+    embeddings = get_embeddings()
+    known_ids = {str(kb_id) for kb_id in KnowledgeBase.objects.values_list('id', flat=True)}
+    missing = sorted({kb_id for _, ids in labeled for kb_id in ids} - known_ids)
+    labeled = [(question, ids & known_ids) for question, ids in labeled if ids & known_ids]
+
+    embed_latency = []
+    vectors = []
+    for question, _ in labeled:
+        started = time.perf_counter()
+        vectors.append(embeddings.embed_query(question))
+        embed_latency.append((time.perf_counter() - started) * 1000)
+
+    results = []
+    for backend in backends:
+        directory = tempfile.mkdtemp(prefix=f'retrieval-eval-{backend}-')
+        try:
+            started = time.perf_counter()
+            store = build_index(backend, directory, embeddings, batch_size)
+            build_seconds = time.perf_counter() - started
+
+            for k in ks:
+                latency = []
+                ranked_lists = []
+                for vector in vectors:
+                    started = time.perf_counter()
+                    ranked_lists.append(store.similarity_search_by_vector_with_relevance_scores(vector, k=k))
+                    latency.append((time.perf_counter() - started) * 1000)
+
+                for threshold in thresholds:
+                    recall = hits = mrr = docs = context_tokens = 0.0
+                    for (question, relevant), ranked in zip(labeled, ranked_lists):
+                        q_recall, q_hit, q_rr, kept = score_query(ranked, relevant, threshold, k)
+                        recall += q_recall
+                        hits += q_hit
+                        mrr += q_rr
+                        docs += len(kept)
+                        context_tokens += estimate_tokens(assemble_context(kept, budget=10 ** 9)) if kept else 0
+
+                    n = len(labeled) or 1
+                    results.append({
+                        "backend": backend,
+                        "k": k,
+                        "threshold": threshold,
+                        "recall": round(recall / n, 4),
+                        "hit_rate": round(hits / n, 4),
+                        "mrr": round(mrr / n, 4),
+                        "mean_docs": round(docs / n, 2),
+                        "mean_context_tokens": round(context_tokens / n, 1),
+                        "search_latency_ms": summarize(latency),
+                        "index_build_seconds": round(build_seconds, 3),
+                    })
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        "queries": len(labeled),
+        "knowledge_base_size": len(known_ids),
+        "unknown_kb_ids": missing,
+        "embedding_latency_ms": summarize(embed_latency),
+        "results": results,
+    }
+
+
+def format_report(report):
+    lines = [f"{report['queries']} queries over {report['knowledge_base_size']} KB entries"]
+    if report["unknown_kb_ids"]:
+        lines.append(f"ignored unknown KB ids: {', '.join(report['unknown_kb_ids'])}")
+    lines.append(f"{'backend':<8} {'k':>3} {'thresh':>6} {'recall':>7} {'hit':>6} {'mrr':>6} "
+                 f"{'docs':>5} {'ctx tok':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in report["results"]:
+        latency = row["search_latency_ms"]
+        lines.append(f"{row['backend']:<8} {row['k']:>3} {row['threshold']:>6} {row['recall']:>7} "
+                     f"{row['hit_rate']:>6} {row['mrr']:>6} {row['mean_docs']:>5} "
+                     f"{row['mean_context_tokens']:>8} {latency['p50']:>8} {latency['p95']:>8}")
+    return "\n".join(lines)
+
+
+def _numbers(value, cast):
+    return [cast(part) for part in value.split(',') if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval recall/MRR/latency over the knowledge base")
+    parser.add_argument('labeled', help="JSON/JSONL file of {question, kb_ids}")
+    parser.add_argument('--k', default='1,3,5,10', help="Comma-separated k values")
+    parser.add_argument('--thresholds', default='0.5,0.6,0.7', help="Comma-separated similarity thresholds")
+    parser.add_argument('--backends', default='chroma,numpy', help="Comma-separated retriever backends")
+    parser.add_argument('--output', help="Write the JSON report here")
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Chatbot.settings')
+    import django
+    django.setup()
+    from django.conf import settings
+
+    report = evaluate(
+        load_labeled_set(args.labeled),
+        backends=[b.strip() for b in args.backends.split(',') if b.strip()],
+        ks=_numbers(args.k, int),
+        thresholds=_numbers(args.thresholds, float),
+        batch_size=settings.VECTOR_SYNC_BATCH_SIZE,
+    )
+    report["config"] = {"k": _numbers(args.k, int), "thresholds": _numbers(args.thresholds, float),
+                        "backends": args.backends.split(','), "labeled": args.labeled}
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Self-contained chat load test: starts the fake Ollama server, a scratch
+database and a dev server, then drives concurrent SSE streams against it.
+Needs no network, models or existing data, so it can run in CI.
+
+    cd Backend/Chatbot
+    python -m benchmarks.run --concurrency 16 --requests 64 --token-rate 20 --output report.json
+
+Server settings such as LLM_MAX_CONCURRENT_GENERATIONS are read from the
+environment as usual, so runs can compare configurations. The answer cache,
+direct answers and chat summaries are off unless set explicitly, so every
+request reaches the (fake) LLM.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from . import fake_ollama, sse_load
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+SEED_KNOWLEDGE_BASE = [
+    ("What is the admission fee for science programs?", "The admission fee for science programs is listed in the prospectus."),
+    ("When is the last date for semester registration?", "Semester registration closes two weeks after classes begin."),
+    ("How can I apply for hostel accommodation?", "Hostel forms are available at the student affairs office."),
+    ("How do I get my transcript?", "Transcripts are issued by the examination department on request."),
+    ("Which scholarships are offered by the university?", "Merit and need based scholarships are offered every year."),
+    ("What are the library timings?", "The library is open from 8am to 8pm on working days."),
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_environment(workdir, ollama_url):
+    defaults = {
+        'SECRET_KEY': 'benchmark-secret-key',
+        'ANSWER_CACHE_ENABLED': 'False',
+        'DIRECT_ANSWER_ENABLED': 'False',
+        'CHAT_SUMMARY_ENABLED': 'False',
+        'RETRIEVER_BACKEND': 'numpy',
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    os.environ.update({
+        'DJANGO_SETTINGS_MODULE': 'Chatbot.settings',
+        'SQLITE_PATH': str(workdir / 'db.sqlite3'),
+        'NUMPY_INDEX_DIR': str(workdir / 'numpy_index'),
+        'EMBEDDING_CACHE_PATH': str(workdir / 'embedding_cache.sqlite3'),
+        'OLLAMA_BASE_URL': ollama_url,
+        'OLLAMA_LLM_URLS': ollama_url,
+        'OLLAMA_EMBED_URLS': ollama_url,
+    })
+
+
+def seed_database(users):
+    """Migrate the scratch DB, add the KB and users; return one access token per user"""
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from chatapi.models import KnowledgeBase
+    from user.models import User
+
+    call_command('migrate', verbosity=0)
+    for question, answer in SEED_KNOWLEDGE_BASE:
+        KnowledgeBase.objects.get_or_create(question=question, answer=answer)
+
+    tokens = []
+    for i in range(users):
+        user = User.objects.create_user(email=f"loadtest{i}@example.com", password=None)
+        tokens.append(User.generated_token(user)['access'])
+    return tokens
+
+
+def wait_until_ready(url, server, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            if httpx.get(f"{url}/ready", timeout=5).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server not ready after {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat load test against a fake Ollama server")
+    parser.add_argument('--users', type=int, default=8, help="Distinct authenticated users")
+    parser.add_argument('--ready-timeout', type=float, default=120)
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch directory and server log")
+    fake_ollama.add_arguments(parser)
+    sse_load.add_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='chatbot-loadtest-'))
+    ollama = fake_ollama.start_in_thread(fake_ollama.config_from_args(args))
+    prepare_environment(workdir, f"http://127.0.0.1:{ollama.server_port}")
+    tokens = seed_database(args.users)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    log = open(workdir / 'server.log', 'w')
+    server = subprocess.Popen(
+        [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload'],
+        cwd=BASE_DIR, env=os.environ.copy(), stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        wait_until_ready(url, server, args.ready_timeout)
+        report = asyncio.run(sse_load.run_load(url, tokens, args.concurrency, args.requests,
+                                               sse_load.load_prompts(args.prompts), args.path))
+        report["config"]["fake_ollama"] = vars(fake_ollama.config_from_args(args))
+        sse_load.write_report(report, args.output)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        log.close()
+        ollama.shutdown()
+        if args.keep:
+            print(f"Scratch files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
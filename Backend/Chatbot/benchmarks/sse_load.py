@@ -0,0 +1,210 @@
+"""
+Open many concurrent authenticated SSE chat streams and report latency
+percentiles.
+
+    python -m benchmarks.sse_load --url http://127.0.0.1:8000 --token <jwt> \\
+        --concurrency 16 --requests 64 --output report.json
+
+Time to first token counts from sending the request to the first `data:`
+frame; `event:` frames (queue position, answer source) are not tokens.
+Tokens are counted as whitespace-separated words in the reply, so the count
+does not depend on how the server groups tokens into frames. A stream that
+carries an `event: error` frame or no tokens at all is a failure, and like
+non-200 responses it is left out of the percentiles.
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+
+import httpx
+
+
+DEFAULT_PROMPTS = [
+    "What is the admission fee for the science department?",
+    "When does semester registration close?",
+    "How do I apply for a hostel room?",
+    "Where can I get my transcript?",
+    "What scholarships does the university offer?",
+    "What are the library timings during examinations?",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "mean": round(sum(values) / len(values), 4),
+        "max": round(max(values), 4),
+    }
+
+
+async def run_stream(client, url, token, prompt):
+    """One chat request; returns a result dict with timings or the failure"""
+    result = {"status": None, "ttft": None, "latency": None, "tokens": 0, "error": None}
+    started = time.perf_counter()
+    reply = []
+    try:
+        async with client.stream('POST', url, json={"prompt": prompt},
+                                 headers={"Authorization": f"Bearer {token}"}) as response:
+            result["status"] = response.status_code
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+
+            event = None
+            data = []
+            async for line in response.aiter_lines():
+                if line.startswith('event:'):
+                    event = line[6:].strip()
+                elif line.startswith('data:'):
+                    value = line[5:]
+                    data.append(value[1:] if value.startswith(' ') else value)
+                elif not line:
+                    if data and event is None:
+                        if result["ttft"] is None:
+                            result["ttft"] = time.perf_counter() - started
+                        reply.append("\n".join(data))
+                    elif data and event == 'error' and result["error"] is None:
+                        message = error_message("\n".join(data))
+                        result["error"] = f"event: error ({message})"
+                    event = None
+                    data = []
+    except httpx.HTTPError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    result["latency"] = time.perf_counter() - started
+    result["tokens"] = len("".join(reply).split())
+    if result["error"] is None and not result["tokens"]:
+        result["error"] = "no tokens"
+    return result
+
+
+def error_message(data):
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return data
+    return payload.get('message', data) if isinstance(payload, dict) else data
+
+
+async def run_load(base_url, tokens, concurrency, requests, prompts=None, path='/api/chat/', timeout=300):
+    """
+    Send `requests` chat requests with at most `concurrency` open at once,
+    cycling through `tokens` (one JWT per simulated user) and `prompts`.
+    """
+    prompts = prompts or DEFAULT_PROMPTS
+    url = base_url.rstrip('/') + path
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def one(i):
+            async with semaphore:
+                return await run_stream(client, url, tokens[i % len(tokens)], prompts[i % len(prompts)])
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - started
+
+    return build_report(results, wall, {
+        "url": url, "concurrency": concurrency, "requests": requests, "users": len(tokens),
+    })
+
+
+def build_report(results, wall, config):
+    ok = [r for r in results if r["error"] is None]
+    ttft = [r["ttft"] for r in ok if r["ttft"] is not None]
+    latency = [r["latency"] for r in ok]
+    per_stream_rate = [
+        (r["tokens"] - 1) / (r["latency"] - r["ttft"])
+        for r in ok if r["tokens"] > 1 and r["ttft"] is not None and r["latency"] > r["ttft"]
+    ]
+    total_tokens = sum(r["tokens"] for r in ok)
+
+    errors = {}
+    for r in results:
+        if r["error"] is not None:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+
+    return {
+        "config": config,
+        "completed": len(ok),
+        "failed": len(results) - len(ok),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "ttft_seconds": summarize(ttft),
+        "latency_seconds": summarize(latency),
+        "tokens": total_tokens,
+        "sustained_tokens_per_second": round(total_tokens / wall, 2) if wall else None,
+        "stream_tokens_per_second": summarize(per_stream_rate),
+    }
+
+
+def format_report(report):
+    lines = [
+        f"requests: {report['completed']} ok, {report['failed']} failed in {report['wall_seconds']}s",
+    ]
+    for label, key in (("time to first token", "ttft_seconds"), ("full response", "latency_seconds"),
+                       ("per-stream tokens/s", "stream_tokens_per_second")):
+        stats = report[key]
+        lines.append(f"{label:>20}: p50={stats['p50']} p95={stats['p95']} p99={stats['p99']} max={stats['max']}")
+    lines.append(f"{'sustained tokens/s':>20}: {report['sustained_tokens_per_second']}")
+    for error, count in report["errors"].items():
+        lines.append(f"{'error':>20}: {count} x {error}")
+    return "\n".join(lines)
+
+
+def add_arguments(parser):
+    parser.add_argument('--concurrency', type=int, default=8, help="Streams open at the same time")
+    parser.add_argument('--requests', type=int, default=32, help="Total chat requests to send")
+    parser.add_argument('--path', default='/api/chat/', help="Chat endpoint, e.g. /api/chat/async/")
+    parser.add_argument('--prompts', help="File with one prompt per line")
+    parser.add_argument('--output', help="Write the JSON report here")
+
+
+def load_prompts(path):
+    if not path:
+        return None
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def write_report(report, output):
+    print(format_report(report))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent SSE load driver for the chat API")
+    parser.add_argument('--url', required=True, help="Server base URL")
+    parser.add_argument('--token', action='append', required=True,
+                        help="JWT access token; repeat to spread requests over several users")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load(args.url, args.token, args.concurrency, args.requests,
+                                  load_prompts(args.prompts), args.path))
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
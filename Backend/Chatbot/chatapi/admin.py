@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import KnowledgeBase,UploadRecord,ChatMessage
+from .models import KnowledgeBase,UploadRecord,ChatMessage,ChatSummary,VectorSyncOutbox,IngestJob,Conversation
 # from django.contrib.auth.models import User
 
 # Register your models here.
@@ -15,4 +15,20 @@ class AdminUpload(admin.ModelAdmin):
 
 @admin.register(ChatMessage)
 class AdminChatmessage(admin.ModelAdmin):
-    list_display = ['id', 'user','role']
\ No newline at end of file
+    list_display = ['id', 'user','role','truncated']
+
+@admin.register(ChatSummary)
+class AdminChatSummary(admin.ModelAdmin):
+    list_display = ['id', 'user', 'conversation', 'last_message_id', 'updated_at']
+
+@admin.register(VectorSyncOutbox)
+class AdminVectorSyncOutbox(admin.ModelAdmin):
+    list_display = ['id', 'kb_id', 'action', 'created_at']
+
+@admin.register(IngestJob)
+class AdminIngestJob(admin.ModelAdmin):
+    list_display = ['id', 'file_name', 'status', 'parsed', 'inserted', 'skipped', 'embedded', 'created_at']
+
+@admin.register(Conversation)
+class AdminConversation(admin.ModelAdmin):
+    list_display = ['id', 'user', 'title', 'updated_at']
@@ -5,4 +5,6 @@ class ChatapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatapi'
 
+    def ready(self):
+        from . import signals  # noqa: F401
 
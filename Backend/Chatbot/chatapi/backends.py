@@ -0,0 +1,296 @@
+import logging
+import threading
+import time
+from typing import Any, Iterator, AsyncIterator, List, Optional
+
+import httpx
+from django.conf import settings
+from ollama import ResponseError
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from langchain_ollama import OllamaEmbeddings
+from langchain_ollama.llms import OllamaLLM
+
+
+logger = logging.getLogger(__name__)
+
+
+class NoHealthyBackend(Exception):
+    pass
+
+
+def is_retryable(error):
+    """Errors that mean the node is down or broken rather than the request being bad"""
+    if isinstance(error, (ConnectionError, httpx.TransportError)):
+        return True
+    return isinstance(error, ResponseError) and error.status_code >= 500
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.in_flight = 0
+        self.healthy = True
+        self.failures = 0
+
+    def __repr__(self):
+        state = "up" if self.healthy else "down"
+        return f"<Endpoint {self.url} {state} in_flight={self.in_flight}>"
+
+
+class BackendPool:
+    """
+    A set of Ollama endpoints. Requests go to the healthy endpoint with the
+    fewest in-flight requests. An endpoint is ejected after
+    `failure_threshold` consecutive failures and re-admitted once a health
+    probe (GET /api/tags) succeeds again.
+    """
+
+    def __init__(self, name, urls, probe_interval=10.0, failure_threshold=3, probe_timeout=2.0):
+        if not urls:
+            raise ValueError(f"Backend pool '{name}' needs at least one URL")
+        self.name = name
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._prober = None
+
+    def _ensure_prober(self):
+        if self._prober is None and self.probe_interval > 0:
+            self._prober = threading.Thread(target=self._probe_loop, name=f"{self.name}-health", daemon=True)
+            self._prober.start()
+
+    def acquire(self, exclude=()):
+        """Reserve the least-loaded healthy endpoint, not counting `exclude`"""
+        with self._lock:
+            self._ensure_prober()
+            candidates = [e for e in self.endpoints if e.healthy and e not in exclude]
+            if not candidates:
+                # Everything is marked down; try an ejected node rather than failing outright
+                candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                raise NoHealthyBackend(f"No {self.name} backend available")
+            endpoint = min(candidates, key=lambda e: e.in_flight)
+            endpoint.in_flight += 1
+            return endpoint
+
+    def release(self, endpoint):
+        with self._lock:
+            endpoint.in_flight -= 1
+
+    def mark_success(self, endpoint):
+        with self._lock:
+            endpoint.failures = 0
+            if not endpoint.healthy:
+                endpoint.healthy = True
+                logger.info(f"[BACKEND] {self.name} {endpoint.url} re-admitted")
+
+    def mark_failure(self, endpoint):
+        with self._lock:
+            endpoint.failures += 1
+            if endpoint.healthy and endpoint.failures >= self.failure_threshold:
+                endpoint.healthy = False
+                logger.warning(f"[BACKEND] {self.name} {endpoint.url} ejected after {endpoint.failures} failures")
+
+    def probe(self, endpoint):
+        try:
+            response = httpx.get(f"{endpoint.url}/api/tags", timeout=self.probe_timeout)
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            self.mark_success(endpoint)
+        else:
+            # A failed probe ejects straight away; the threshold is for request errors
+            with self._lock:
+                endpoint.failures = max(endpoint.failures, self.failure_threshold)
+            self.mark_failure(endpoint)
+        return ok
+
+    def probe_all(self):
+        return {endpoint.url: self.probe(endpoint) for endpoint in self.endpoints}
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe_all()
+            except Exception:
+                logger.exception(f"[BACKEND] {self.name} health probe failed")
+
+    def status(self):
+        with self._lock:
+            return [
+                {"url": e.url, "healthy": e.healthy, "in_flight": e.in_flight, "failures": e.failures}
+                for e in self.endpoints
+            ]
+
+
+class PooledOllamaLLM(LLM):
+    """
+    OllamaLLM spread over a BackendPool. A request that fails with a
+    connection error before the first token is retried on another node;
+    once tokens have been sent the error is raised as usual.
+    """
+
+    pool: Any
+    model: str
+    model_kwargs: dict = {}
+    keep_alive: Optional[str] = None
+    clients: dict = {}
+
+    @property
+    def _llm_type(self):
+        return "pooled-ollama"
+
+    def _client(self, endpoint):
+        client = self.clients.get(endpoint.url)
+        if client is None:
+            client = OllamaLLM(model=self.model, model_kwargs=self.model_kwargs,
+                               keep_alive=self.keep_alive, base_url=endpoint.url)
+            self.clients[endpoint.url] = client
+        return client
+
+    def preload(self, timeout=300):
+        """Load the model into memory on every endpoint (an empty generate request)"""
+        loaded = 0
+        for endpoint in self.pool.endpoints:
+            try:
+                response = httpx.post(f"{endpoint.url}/api/generate",
+                                      json={"model": self.model, "keep_alive": self.keep_alive},
+                                      timeout=timeout)
+                response.raise_for_status()
+                self.pool.mark_success(endpoint)
+                loaded += 1
+            except httpx.HTTPError as e:
+                self.pool.mark_failure(endpoint)
+                logger.warning(f"[BACKEND] Could not preload {self.model} on {endpoint.url}: {e}")
+        if not loaded:
+            raise NoHealthyBackend(f"{self.model} could not be loaded on any backend")
+        return loaded
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs) -> Iterator[GenerationChunk]:
+        tried = []
+        while True:
+            endpoint = self.pool.acquire(exclude=tried)
+            started = False
+            try:
+                for token in self._client(endpoint).stream(prompt, stop=stop, **kwargs):
+                    started = True
+                    if run_manager:
+                        run_manager.on_llm_new_token(token)
+                    yield GenerationChunk(text=token)
+                self.pool.mark_success(endpoint)
+                return
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.pool.mark_failure(endpoint)
+                tried.append(endpoint)
+                if started or len(tried) >= len(self.pool.endpoints):
+                    raise
+                logger.warning(f"[BACKEND] {endpoint.url} failed before first token, retrying: {e}")
+            finally:
+                self.pool.release(endpoint)
+
+    async def _astream(self, prompt, stop=None, run_manager=None, **kwargs) -> AsyncIterator[GenerationChunk]:
+        tried = []
+        while True:
+            endpoint = self.pool.acquire(exclude=tried)
+            started = False
+            try:
+                async for token in self._client(endpoint).astream(prompt, stop=stop, **kwargs):
+                    started = True
+                    if run_manager:
+                        await run_manager.on_llm_new_token(token)
+                    yield GenerationChunk(text=token)
+                self.pool.mark_success(endpoint)
+                return
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.pool.mark_failure(endpoint)
+                tried.append(endpoint)
+                if started or len(tried) >= len(self.pool.endpoints):
+                    raise
+                logger.warning(f"[BACKEND] {endpoint.url} failed before first token, retrying: {e}")
+            finally:
+                self.pool.release(endpoint)
+
+
+class PooledEmbeddings(Embeddings):
+    """OllamaEmbeddings spread over a BackendPool, retrying failed calls on another node"""
+
+    def __init__(self, pool, model):
+        self.pool = pool
+        self.model = model
+        self._clients = {}
+
+    def _client(self, endpoint):
+        client = self._clients.get(endpoint.url)
+        if client is None:
+            client = OllamaEmbeddings(model=self.model, base_url=endpoint.url)
+            self._clients[endpoint.url] = client
+        return client
+
+    def preload(self):
+        """Load the embedding model on every endpoint"""
+        loaded = 0
+        for endpoint in self.pool.endpoints:
+            try:
+                self._client(endpoint).embed_query("warmup")
+                self.pool.mark_success(endpoint)
+                loaded += 1
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.pool.mark_failure(endpoint)
+                logger.warning(f"[BACKEND] Could not preload {self.model} on {endpoint.url}: {e}")
+        if not loaded:
+            raise NoHealthyBackend(f"{self.model} could not be loaded on any backend")
+        return loaded
+
+    def _run(self, method, *args):
+        tried = []
+        while True:
+            endpoint = self.pool.acquire(exclude=tried)
+            try:
+                result = getattr(self._client(endpoint), method)(*args)
+                self.pool.mark_success(endpoint)
+                return result
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.pool.mark_failure(endpoint)
+                tried.append(endpoint)
+                if len(tried) >= len(self.pool.endpoints):
+                    raise
+                logger.warning(f"[BACKEND] {endpoint.url} embedding failed, retrying: {e}")
+            finally:
+                self.pool.release(endpoint)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._run('embed_documents', texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._run('embed_query', text)
+
+
+llm_pool = BackendPool(
+    'llm',
+    settings.OLLAMA_LLM_URLS,
+    probe_interval=settings.OLLAMA_HEALTH_PROBE_SECONDS,
+    failure_threshold=settings.OLLAMA_FAILURE_THRESHOLD,
+)
+embedding_pool = BackendPool(
+    'embedding',
+    settings.OLLAMA_EMBED_URLS,
+    probe_interval=settings.OLLAMA_HEALTH_PROBE_SECONDS,
+    failure_threshold=settings.OLLAMA_FAILURE_THRESHOLD,
+)
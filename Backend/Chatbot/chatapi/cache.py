@@ -0,0 +1,197 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from . import kb_version
+from .embedding import normalize_text
+from .metrics import RETRIEVAL_CACHE_LOOKUPS
+
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticAnswerCache:
+    """
+    In-process LRU cache of final answers, looked up by cosine similarity
+    between question embeddings instead of exact text. Only answers to
+    prompts without chat history may be stored or served, since anything
+    else depends on the user's conversation. Answers are tagged with the KB
+    version they were generated under and only served under that version.
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=512):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (unit vector, answer, stored_at, kb version)
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _purge(self, now, version):
+        expired = [key for key, (_, _, stored_at, stored_version) in self._entries.items()
+                   if now - stored_at > self.ttl or stored_version != version]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, vector, version):
+        """Return the cached answer for the closest earlier question under KB `version`, or None"""
+        query = self._normalize(vector)
+        with self._lock:
+            self._purge(time.time(), version)
+
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            keys = list(self._entries.keys())
+            matrix = np.stack([self._entries[key][0] for key in keys])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(keys[best])
+            self.hits += 1
+            logger.info(f"[ANSWER CACHE] Hit with similarity={similarities[best]:.3f}")
+            return self._entries[keys[best]][1]
+
+    def store(self, vector, answer, version):
+        with self._lock:
+            self._entries[self._next_key] = (self._normalize(vector), answer, time.time(), version)
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        logger.info("[ANSWER CACHE] Cleared")
+
+
+answer_cache = SemanticAnswerCache(
+    threshold=settings.ANSWER_CACHE_THRESHOLD,
+    ttl=settings.ANSWER_CACHE_TTL,
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+)
+
+
+class RetrievalEntry:
+    """What retrieval produced for one question under one KB version"""
+
+    # Distinct token budgets whose assembled context is kept per entry
+    MAX_CONTEXTS = 4
+
+    def __init__(self, key, version, vector, docs):
+        self.key = key
+        self.version = version
+        self.vector = np.asarray(vector, dtype=np.float32)
+        self.docs = docs   # [(Document, similarity)], best first
+        self.contexts = OrderedDict()   # token budget -> context string
+        self.size = self.vector.nbytes + sum(
+            256 + len(doc.page_content) + len(doc.metadata.get('answer', '')) for doc, _ in docs
+        )
+
+
+class RetrievalCache:
+    """
+    In-process LRU of retrieval results keyed by normalized question: the
+    question vector, the ranked (document, similarity) pairs and the contexts
+    assembled from them. Unlike the answer cache it pays off when chat history
+    makes every answer unique, since it skips the embedding, the vector search
+    and the context assembly. Entries are tagged with the KB version they were
+    built under and never served once it has moved. Eviction keeps the
+    estimated size under max_bytes.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, enabled=True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.bytes = 0
+        self._entries = OrderedDict()   # normalized question -> RetrievalEntry
+        self._lock = threading.Lock()
+
+    def get(self, question, version):
+        """The entry for `question` if it was built under `version`, the current KB version"""
+        if not self.enabled:
+            return None
+        key = normalize_text(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version != version:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                RETRIEVAL_CACHE_LOOKUPS.inc(result='miss')
+                return None
+            self._entries.move_to_end(key)
+        RETRIEVAL_CACHE_LOOKUPS.inc(result='hit')
+        return entry
+
+    def put(self, question, vector, docs, version):
+        """
+        Store results computed under `version` (read before the search started,
+        so results racing a KB change are never served as current)
+        """
+        key = normalize_text(question)
+        entry = RetrievalEntry(key, version, vector, docs)
+        if not self.enabled:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.bytes += entry.size
+            self._evict()
+        return entry
+
+    def add_context(self, entry, budget, context):
+        with self._lock:
+            cached = self._entries.get(entry.key) is entry
+            entry.contexts[budget] = context
+            added = len(context)
+            while len(entry.contexts) > RetrievalEntry.MAX_CONTEXTS:
+                added -= len(entry.contexts.popitem(last=False)[1])
+            entry.size += added
+            if cached:
+                self.bytes += added
+                self._evict()
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key).size
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+        logger.info("[RETRIEVAL CACHE] Cleared")
+
+
+retrieval_cache = RetrievalCache(
+    max_bytes=settings.RETRIEVAL_CACHE_MAX_MB * 1024 * 1024,
+    enabled=settings.RETRIEVAL_CACHE_ENABLED,
+)
+
+# This process saw the shared KB version move (see kb_version.current): answers and
+# retrieval results may rest on stale documents, so free them now instead of on lookup
+kb_version.on_change(lambda version: answer_cache.clear())
+kb_version.on_change(lambda version: retrieval_cache.clear())
@@ -0,0 +1,110 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from .metrics import CHAT_STAGE_SECONDS
+from .models import ChatMessage, Conversation
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChatLogWriter:
+    """
+    One background thread that stores chat exchanges for this process. Streams
+    hand their exchange over and return at once; the writer commits whatever
+    has queued up in a single transaction, so SQLite sees one writer doing few
+    large commits instead of many streams fighting over the write lock.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._pending = {}   # user id -> exchanges queued but not yet committed
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, user, question, reply, conversation=None, truncated=False):
+        with self._cond:
+            self._pending[user.pk] = self._pending.get(user.pk, 0) + 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='chat-log-writer', daemon=True)
+                self._thread.start()
+        self._queue.put((user.pk, conversation.pk if conversation else None, question, reply, truncated))
+
+    def pending(self, user_id):
+        return self._pending.get(user_id, 0)
+
+    def wait_for(self, user_id, timeout=None):
+        """Block until the user's queued exchanges are stored, so history reads see them"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending.get(user_id), timeout)
+
+    def flush(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < settings.CHAT_LOG_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._store(batch)
+            finally:
+                with self._cond:
+                    for user_id, *_ in batch:
+                        self._pending[user_id] -= 1
+                        if not self._pending[user_id]:
+                            del self._pending[user_id]
+                    self._cond.notify_all()
+
+    def _store(self, batch):
+        """Write a batch, retrying with backoff; then save what can be saved row by row"""
+        for attempt in range(settings.CHAT_LOG_RETRIES):
+            try:
+                self._write(batch)
+                return
+            except Exception as e:
+                logger.warning(f"[CHAT LOG] Writing {len(batch)} exchange(s) failed, attempt {attempt + 1}: {str(e)}")
+                connections.close_all()
+                if attempt + 1 < settings.CHAT_LOG_RETRIES:
+                    time.sleep(settings.CHAT_LOG_RETRY_SECONDS * 2 ** attempt)
+
+        # A single bad exchange would fail the batch every time, so keep the others
+        for exchange in batch:
+            try:
+                self._write([exchange])
+            except Exception as e:
+                logger.error(f"[CHAT LOG ERROR] Dropped exchange for user {exchange[0]}: {str(e)}")
+                connections.close_all()
+
+    def _write(self, batch):
+        rows = []
+        for user_id, conversation_id, question, reply, truncated in batch:
+            rows.append(ChatMessage(user_id=user_id, conversation_id=conversation_id, role="user", content=question))
+            rows.append(ChatMessage(user_id=user_id, conversation_id=conversation_id, role="assistant",
+                                    content=reply, truncated=truncated))
+        conversation_ids = {conversation_id for _, conversation_id, *_ in batch if conversation_id}
+
+        for conn in connections.all(initialized_only=True):
+            conn.close_if_unusable_or_obsolete()
+        with CHAT_STAGE_SECONDS.time(stage="persist_batch"), transaction.atomic():
+            ChatMessage.objects.bulk_create(rows)
+            if conversation_ids:
+                Conversation.objects.filter(pk__in=conversation_ids).update(updated_at=timezone.now())
+
+
+chat_log_writer = ChatLogWriter()
+
+
+@atexit.register
+def _flush_on_exit():
+    if not chat_log_writer.flush(timeout=5):
+        logger.warning("[CHAT LOG] Exiting with unsaved chat messages")
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import threading
+import logging
+from .embedding import normalize_text
+
+
+logger = logging.getLogger(__name__)
+
+
+class FlightAborted(Exception):
+    """The generation stopped before finishing its reply"""
+
+
+def flight_key(question, context):
+    """Identical prompts: same normalized question over the same retrieved context"""
+    return hashlib.sha256(f"{normalize_text(question)}\0{context}".encode('utf-8')).hexdigest()
+
+
+class Flight:
+    """
+    One in-progress generation that other requests can subscribe to. Its
+    producer publishes tokens as they arrive; readers replay everything
+    published so far and then follow along, from threads or asyncio tasks.
+    The request that created the flight is its first reader.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.tokens = []
+        self.reply = None
+        self.done = False
+        self.failed = False
+        self.subscribers = 0
+        self.readers = 1   # requests still reading, counting the leader
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, event in list(self._async_waiters):
+            loop.call_soon_threadsafe(event.set)
+
+    def add_reader(self):
+        """Join as another reader; False once the flight is over or nobody reads it"""
+        with self._cond:
+            if self.done or not self.readers:
+                return False
+            self.readers += 1
+            self.subscribers += 1
+            return True
+
+    def detach(self):
+        """A reader is done with the flight, because it finished or its client left"""
+        with self._cond:
+            self.readers -= 1
+
+    @property
+    def abandoned(self):
+        return self.readers <= 0
+
+    def publish(self, token):
+        with self._cond:
+            self.tokens.append(token)
+            self._notify()
+
+    def finish(self, reply):
+        """Close the flight with the final (cleaned) reply that subscribers store"""
+        with self._cond:
+            self.reply = reply
+            self.done = True
+            self._notify()
+
+    def abort(self):
+        with self._cond:
+            if not self.done:
+                self.failed = True
+                self.done = True
+                self._notify()
+
+    def _take(self, index):
+        """New tokens from `index` and whether the flight is over (lock held)"""
+        return self.tokens[index:], self.done and index >= len(self.tokens)
+
+    def follow(self, poll_seconds=1.0):
+        """Yield the reply token by token; raise FlightAborted if the generation failed"""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.tokens) and not self.done:
+                    self._cond.wait(poll_seconds)
+                tokens, over = self._take(index)
+                failed = self.failed
+            if over:
+                if failed:
+                    raise FlightAborted()
+                return
+            index += len(tokens)
+            yield from tokens
+
+    async def afollow(self, poll_seconds=1.0):
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        self._async_waiters.add(waiter)
+        try:
+            index = 0
+            while True:
+                with self._cond:
+                    tokens, over = self._take(index)
+                    failed = self.failed
+                    waiting = not tokens and not over
+                    if waiting:
+                        event.clear()
+                if over:
+                    if failed:
+                        raise FlightAborted()
+                    return
+                if waiting:
+                    try:
+                        await asyncio.wait_for(event.wait(), poll_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                index += len(tokens)
+                for token in tokens:
+                    yield token
+        finally:
+            self._async_waiters.discard(waiter)
+
+
+class SingleFlight:
+    """Registry of in-progress generations keyed by prompt fingerprint (per process)"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """
+        Return (flight, is_leader). Every caller detach()es when done; the
+        leader either starts the flight's producer, which finishes or aborts
+        it and then leave()s, or aborts it and leave()s itself.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.add_reader():
+                return flight, False
+            flight = Flight(key)
+            self._flights[key] = flight
+            return flight, True
+
+    def leave(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if flight.subscribers:
+            logger.info(f"[COALESCE] {flight.subscribers} request(s) shared one generation")
+
+    def __len__(self):
+        return len(self._flights)
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,94 @@
+import re
+import logging
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to roughly max_tokens, on a word boundary where possible"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(' ')
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut.rstrip() + " ..."
+
+
+def _word_set(text):
+    return set(_WORD.findall(text.lower()))
+
+
+def _is_near_duplicate(words, answer, kept):
+    for kept_words, kept_answer in kept:
+        if answer and answer == kept_answer:
+            return True
+        union = words | kept_words
+        if union and len(words & kept_words) / len(union) >= settings.CONTEXT_DEDUP_JACCARD:
+            return True
+    return False
+
+
+def context_budget(question, history_messages):
+    """Tokens left for retrieved context once the template, question and history are counted"""
+    used = settings.PROMPT_TEMPLATE_TOKENS + estimate_tokens(question)
+    used += sum(estimate_tokens(msg.content) for msg in history_messages)
+    return max(settings.PROMPT_TOKEN_BUDGET - used, settings.CONTEXT_MIN_TOKENS)
+
+
+def assemble_context(relevant_docs, budget):
+    """
+    Build the context block from (document, similarity) pairs, best first:
+    drop near-duplicates, cap each answer, and stop once the budget is spent.
+    """
+    blocks = []
+    kept = []
+    used = 0
+    cut = 0
+    dropped = 0
+
+    for doc, similarity in relevant_docs:
+        question = doc.page_content
+        answer = doc.metadata.get('answer', '')
+        words = _word_set(question)
+        normalized_answer = " ".join(answer.lower().split())
+
+        if _is_near_duplicate(words, normalized_answer, kept):
+            dropped += 1
+            cut += estimate_tokens(question) + estimate_tokens(answer)
+            continue
+
+        trimmed = truncate_to_tokens(answer, settings.CONTEXT_MAX_ANSWER_TOKENS)
+        block = f"Content: {question}\nAnswer: {trimmed}"
+        cost = estimate_tokens(block)
+
+        if used + cost > budget:
+            remaining = budget - used - estimate_tokens(f"Content: {question}\nAnswer: ")
+            if blocks or remaining < settings.CONTEXT_MIN_ANSWER_TOKENS:
+                dropped += 1
+                cut += estimate_tokens(question) + estimate_tokens(answer)
+                continue
+            # Always keep something of the best match
+            trimmed = truncate_to_tokens(answer, remaining)
+            block = f"Content: {question}\nAnswer: {trimmed}"
+            cost = estimate_tokens(block)
+
+        cut += estimate_tokens(answer) - estimate_tokens(trimmed)
+        blocks.append(block)
+        kept.append((words, normalized_answer))
+        used += cost
+
+    if relevant_docs:
+        logger.info(f"[CONTEXT] {len(blocks)} docs, {used}/{budget} tokens used, "
+                    f"{cut} tokens cut, {dropped} docs dropped")
+    return "\n".join(blocks)
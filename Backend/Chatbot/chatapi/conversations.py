@@ -0,0 +1,86 @@
+import base64
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import Conversation, ChatMessage
+
+
+def _new_conversation_cutoff():
+    return timezone.now() - timedelta(minutes=settings.CONVERSATION_IDLE_MINUTES)
+
+
+def resolve_conversation(user, conversation_id, question):
+    """
+    The conversation a chat request belongs to. An explicit id must be one of
+    the user's conversations (Conversation.DoesNotExist otherwise); without
+    one, the user's latest conversation continues unless it has been idle for
+    CONVERSATION_IDLE_MINUTES, in which case a new one is started.
+    """
+    if conversation_id:
+        return Conversation.objects.get(pk=conversation_id, user=user)
+
+    latest = (Conversation.objects.filter(user=user, updated_at__gte=_new_conversation_cutoff())
+              .order_by('-updated_at', '-id').first())
+    return latest or Conversation.objects.create(user=user, title=question[:200])
+
+
+async def aresolve_conversation(user, conversation_id, question):
+    if conversation_id:
+        return await Conversation.objects.aget(pk=conversation_id, user=user)
+
+    latest = await (Conversation.objects.filter(user=user, updated_at__gte=_new_conversation_cutoff())
+                    .order_by('-updated_at', '-id').afirst())
+    return latest or await Conversation.objects.acreate(user=user, title=question[:200])
+
+
+def encode_cursor(moment, pk):
+    raw = f"{moment.isoformat()}|{pk}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(datetime, id) from an opaque cursor; ValueError if it was tampered with"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        moment, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(moment), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+
+
+def page_size(requested):
+    """Requested page size clamped to HISTORY_MAX_PAGE_SIZE; ValueError if not a number"""
+    if requested in (None, ''):
+        return settings.HISTORY_PAGE_SIZE
+    return max(1, min(int(requested), settings.HISTORY_MAX_PAGE_SIZE))
+
+
+def _keyset_page(queryset, field, cursor, limit):
+    """
+    Newest-first page after `cursor` on (field, id). The seek predicate and
+    ordering match a composite index, so each page costs the same however far
+    back it is.
+    """
+    if cursor:
+        moment, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f"{field}__lt": moment}) | Q(**{field: moment, "id__lt": pk}))
+
+    rows = list(queryset.order_by(f"-{field}", "-id")[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].pk)
+    return rows, next_cursor
+
+
+def message_page(conversation, cursor=None, limit=None):
+    """Messages of a conversation, newest first, and the cursor for the older page"""
+    queryset = ChatMessage.objects.filter(conversation=conversation).only('id', 'role', 'content', 'truncated', 'timestemp')
+    return _keyset_page(queryset, 'timestemp', cursor, limit or settings.HISTORY_PAGE_SIZE)
+
+
+def conversation_page(user, cursor=None, limit=None):
+    """The user's conversations, most recently active first"""
+    queryset = Conversation.objects.filter(user=user)
+    return _keyset_page(queryset, 'updated_at', cursor, limit or settings.HISTORY_PAGE_SIZE)
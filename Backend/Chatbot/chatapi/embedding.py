@@ -1,4 +1,218 @@
-from langchain_ollama import OllamaEmbeddings
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+from .backends import PooledEmbeddings, embedding_pool
 # from langchain.embeddings import OpenAIEmbeddings
 
-embeddings = OllamaEmbeddings(model="nomic-embed-text")
\ No newline at end of file
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "nomic-embed-text"
+
+
+def normalize_text(text):
+    """Collapse whitespace and case so trivially different questions share a key"""
+    return " ".join(text.split()).casefold()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Two-tier cache in front of an embeddings model: an in-process LRU, then an
+    on-disk SQLite store shared by every worker. Keys are the model name plus a
+    hash of the normalized text, so a question or KB entry is embedded once.
+    """
+
+    def __init__(self, underlying, model_name, path, memory_entries=4096, disk_entries=200000):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.path = str(path)
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+
+    def _key(self, text):
+        digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_used_at ON embeddings (used_at)")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, vector):
+        """Keep the vector as float32 (half the size of a float list); callers get lists back"""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        """Return {key: vector} for every key found in either tier"""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self.memory_hits += 1
+                else:
+                    missing.append(key)
+
+        if missing:
+            hit_keys = []
+            try:
+                db = self._db()
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        found[key] = vector
+                        self._remember(key, vector)
+                        hit_keys.append(key)
+                        self.disk_hits += 1
+                if hit_keys:
+                    now = time.time()
+                    with db:
+                        db.executemany("UPDATE embeddings SET used_at = ? WHERE key = ?",
+                                       [(now, key) for key in hit_keys])
+            except sqlite3.Error as e:
+                logger.warning(f"[EMBEDDING CACHE ERROR] {str(e)}")
+
+        return found
+
+    def _store(self, items):
+        for key, vector in items:
+            self._remember(key, vector)
+        try:
+            db = self._db()
+            now = time.time()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, used_at) VALUES (?, ?, ?)",
+                    [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items],
+                )
+            self._writes += len(items)
+            if self._writes >= 1000:
+                self._writes = 0
+                self._trim(db)
+        except sqlite3.Error as e:
+            logger.warning(f"[EMBEDDING CACHE ERROR] {str(e)}")
+
+    def _trim(self, db):
+        """Drop least recently used rows above the disk cap"""
+        with db:
+            db.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                "SELECT key FROM embeddings ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_entries,),
+            )
+
+    @staticmethod
+    def _as_list(vector):
+        return vector.tolist() if isinstance(vector, np.ndarray) else vector
+
+    def _split(self, texts):
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        # Embed each distinct missing text only once
+        pending = OrderedDict()
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+        self.misses += len(pending)
+        return keys, found, pending
+
+    def embed_documents(self, texts):
+        keys, found, pending = self._split(texts)
+        if pending:
+            vectors = self.underlying.embed_documents(list(pending.values()))
+            new_items = list(zip(pending.keys(), vectors))
+            self._store(new_items)
+            found.update(new_items)
+        return [self._as_list(found[key]) for key in keys]
+
+    def embed_query(self, text):
+        keys, found, pending = self._split([text])
+        if pending:
+            vector = self.underlying.embed_query(text)
+            self._store([(keys[0], vector)])
+            return vector
+        return found[keys[0]].tolist()
+
+    async def aembed_documents(self, texts):
+        keys, found, pending = self._split(texts)
+        if pending:
+            vectors = await self.underlying.aembed_documents(list(pending.values()))
+            new_items = list(zip(pending.keys(), vectors))
+            self._store(new_items)
+            found.update(new_items)
+        return [self._as_list(found[key]) for key in keys]
+
+    async def aembed_query(self, text):
+        keys, found, pending = self._split([text])
+        if pending:
+            vector = await self.underlying.aembed_query(text)
+            self._store([(keys[0], vector)])
+            return vector
+        return found[keys[0]].tolist()
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+        }
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings():
+    """Shared embeddings client, built on first use rather than at import"""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                base_embeddings = PooledEmbeddings(embedding_pool, model=EMBEDDING_MODEL)
+                if settings.EMBEDDING_CACHE_ENABLED:
+                    _embeddings = CachedEmbeddings(
+                        base_embeddings,
+                        model_name=EMBEDDING_MODEL,
+                        path=settings.EMBEDDING_CACHE_PATH,
+                        memory_entries=settings.EMBEDDING_CACHE_MEMORY_ENTRIES,
+                        disk_entries=settings.EMBEDDING_CACHE_DISK_ENTRIES,
+                    )
+                else:
+                    _embeddings = base_embeddings
+    return _embeddings
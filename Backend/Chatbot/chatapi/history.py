@@ -0,0 +1,139 @@
+import threading
+import logging
+from django.conf import settings
+from django.db import connections
+from chatapi.models import ChatMessage, ChatSummary
+from .context import estimate_tokens
+from .chatlog import chat_log_writer
+from .scheduler import generation_scheduler
+
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_TEMPLATE = """Update the running summary of a conversation between a Karachi University student and an assistant.
+Keep facts the student asked about and answers they were given. Reply with the new summary only.
+
+Current summary:
+{summary}
+
+New lines:
+{lines}
+
+New summary:"""
+
+# Conversations whose summary is currently being rebuilt in this process
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+
+def _trim_to_budget(summary, recent):
+    """Apply the token budget to a summary and newest-first messages"""
+    budget = settings.CHAT_HISTORY_TOKEN_BUDGET
+    if summary:
+        # The summary never takes more than half of the budget
+        summary = summary[:budget * 2]
+        budget -= estimate_tokens(summary)
+
+    messages = []
+    for msg in recent:
+        cost = estimate_tokens(msg.content)
+        if cost > budget:
+            break
+        budget -= cost
+        messages.append(msg)
+
+    messages.reverse()
+    return summary, messages
+
+
+def _recent_messages(conversation):
+    return (
+        ChatMessage.objects.filter(conversation=conversation)
+        .order_by('-timestemp', '-id')
+        .only('id', 'role', 'content')[:settings.CHAT_HISTORY_TURNS * 2]
+    )
+
+
+def load_chat_history(conversation):
+    """
+    Return (summary, messages) for the prompt: the conversation's rolling
+    summary plus its last CHAT_HISTORY_TURNS turns, oldest first, trimmed to
+    the token budget.
+    """
+    recent = list(_recent_messages(conversation))
+    summary = ChatSummary.objects.filter(conversation=conversation).values_list('summary', flat=True).first() or ''
+    return _trim_to_budget(summary, recent)
+
+
+async def aload_chat_history(conversation):
+    """Async ORM version of load_chat_history"""
+    recent = [msg async for msg in _recent_messages(conversation)]
+    summary = await ChatSummary.objects.filter(conversation=conversation).values_list('summary', flat=True).afirst() or ''
+    return _trim_to_budget(summary, recent)
+
+
+def update_chat_summary(conversation, llm):
+    """
+    Fold messages that have slid out of the conversation's verbatim window
+    into its stored summary. Runs only once CHAT_SUMMARY_BATCH_MESSAGES of
+    them have piled up, and only ever sends the previous summary plus the new
+    messages to the LLM.
+    """
+    window = settings.CHAT_HISTORY_TURNS * 2
+    row, _ = ChatSummary.objects.get_or_create(conversation=conversation, defaults={'user_id': conversation.user_id})
+
+    window_ids = list(
+        ChatMessage.objects.filter(conversation=conversation)
+        .order_by('-timestemp', '-id')
+        .values_list('id', flat=True)[:window]
+    )
+    if len(window_ids) < window:
+        return False
+
+    # Newest evicted messages first, capped so a long backlog never blows up the prompt
+    evicted = list(
+        ChatMessage.objects.filter(conversation=conversation, id__gt=row.last_message_id, id__lt=window_ids[-1])
+        .order_by('-timestemp', '-id')[:settings.CHAT_SUMMARY_BATCH_MESSAGES * 4]
+    )
+    evicted.reverse()
+    if len(evicted) < settings.CHAT_SUMMARY_BATCH_MESSAGES:
+        return False
+
+    lines = "\n".join(f"{msg.role}: {msg.content}" for msg in evicted)
+    # Summaries share the generation slots with chat replies
+    ticket = generation_scheduler.acquire(conversation.user_id, settings.LLM_QUEUE_POLL_SECONDS)
+    try:
+        result = llm.invoke(SUMMARY_TEMPLATE.format(summary=row.summary or "(none)", lines=lines))
+    finally:
+        generation_scheduler.release(ticket)
+    summary = result.content if hasattr(result, "content") else str(result)
+
+    row.summary = summary.strip()
+    row.last_message_id = evicted[-1].id
+    row.save(update_fields=['summary', 'last_message_id', 'updated_at'])
+    logger.info(f"[HISTORY] Summarized {len(evicted)} messages for conversation {conversation.pk}")
+    return True
+
+
+def schedule_summary_update(conversation, llm):
+    """Update the summary on a background thread so the SSE response can close"""
+    if not settings.CHAT_SUMMARY_ENABLED or conversation is None:
+        return
+
+    with _summarizing_lock:
+        if conversation.pk in _summarizing:
+            return
+        _summarizing.add(conversation.pk)
+
+    def run():
+        try:
+            chat_log_writer.wait_for(conversation.user_id, settings.CHAT_LOG_WAIT_SECONDS)
+            update_chat_summary(conversation, llm)
+        except Exception as e:
+            logger.warning(f"[HISTORY ERROR] {str(e)}")
+        finally:
+            with _summarizing_lock:
+                _summarizing.discard(conversation.pk)
+            connections.close_all()
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,275 @@
+import codecs
+import json
+import logging
+import re
+from contextlib import nullcontext
+from django.conf import settings
+from django.db import transaction
+from .models import KnowledgeBase, VectorSyncOutbox, compute_content_hash, compute_dedup_key
+from . import kb_version
+from .metrics import INGEST_STAGE_SECONDS,INGEST_ITEMS
+
+
+logger = logging.getLogger(__name__)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def prepare_pairs(items):
+    """
+    Strip, key and dedup (question, answer) pairs in memory. Returns the
+    unique pairs keyed by dedup_key plus the number of in-file duplicates;
+    pairs with both fields empty are dropped without being counted.
+    """
+    unique = {}
+    duplicates = 0
+    for item in items:
+        question = item.get('question','').strip()
+        answer = item.get('answer','').strip()
+
+        if not question and not answer:
+            continue
+
+        key = compute_dedup_key(question, answer)
+        if key in unique:
+            duplicates += 1
+        else:
+            unique[key] = (question, answer)
+    return unique, duplicates
+
+
+def insert_unique_pairs(unique):
+    """
+    Insert deduped pairs that are not in the DB yet, in chunks. Must run inside
+    a transaction. Returns (inserted, skipped_existing).
+    """
+    keys = list(unique)
+    chunk_size = settings.INGEST_CHUNK_SIZE
+    inserted = 0
+    skipped = 0
+
+    for chunk in _chunks(keys, chunk_size):
+        existing = set(
+            KnowledgeBase.objects.filter(dedup_key__in=chunk).values_list('dedup_key', flat=True)
+        )
+        skipped += len(existing)
+
+        new_entries = []
+        for key in chunk:
+            if key in existing:
+                continue
+            question, answer = unique[key]
+            new_entries.append(KnowledgeBase(
+                question=question,
+                answer=answer,
+                dedup_key=key,
+                content_hash=compute_content_hash(question, answer),
+            ))
+
+        # bulk_create skips post_save, so queue the vector sync directly
+        created = KnowledgeBase.objects.bulk_create(new_entries, batch_size=chunk_size)
+        VectorSyncOutbox.objects.bulk_create(
+            [VectorSyncOutbox(kb_id=entry.pk, action='upsert') for entry in created],
+            batch_size=chunk_size,
+        )
+        inserted += len(created)
+
+    return inserted, skipped
+
+
+class IngestError(Exception):
+    """Invalid upload content; `offset` is the item index (JSON) or line number (NDJSON)"""
+
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.message = message
+        self.offset = offset
+
+
+def validate_item(item, offset):
+    if not isinstance(item, dict):
+        raise IngestError('Invalid not a JSON object.', offset)
+
+    if 'question' not in item or 'answer' not in item:
+        raise IngestError("Missing 'question' or 'answer' in some items.", offset)
+
+
+def is_ndjson_upload(file):
+    name = (file.name or '').lower()
+    return name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in (getattr(file, 'content_type', '') or '')
+
+
+def _read_text(file, chunk_size):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+# A token cut off by the end of the buffer, e.g. `tru`, `1.` or an escape like `\u12`
+_PARTIAL_TOKEN = re.compile(r'[^\s,:\[\]{}"]*')
+
+
+def _cut_off(buffer, err):
+    """Whether a decode error only means the item runs past the end of the buffer"""
+    if err.pos >= len(buffer) or err.msg.startswith('Unterminated string'):
+        return True
+    return _PARTIAL_TOKEN.fullmatch(buffer, err.pos) is not None
+
+
+def iter_json_array(file, chunk_size=65536):
+    """Yield (index, item) from a top-level JSON array without loading it whole"""
+    decoder = json.JSONDecoder()
+    chunks = _read_text(file, chunk_size)
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        buffer = buffer[pos:]
+        pos = 0
+        for text in chunks:
+            if text:
+                buffer += text
+                return True
+        eof = True
+        return False
+
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ''
+
+    first = peek()
+    if not first:
+        raise IngestError('provided file is not json format', 0)
+    if first != '[':
+        raise IngestError('Json must be a list of objects')
+    pos += 1
+
+    index = 0
+    if peek() == ']':
+        return
+
+    while True:
+        if not peek():
+            raise IngestError('provided file is not json format', index)
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as err:
+                # Only read on when the item is incomplete, so a malformed item fails at once
+                if eof or not _cut_off(buffer, err):
+                    raise IngestError('provided file is not json format', index)
+                if not fill():
+                    raise IngestError('provided file is not json format', index)
+                continue
+            if eof or _PARTIAL_TOKEN.fullmatch(buffer, end) is None:
+                break
+            # A number decodes from its first digits (`12` of `1234`, `1` of `1.5`): decode again with more text
+            fill()
+        pos = end
+        yield index, item
+        index += 1
+
+        separator = peek()
+        if separator == ',':
+            pos += 1
+        elif separator == ']':
+            pos += 1
+            if peek():
+                raise IngestError('provided file is not json format', index)
+            return
+        else:
+            raise IngestError('provided file is not json format', index)
+
+
+def iter_ndjson(file):
+    """Yield (line number, item) for each non-blank line of an NDJSON/JSONL file"""
+    line_number = 0
+    pending = ''
+    for text in _read_text(file, 65536):
+        pending += text
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError:
+                    raise IngestError('provided file is not json format', line_number)
+    if pending.strip():
+        try:
+            yield line_number + 1, json.loads(pending)
+        except json.JSONDecodeError:
+            raise IngestError('provided file is not json format', line_number + 1)
+
+
+def iter_upload_items(file):
+    return iter_ndjson(file) if is_ndjson_upload(file) else iter_json_array(file)
+
+
+def validate_upload(file, progress=None, every=10000):
+    """Parse and validate the whole upload without writing; return the item count"""
+    parsed = 0
+    with INGEST_STAGE_SECONDS.time(stage="validate"):
+        for offset, item in iter_upload_items(file):
+            validate_item(item, offset)
+            parsed += 1
+            if progress and parsed % every == 0:
+                progress(parsed)
+    return parsed
+
+
+def ingest_upload(file, batch_size=None, atomic=True, progress=None):
+    """
+    Parse, validate and insert an uploaded JSON array or NDJSON file in
+    fixed-size batches, so memory stays flat however big the file is.
+
+    With atomic=True all batches share one transaction and an invalid item
+    anywhere rolls back the whole upload, as before. With atomic=False each
+    batch commits on its own and progress(inserted, skipped) is called after
+    it; callers should run validate_upload first. Returns (inserted, skipped).
+    """
+    batch_size = batch_size or settings.INGEST_STREAM_BATCH_SIZE
+    items = iter_upload_items(file)
+    inserted = 0
+    skipped = 0
+
+    def flush(batch):
+        nonlocal inserted, skipped
+        unique, duplicates = prepare_pairs(batch)
+        with transaction.atomic():
+            batch_inserted, batch_skipped = insert_unique_pairs(unique)
+        inserted += batch_inserted
+        skipped += duplicates + batch_skipped
+        if progress:
+            progress(inserted, skipped)
+
+    with INGEST_STAGE_SECONDS.time(stage="ingest"), transaction.atomic() if atomic else nullcontext():
+        batch = []
+        for offset, item in items:
+            validate_item(item, offset)
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+    INGEST_ITEMS.inc(inserted, result='inserted')
+    INGEST_ITEMS.inc(skipped, result='skipped')
+    if inserted:
+        # Drops cached answers in every process, not just this one
+        kb_version.bump()
+    logger.info(f"[INGEST] Inserted {inserted}, skipped {skipped}")
+    return inserted, skipped
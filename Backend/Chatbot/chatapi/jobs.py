@@ -0,0 +1,159 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import IngestJob, UploadRecord
+from .ingest import ingest_upload, validate_upload, IngestError
+from .utils import sync_new_entries_to_vector_store
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobTakenOver(Exception):
+    """Another worker claimed the job after this one's heartbeat went stale"""
+
+
+def create_ingest_job(file, user):
+    """Store the upload and queue it for the ingest worker"""
+    with transaction.atomic():
+        job = IngestJob.objects.create(file=file, file_name=file.name, uploaded_by=user)
+        UploadRecord.objects.create(
+            file_name=file.name,
+            uploaded_by=user,
+            inserted=0,
+            skipped=0,
+            job=job,
+        )
+    return job
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to running; None if there is nothing to do"""
+    while True:
+        job = IngestJob.objects.filter(status='queued').order_by('id').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = IngestJob.objects.filter(pk=job.pk, status='queued').update(
+            status='running', started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def requeue_stale_jobs():
+    """
+    Recover jobs left 'running' by a worker that died mid-job, judged by
+    their last heartbeat. Each job is moved with an update guarded on that
+    stale heartbeat, so a worker reporting progress meanwhile keeps its job.
+    Counts from the dead attempt are kept; see run_ingest_job. Returns
+    (requeued, failed).
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.INGEST_JOB_STALE_SECONDS)
+    requeued = 0
+    failed = 0
+
+    for job in IngestJob.objects.filter(status='running', heartbeat_at__lt=cutoff):
+        stale = IngestJob.objects.filter(pk=job.pk, status='running', attempts=job.attempts, heartbeat_at__lt=cutoff)
+        if job.attempts >= settings.INGEST_JOB_MAX_ATTEMPTS:
+            if stale.update(status='failed', error='The ingest worker stopped while processing this upload',
+                            finished_at=timezone.now()):
+                job.file.delete(save=False)
+                failed += 1
+        elif stale.update(status='queued', started_at=None, heartbeat_at=None):
+            requeued += 1
+
+    if requeued or failed:
+        logger.warning(f"[INGEST JOB] Stale running jobs: {requeued} requeued, {failed} failed")
+    return requeued, failed
+
+
+def run_ingest_job(job):
+    """
+    Validate the whole file first so bad input fails before anything is
+    written, then insert and embed in batches, saving progress after each.
+
+    Every write is guarded on this claim's attempt number: a worker whose
+    job was taken over after a stale heartbeat stops at its next progress
+    report instead of racing the new run. A rerun finds the rows of earlier
+    attempts already stored and counts them as skipped; they are moved back
+    to the inserted count here.
+    """
+    claim = IngestJob.objects.filter(pk=job.pk, attempts=job.attempts)
+    earlier_inserted = job.inserted
+
+    def beat(**fields):
+        if not claim.update(heartbeat_at=timezone.now(), **fields):
+            raise JobTakenOver()
+
+    def on_parsed(parsed):
+        beat(parsed=parsed)
+
+    def on_inserted(inserted, skipped):
+        inserted += earlier_inserted
+        skipped = max(skipped - earlier_inserted, 0)
+        beat(inserted=inserted, skipped=skipped)
+        UploadRecord.objects.filter(job=job).update(inserted=inserted, skipped=skipped)
+
+    def on_embedded(upserted):
+        beat(embedded=F('embedded') + upserted)
+
+    def finish(**fields):
+        """Record the outcome and drop the upload, which is not needed any more either way"""
+        if not claim.update(finished_at=timezone.now(), **fields):
+            raise JobTakenOver()
+        job.file.delete(save=False)
+
+    try:
+        try:
+            with job.file.open('rb') as file:
+                parsed = validate_upload(file, progress=on_parsed)
+                on_parsed(parsed)
+
+                file.seek(0)
+                inserted, _ = ingest_upload(file, atomic=False, progress=on_inserted)
+
+            if inserted and not sync_new_entries_to_vector_store(
+                    batch_size=settings.INGEST_EMBED_BATCH_SIZE, on_batch=on_embedded):
+                raise RuntimeError("Vector store sync failed, see logs")
+            outcome = {'status': 'done'}
+            logger.info(f"[INGEST JOB] {job.pk} done")
+
+        except IngestError as e:
+            outcome = {'status': 'failed', 'error': e.message, 'error_offset': e.offset}
+            logger.warning(f"[INGEST JOB] {job.pk} rejected: {e.message} at {e.offset}")
+
+        except JobTakenOver:
+            raise
+
+        except Exception as e:
+            outcome = {'status': 'failed', 'error': str(e)}
+            logger.exception(f"[INGEST JOB] {job.pk} failed")
+
+        finish(**outcome)
+
+    except JobTakenOver:
+        logger.warning(f"[INGEST JOB] {job.pk} was taken over by another worker, stopping this run")
+
+
+def job_progress(job):
+    return {
+        "job_id": job.pk,
+        "file_name": job.file_name,
+        "status": job.status,
+        "parsed": job.parsed,
+        "inserted": job.inserted,
+        "skipped": job.skipped,
+        "embedded": job.embedded,
+        "attempts": job.attempts,
+        "heartbeat_at": job.heartbeat_at,
+        "error": job.error or None,
+        "error_offset": job.error_offset,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db.models import F
+
+
+logger = logging.getLogger(__name__)
+
+# Version of the indexed knowledge base, kept in the KnowledgeBaseVersion row
+# so that every process (web workers, ingest worker, retrieval service) sees
+# the same number. Whichever process applies changes to the vector store
+# bumps it; the others notice on their next check and drop the caches tied
+# to it through on_change().
+_version = None     # last value read in this process
+_checked_at = 0.0
+_lock = threading.Lock()
+_listeners = []
+
+
+def _fresh():
+    return _version is not None and time.monotonic() - _checked_at < settings.KB_VERSION_CHECK_SECONDS
+
+
+def _query():
+    from .models import KnowledgeBaseVersion
+    return KnowledgeBaseVersion.objects.filter(pk=1).values_list('version', flat=True)
+
+
+def current():
+    """The shared version, re-read at most every KB_VERSION_CHECK_SECONDS"""
+    if _fresh():
+        return _version
+    return refresh()
+
+
+def refresh():
+    """Re-read the shared version now, e.g. after another process was asked to change it"""
+    return _observe(_query().first() or 0)
+
+
+async def acurrent():
+    """current() for async code, using the async ORM"""
+    if _fresh():
+        return _version
+    return _observe(await _query().afirst() or 0)
+
+
+def on_change(listener):
+    """Call listener(version) whenever the version moves; usable as a decorator"""
+    _listeners.append(listener)
+    return listener
+
+
+def _notify(version):
+    for listener in list(_listeners):
+        try:
+            listener(version)
+        except Exception as e:
+            logger.warning(f"[KB VERSION] Listener failed: {str(e)}")
+
+
+def _observe(version):
+    global _version, _checked_at
+    with _lock:
+        previous = _version
+        _version = version
+        _checked_at = time.monotonic()
+    if previous is not None and version != previous:
+        logger.info(f"[KB VERSION] Now {version}")
+        _notify(version)
+    return version
+
+
+def bump():
+    """Record a change to the index for every process; returns the new version"""
+    from .models import KnowledgeBaseVersion
+
+    if not KnowledgeBaseVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        KnowledgeBaseVersion.objects.get_or_create(pk=1)
+        KnowledgeBaseVersion.objects.filter(pk=1).update(version=F('version') + 1)
+    return _observe(_query().first())
@@ -0,0 +1,27 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from chatapi.jobs import claim_next_job, requeue_stale_jobs, run_ingest_job
+
+
+class Command(BaseCommand):
+    help = "Process queued knowledge-base upload jobs in the background"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Ingest worker started")
+        while True:
+            close_old_connections()
+            requeue_stale_jobs()
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(settings.INGEST_WORKER_POLL_SECONDS)
+                continue
+
+            self.stdout.write(f"Processing job {job.pk} ({job.file_name})")
+            run_ingest_job(job)
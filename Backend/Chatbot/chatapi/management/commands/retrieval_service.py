@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from chatapi.retrieval_service import serve
+
+
+class Command(BaseCommand):
+    help = "Serve vector searches for all web workers from one shared index over a Unix socket"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.RETRIEVAL_SERVICE_SOCKET,
+                            help="Socket path (default: RETRIEVAL_SERVICE_SOCKET)")
+        parser.add_argument('--sync-interval', type=float, default=None,
+                            help="Seconds between outbox checks for KB edits; 0 disables")
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError("Set RETRIEVAL_SERVICE_SOCKET or pass --socket")
+        self.stdout.write(f"Retrieval service starting on {options['socket']}")
+        try:
+            serve(options['socket'], sync_interval=options['sync_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Retrieval service stopped")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from chatapi.warmup import warmup
+
+
+class Command(BaseCommand):
+    help = "Load the Ollama models on every backend and bring the vector store up to date"
+
+    def handle(self, *args, **options):
+        try:
+            timings = warmup()
+        except Exception as e:
+            raise CommandError(f"Warmup failed: {e}")
+
+        for stage, took in timings.items():
+            self.stdout.write(f"{stage}: {took:.2f}s")
+        self.stdout.write(self.style.SUCCESS("Warmup complete"))
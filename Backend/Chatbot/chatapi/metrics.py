@@ -0,0 +1,198 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Latency buckets in seconds, from cache hits up to slow CPU generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the block, whether or not it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# Chat path
+CHAT_STAGE_SECONDS = Histogram(
+    "chatbot_chat_stage_seconds",
+    "Time spent in each stage of a chat request",
+    ["stage"],
+)
+CHAT_TOKENS_PER_SECOND = Histogram(
+    "chatbot_generation_tokens_per_second",
+    "LLM streaming rate after the first token",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 50, 100),
+)
+CHAT_RESPONSES = Counter(
+    "chatbot_chat_responses_total",
+    "Chat replies by where the answer came from",
+    ["source"],
+)
+CHAT_GENERATED_TOKENS = Counter(
+    "chatbot_generated_tokens_total",
+    "Tokens streamed from the LLM",
+)
+CHAT_CANCELLATIONS = Counter(
+    "chatbot_chat_cancellations_total",
+    "Chat streams abandoned by the client, by the stage they were in",
+    ["stage"],
+)
+CHAT_CANCELLED_TOKENS_AVOIDED = Counter(
+    "chatbot_cancelled_tokens_avoided_total",
+    "Upper bound on tokens not generated because the stream was cancelled",
+)
+CHAT_SSE_FRAMES = Counter(
+    "chatbot_sse_frames_total",
+    "SSE frames written to chat clients (compare with generated tokens for the batching ratio)",
+)
+RETRIEVAL_CACHE_LOOKUPS = Counter(
+    "chatbot_retrieval_cache_lookups_total",
+    "Retrieval cache lookups by result (hit or miss)",
+    ["result"],
+)
+
+# Upload and vector sync paths
+INGEST_STAGE_SECONDS = Histogram(
+    "chatbot_ingest_stage_seconds",
+    "Time spent parsing/inserting uploads and syncing the vector store",
+    ["stage"],
+)
+INGEST_ITEMS = Counter(
+    "chatbot_ingest_items_total",
+    "Uploaded Q&A pairs by outcome",
+    ["result"],
+)
+VECTOR_SYNC_DOCUMENTS = Counter(
+    "chatbot_vector_sync_documents_total",
+    "Documents written to or removed from the vector store",
+    ["action"],
+)
+
+
+class GenerationTimer:
+    """Records time to first token, total generation time and tokens/sec for one reply"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.tokens = 0
+
+    def token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            CHAT_STAGE_SECONDS.observe(self.first_token_at - self.started, stage="first_token")
+        self.tokens += 1
+
+    def finish(self):
+        """Record the totals and return the generation time in seconds"""
+        finished = time.perf_counter()
+        took = finished - self.started
+        CHAT_STAGE_SECONDS.observe(took, stage="generation")
+        CHAT_GENERATED_TOKENS.inc(self.tokens)
+        if self.tokens > 1 and finished > self.first_token_at:
+            CHAT_TOKENS_PER_SECOND.observe((self.tokens - 1) / (finished - self.first_token_at))
+        return took
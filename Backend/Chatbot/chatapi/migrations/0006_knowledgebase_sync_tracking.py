@@ -0,0 +1,55 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:36
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_content_hash(apps, schema_editor):
+    # synced_hash stays empty, so the next sync re-pushes every row once and
+    # fixes any answers that were edited while sync was add-only.
+    KnowledgeBase = apps.get_model('chatapi', 'KnowledgeBase')
+    batch = []
+    for entry in KnowledgeBase.objects.only('id', 'question', 'answer').iterator():
+        entry.content_hash = hashlib.sha256(f"{entry.question}\0{entry.answer}".encode('utf-8')).hexdigest()
+        batch.append(entry)
+        if len(batch) >= 1000:
+            KnowledgeBase.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        KnowledgeBase.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapi', '0005_chatsummary_chatmessage_user_timestemp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VectorSyncOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kb_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='content_hash',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='synced_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
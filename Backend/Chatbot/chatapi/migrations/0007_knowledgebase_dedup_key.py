@@ -0,0 +1,45 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_dedup_key(apps, schema_editor):
+    # Rows that already duplicate an earlier pair keep a NULL key so the
+    # unique constraint can be added without deleting data.
+    KnowledgeBase = apps.get_model('chatapi', 'KnowledgeBase')
+    seen = set()
+    batch = []
+    for entry in KnowledgeBase.objects.only('id', 'question', 'answer').order_by('id').iterator():
+        normalized = f"{entry.question.strip().lower()}\0{entry.answer.strip().lower()}"
+        key = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        if key in seen:
+            continue
+        seen.add(key)
+        entry.dedup_key = key
+        batch.append(entry)
+        if len(batch) >= 1000:
+            KnowledgeBase.objects.bulk_update(batch, ['dedup_key'])
+            batch = []
+    if batch:
+        KnowledgeBase.objects.bulk_update(batch, ['dedup_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapi', '0006_knowledgebase_sync_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='dedup_key',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_dedup_key, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='knowledgebase',
+            name='dedup_key',
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
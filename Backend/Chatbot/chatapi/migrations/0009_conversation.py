@@ -0,0 +1,53 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+
+def group_existing_messages(apps, schema_editor):
+    # Earlier messages had no grouping; give each user one conversation holding them
+    ChatMessage = apps.get_model('chatapi', 'ChatMessage')
+    Conversation = apps.get_model('chatapi', 'Conversation')
+    per_user = (ChatMessage.objects.filter(conversation__isnull=True)
+                .values('user_id').annotate(first=Min('timestemp'), last=Max('timestemp')))
+    for row in per_user:
+        conversation = Conversation.objects.create(user_id=row['user_id'], title='Earlier messages')
+        Conversation.objects.filter(pk=conversation.pk).update(created_at=row['first'], updated_at=row['last'])
+        ChatMessage.objects.filter(user_id=row['user_id'], conversation__isnull=True).update(conversation=conversation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapi', '0008_ingestjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(blank=True, default='', max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chatapi.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['conversation', 'timestemp', 'id'], name='chatapi_cha_convers_30dc5d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='chatapi_con_user_id_6c5819_idx'),
+        ),
+        migrations.RunPython(group_existing_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapi', '0009_conversation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='truncated',
+            field=models.BooleanField(default=False),
+        ),
+    ]
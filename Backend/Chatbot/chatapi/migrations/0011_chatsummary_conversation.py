@@ -0,0 +1,50 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def attach_summaries(apps, schema_editor):
+    # Summaries used to cover all of a user's messages; move each onto the
+    # conversation holding the newest message it folded in, else the latest one
+    ChatSummary = apps.get_model('chatapi', 'ChatSummary')
+    ChatMessage = apps.get_model('chatapi', 'ChatMessage')
+    Conversation = apps.get_model('chatapi', 'Conversation')
+    for row in ChatSummary.objects.all():
+        conversation_id = (ChatMessage.objects.filter(pk=row.last_message_id, user_id=row.user_id)
+                           .values_list('conversation_id', flat=True).first())
+        if conversation_id is None:
+            conversation_id = (Conversation.objects.filter(user_id=row.user_id)
+                               .order_by('-updated_at', '-id').values_list('id', flat=True).first())
+        if conversation_id is None:
+            row.delete()
+        else:
+            ChatSummary.objects.filter(pk=row.pk).update(conversation_id=conversation_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapi', '0010_chatmessage_truncated'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsummary',
+            name='conversation',
+            field=models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='chatapi.conversation'),
+        ),
+        migrations.AlterField(
+            model_name='chatsummary',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_summaries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(attach_summaries, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chatsummary',
+            name='conversation',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='chatapi.conversation'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+def create_version_row(apps, schema_editor):
+    apps.get_model('chatapi', 'KnowledgeBaseVersion').objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapi', '0011_chatsummary_conversation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeBaseVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
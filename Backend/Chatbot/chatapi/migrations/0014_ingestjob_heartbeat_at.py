@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:53
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def seed_heartbeats(apps, schema_editor):
+    # Jobs already running count as alive from when they started
+    IngestJob = apps.get_model('chatapi', 'IngestJob')
+    IngestJob.objects.filter(status='running').update(heartbeat_at=F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapi', '0013_ingestjob_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(seed_heartbeats, migrations.RunPython.noop),
+    ]
@@ -1,29 +1,144 @@
+import hashlib
+from django.core.exceptions import ValidationError
 from django.db import models
 from user.models import User
 # Create your models here.
 
+def compute_content_hash(question, answer):
+    return hashlib.sha256(f"{question}\0{answer}".encode('utf-8')).hexdigest()
+
+def compute_dedup_key(question, answer):
+    """Case-insensitive identity of a Q&A pair, matching the old iexact duplicate check"""
+    return compute_content_hash(question.strip().lower(), answer.strip().lower())
+
+
 class KnowledgeBase(models.Model):
     question = models.TextField()
     answer = models.TextField()
+    dedup_key = models.CharField(max_length=64, unique=True, null=True, editable=False)
+    content_hash = models.CharField(max_length=64, default='', editable=False)
+    synced_hash = models.CharField(max_length=64, default='', blank=True, editable=False)  # content_hash last pushed to the vector store
+    synced_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    def validate_unique(self, exclude=None):
+        # dedup_key is not a form field, so ModelForm would leave its unique check to the database
+        super().validate_unique(exclude)
+        key = compute_dedup_key(self.question, self.answer)
+        if KnowledgeBase.objects.filter(dedup_key=key).exclude(pk=self.pk).exists():
+            raise ValidationError({'question': 'This question and answer are already in the knowledge base '
+                                               '(ignoring case and surrounding spaces).'})
+
+    def save(self, *args, **kwargs):
+        self.content_hash = compute_content_hash(self.question, self.answer)
+        self.dedup_key = compute_dedup_key(self.question, self.answer)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('question' in update_fields or 'answer' in update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'content_hash', 'dedup_key'}
+        super().save(*args, **kwargs)
+
+
+class VectorSyncOutbox(models.Model):
+    """KnowledgeBase changes not yet applied to the vector store"""
+    ACTION_CHOICES = [('upsert','Upsert'),('delete','Delete')]
+
+    kb_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+
+        return f'{self.action} {self.kb_id}'
+
+
+class KnowledgeBaseVersion(models.Model):
+    """Single row counting changes applied to the vector index, read by every process"""
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+
+        return f'KB version {self.version}'
   
 
+class IngestJob(models.Model):
+    STATUS_CHOICES = [('queued','Queued'),('running','Running'),('done','Done'),('failed','Failed')]
+
+    file = models.FileField(upload_to='ingest_jobs/')
+    file_name = models.CharField(max_length=200)
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ingest_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    parsed = models.PositiveIntegerField(default=0)
+    inserted = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    embedded = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)   # times a worker has claimed the job
+    heartbeat_at = models.DateTimeField(null=True, blank=True)   # last progress report from the worker running it
+    error = models.TextField(blank=True, default='')
+    error_offset = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+
+        return f'{self.file_name} - {self.status}'
+
+
 class UploadRecord(models.Model):
     file_name= models.CharField(max_length=200)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     inserted = models.PositiveIntegerField()
     skipped = models.PositiveIntegerField()
+    job = models.OneToOneField(IngestJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_record')
 
 
     def __str__(self):
 
         return f'{self.file_name} - {self.uploaded_by} - {self.uploaded_at}'
     
+class Conversation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
+    title = models.CharField(max_length=200, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'updated_at', 'id'])]
+
+    def __str__(self):
+
+        return f'{self.user} - {self.title}'
+
+
 class ChatMessage(models.Model):
     ROLE_CHOICES = [('user','User'),('assistant','Assistant')]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_messages')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, null=True, blank=True, related_name='messages')
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
     content = models.TextField()
+    truncated = models.BooleanField(default=False)   # reply cut short because the client disconnected
     timestemp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestemp']),
+            models.Index(fields=['conversation', 'timestemp', 'id']),
+        ]
+
+
+class ChatSummary(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_summaries')
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, related_name='summary')
+    summary = models.TextField(blank=True, default='')
+    last_message_id = models.PositiveBigIntegerField(default=0)   # newest ChatMessage folded into summary
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+
+        return f'{self.conversation} - summary until {self.last_message_id}'
     
\ No newline at end of file
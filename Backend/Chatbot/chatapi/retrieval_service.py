@@ -0,0 +1,242 @@
+"""
+Shared retrieval service: one process owns the vector index and every web
+worker queries it over a Unix socket, so the index is held in memory once
+instead of once per worker.
+
+Enable it by setting RETRIEVAL_SERVICE_SOCKET for the workers and the service
+(`python manage.py retrieval_service`). The service applies all vector store
+changes itself, including outbox rows left by KB edits in other processes, and
+bumps the shared KB version (chatapi/kb_version.py) when it does, which is
+how workers learn to drop their derived caches.
+
+Protocol: one JSON object per line in each direction. Vectors travel as
+base64-encoded float32.
+"""
+import base64
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from langchain_core.documents import Document
+
+
+logger = logging.getLogger(__name__)
+
+# True inside the service process, which must use the local index itself
+_serving = False
+
+
+class RetrievalServiceError(Exception):
+    pass
+
+
+def client_mode():
+    """Whether this process should query the retrieval service instead of a local index"""
+    return bool(settings.RETRIEVAL_SERVICE_SOCKET) and not _serving
+
+
+def _encode_vector(vector):
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode('ascii')
+
+
+def _decode_vector(data):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).tolist()
+
+
+def _encode_results(results):
+    return [[doc.id, doc.page_content, doc.metadata, float(score)] for doc, score in results]
+
+
+def _decode_results(rows):
+    return [(Document(page_content=text, metadata=metadata, id=doc_id), score)
+            for doc_id, text, metadata, score in rows]
+
+
+# --- client ---------------------------------------------------------------
+
+class RemoteVectorStore:
+    """
+    Client side of the retrieval service. Exposes the subset of the vector
+    store API that utils.py searches with; each thread keeps its own
+    connection and reconnects once if the service was restarted.
+    """
+
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.timeout = settings.RETRIEVAL_SERVICE_TIMEOUT if timeout is None else timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self._local.sock = sock
+        self._local.file = sock.makefile('rwb')
+        return self._local.file
+
+    def _close(self):
+        for name in ('file', 'sock'):
+            handle = getattr(self._local, name, None)
+            if handle is not None:
+                try:
+                    handle.close()
+                except OSError:
+                    pass
+                setattr(self._local, name, None)
+
+    def call(self, op, **params):
+        request = (json.dumps({"op": op, **params}) + "\n").encode('utf-8')
+        for attempt in (1, 2):
+            try:
+                stream = getattr(self._local, 'file', None) or self._connect()
+                stream.write(request)
+                stream.flush()
+                line = stream.readline()
+                if not line:
+                    raise ConnectionError("retrieval service closed the connection")
+                break
+            except (OSError, ConnectionError) as e:
+                self._close()
+                if attempt == 2:
+                    raise RetrievalServiceError(f"Retrieval service unavailable at {self.path}: {e}")
+
+        reply = json.loads(line)
+        if reply.get('error'):
+            raise RetrievalServiceError(reply['error'])
+        return reply
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4):
+        return _decode_results(self.call('search', vector=_encode_vector(embedding), k=k)['results'])
+
+    def similarity_search_by_vectors_with_score(self, embeddings, k=4):
+        reply = self.call('search_batch', vectors=[_encode_vector(v) for v in embeddings], k=k)
+        return [_decode_results(rows) for rows in reply['results']]
+
+    def count(self):
+        return self.call('count')['count']
+
+    def ping(self):
+        return self.call('ping')
+
+    def sync(self, batch_size=None):
+        """Have the service apply queued KB changes; returns documents upserted"""
+        reply = self.call('sync', batch_size=batch_size)
+        if not reply['ok']:
+            raise RetrievalServiceError("Vector store sync failed in the retrieval service, see its logs")
+        return reply['upserted']
+
+
+# --- server ---------------------------------------------------------------
+
+_sync_lock = threading.Lock()
+
+
+def _sync(batch_size=None):
+    from . import utils
+
+    upserted = []
+    with _sync_lock:
+        ok = utils.sync_new_entries_to_vector_store(batch_size=batch_size, on_batch=upserted.append)
+    return ok, sum(upserted)
+
+
+def _search(vector, k):
+    from .utils import search_by_vector
+    return _encode_results(search_by_vector(_decode_vector(vector), k=k))
+
+
+def _search_batch(vectors, k):
+    from .utils import get_vector_store, NumpyVectorIndex
+    store = get_vector_store()
+    vectors = [_decode_vector(v) for v in vectors]
+    if isinstance(store, NumpyVectorIndex):
+        return [_encode_results(rows) for rows in store.similarity_search_by_vectors_with_score(vectors, k=k)]
+    return [_encode_results(store.similarity_search_by_vector_with_relevance_scores(v, k=k)) for v in vectors]
+
+
+def handle_request(request):
+    op = request.get('op')
+    if op == 'search':
+        return {"results": _search(request['vector'], request.get('k', 10))}
+    if op == 'search_batch':
+        return {"results": _search_batch(request['vectors'], request.get('k', 10))}
+    if op == 'sync':
+        ok, upserted = _sync(request.get('batch_size'))
+        return {"ok": ok, "upserted": upserted}
+    if op == 'count':
+        from .utils import vector_store_count
+        return {"count": vector_store_count()}
+    if op == 'ping':
+        return {"pid": os.getpid()}
+    raise ValueError(f"unknown op '{op}'")
+
+
+class RetrievalRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            for line in self.rfile:
+                try:
+                    reply = handle_request(json.loads(line))
+                except Exception as e:
+                    logger.warning(f"[RETRIEVAL SERVICE] {str(e)}")
+                    reply = {"error": str(e)}
+                self.wfile.write((json.dumps(reply) + "\n").encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            connections.close_all()
+
+
+class RetrievalServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _poll_outbox(interval):
+    """Pick up KB edits made by other processes (admin, shell) that only queued outbox rows"""
+    from .models import VectorSyncOutbox
+
+    while True:
+        time.sleep(interval)
+        try:
+            if VectorSyncOutbox.objects.exists():
+                _sync()
+        except Exception as e:
+            logger.warning(f"[RETRIEVAL SERVICE] Outbox poll failed: {str(e)}")
+        finally:
+            connections.close_all()
+
+
+def serve(path, sync_interval=None):
+    """Build the local index, then answer workers on `path` until interrupted"""
+    global _serving
+    from . import utils
+
+    _serving = True
+    utils.initialize_vector_store()
+    logger.info(f"[RETRIEVAL SERVICE] Index ready with {utils.vector_store_count()} documents")
+
+    if os.path.exists(path):
+        os.unlink(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    server = RetrievalServer(path, RetrievalRequestHandler)
+    os.chmod(path, 0o660)
+
+    interval = settings.RETRIEVAL_SERVICE_SYNC_SECONDS if sync_interval is None else sync_interval
+    if interval:
+        threading.Thread(target=_poll_outbox, args=(interval,), name='outbox-poll', daemon=True).start()
+
+    logger.info(f"[RETRIEVAL SERVICE] Listening on {path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when the generation wait queue has no room left"""
+
+
+class Ticket:
+    """A request's place in the generation queue"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.granted = False
+        self.released = False
+        self._event = threading.Event()
+        self._loop = None
+        self._async_event = None
+
+    def bind_loop(self):
+        """Allow an asyncio task to await the grant"""
+        self._async_event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        if self.granted:
+            self._async_event.set()
+
+    def _grant(self):
+        self.granted = True
+        self._wake()
+
+    def _wake(self):
+        self._event.set()
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._async_event.set)
+            except RuntimeError:
+                pass   # the waiting task's event loop is already closed
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+    async def await_grant(self, timeout):
+        try:
+            await asyncio.wait_for(self._async_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.granted
+
+
+class Cancellation:
+    """
+    Set by whoever serves a response once its client is gone. Tickets tracked
+    by it are released at that moment, so a request still waiting in the
+    queue leaves it at once instead of when its worker next looks.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._tickets = []
+        self._lock = threading.Lock()
+
+    def track(self, ticket):
+        with self._lock:
+            if not self.cancelled:
+                self._tickets.append(ticket)
+                return ticket
+        generation_scheduler.release(ticket)
+        return ticket
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            tickets, self._tickets = self._tickets, []
+        for ticket in tickets:
+            generation_scheduler.release(ticket)
+
+
+class GenerationScheduler:
+    """
+    Admission control for LLM generations: at most `max_concurrent` run at
+    once, at most `max_waiting` queue behind them, and queued requests are
+    dispatched round-robin across users so one user cannot starve the rest.
+    """
+
+    def __init__(self, max_concurrent, max_waiting):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.rejected = 0
+        self._active = 0
+        self._waiting = 0
+        self._queues = OrderedDict()    # user_id -> deque of waiting tickets, in round-robin order
+        self._lock = threading.Lock()
+
+    def enqueue(self, user_id):
+        """Return a Ticket, already granted if a slot is free; raise QueueFull otherwise"""
+        ticket = Ticket(user_id)
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                ticket._grant()
+                return ticket
+
+            if self._waiting >= self.max_waiting:
+                self.rejected += 1
+                raise QueueFull()
+
+            self._queues.setdefault(user_id, deque()).append(ticket)
+            self._waiting += 1
+
+        logger.info(f"[SCHEDULER] Queued user {user_id}, waiting={self._waiting}")
+        return ticket
+
+    def acquire(self, user_id, poll_seconds=1.0):
+        """Block until a slot is granted, retrying while the wait queue is full"""
+        while True:
+            try:
+                ticket = self.enqueue(user_id)
+                break
+            except QueueFull:
+                time.sleep(poll_seconds)
+        ticket.wait(None)
+        return ticket
+
+    def position(self, ticket):
+        """1-based number of dispatches until this ticket runs, or 0 once granted"""
+        with self._lock:
+            if ticket.granted or ticket.released:
+                return 0
+
+            queues = list(self._queues.items())
+            for user_index, (user_id, queue) in enumerate(queues):
+                if user_id != ticket.user_id:
+                    continue
+                rank = queue.index(ticket)
+                ahead = sum(min(len(q), rank) for _, q in queues)
+                ahead += sum(1 for _, q in queues[:user_index] if len(q) > rank)
+                return ahead + 1
+        return 0
+
+    def release(self, ticket):
+        """Give back a slot or leave the queue; safe to call more than once"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+
+            if ticket.granted:
+                self._active -= 1
+            else:
+                queue = self._queues.get(ticket.user_id)
+                if queue and ticket in queue:
+                    queue.remove(ticket)
+                    self._waiting -= 1
+                    if not queue:
+                        del self._queues[ticket.user_id]
+
+            self._dispatch()
+        # Wake a waiter still in the queue so it sees it was released
+        ticket._wake()
+
+    def hand_over(self, ticket):
+        """
+        Move a granted slot to a new Ticket for work that outlives the request
+        holding it; releasing the old ticket is then a no-op. Returns None if
+        the ticket was released (or never granted) first.
+        """
+        with self._lock:
+            if not ticket.granted or ticket.released:
+                return None
+            ticket.released = True
+            successor = Ticket(ticket.user_id)
+            successor.granted = True
+            successor._event.set()
+            return successor
+
+    def _dispatch(self):
+        while self._active < self.max_concurrent and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            self._waiting -= 1
+
+            # Rotate this user to the back so the next slot goes to someone else
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+
+            self._active += 1
+            ticket._grant()
+
+
+generation_scheduler = GenerationScheduler(
+    max_concurrent=settings.LLM_MAX_CONCURRENT_GENERATIONS,
+    max_waiting=settings.LLM_MAX_QUEUED_GENERATIONS,
+)
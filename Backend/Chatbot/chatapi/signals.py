@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import KnowledgeBase, VectorSyncOutbox
+from .cache import answer_cache
+
+
+@receiver(post_save, sender=KnowledgeBase)
+@receiver(post_delete, sender=KnowledgeBase)
+def invalidate_answer_cache(sender, **kwargs):
+    """Cached answers may be built on the changed row, so drop them all"""
+    answer_cache.clear()
+
+
+@receiver(post_save, sender=KnowledgeBase)
+def queue_vector_upsert(sender, instance, **kwargs):
+    if instance.content_hash != instance.synced_hash:
+        VectorSyncOutbox.objects.create(kb_id=instance.pk, action='upsert')
+
+
+@receiver(post_delete, sender=KnowledgeBase)
+def queue_vector_delete(sender, instance, **kwargs):
+    VectorSyncOutbox.objects.create(kb_id=instance.pk, action='delete')
+
+
+# Registered after the outbox receivers, so the outbox row exists when this runs
+@receiver(post_save, sender=KnowledgeBase)
+@receiver(post_delete, sender=KnowledgeBase)
+def sync_kb_edit(sender, **kwargs):
+    """Index the edit once committed; the sync bumps the KB version, dropping retrieval results"""
+    from .utils import schedule_vector_sync
+    transaction.on_commit(schedule_vector_sync)
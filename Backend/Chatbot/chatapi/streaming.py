@@ -0,0 +1,162 @@
+import asyncio
+import json
+import re
+import time
+import zlib
+from django.conf import settings
+from .metrics import CHAT_SSE_FRAMES
+from .utils import StreamEvent
+
+
+_LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+
+def format_sse(token):
+    """
+    One SSE frame. Text spanning several lines is sent as several data: lines,
+    which the client joins back with newlines.
+    """
+    if isinstance(token, StreamEvent):
+        return f"event: {token.event}\ndata: {json.dumps(token.data)}\n\n"
+    return "".join(f"data: {line}\n" for line in _LINE_BREAK.split(token)) + "\n"
+
+
+class FrameCoalescer:
+    """
+    Batch reply tokens into fewer SSE frames. A token arriving after a quiet
+    spell of SSE_COALESCE_MS (such as the first one) is sent at once; later
+    ones are buffered until SSE_COALESCE_BYTES or SSE_COALESCE_MS since the
+    buffer started. Named events go out at once, after any buffered text.
+    """
+
+    def __init__(self, window_ms=None, max_bytes=None):
+        self.window = (settings.SSE_COALESCE_MS if window_ms is None else window_ms) / 1000
+        self.max_bytes = settings.SSE_COALESCE_BYTES if max_bytes is None else max_bytes
+        self.parts = []
+        self.size = 0
+        self.started = None
+        self.last_flush = None
+
+    def deadline(self):
+        """Monotonic time at which the buffer must be sent, or None if empty"""
+        return None if self.started is None else self.started + self.window
+
+    def add(self, item):
+        """Frames ready to send after `item` (a token or StreamEvent)"""
+        if isinstance(item, StreamEvent):
+            frames = self.flush()
+            frames.append(self._frame(item))
+            return frames
+
+        now = time.monotonic()
+        self.parts.append(item)
+        self.size += len(item.encode('utf-8'))
+        if self.started is None:
+            self.started = now
+            if self.last_flush is None or now - self.last_flush >= self.window:
+                return self.flush()
+        if self.size >= self.max_bytes or now >= self.deadline():
+            return self.flush()
+        return []
+
+    def flush(self):
+        if not self.parts:
+            return []
+        text = "".join(self.parts)
+        self.parts, self.size, self.started = [], 0, None
+        self.last_flush = time.monotonic()
+        return [self._frame(text)]
+
+    def _frame(self, item):
+        CHAT_SSE_FRAMES.inc()
+        return format_sse(item)
+
+
+def sse_frames(items, coalescer=None):
+    """
+    Frames for a sync token stream. A sync generator cannot be interrupted,
+    so apart from the first token after a pause the time window is checked
+    when the next token arrives.
+    """
+    coalescer = coalescer or FrameCoalescer()
+    for item in items:
+        yield from coalescer.add(item)
+    yield from coalescer.flush()
+
+
+async def asse_frames(items, coalescer=None):
+    """Frames for an async token stream; buffered text is sent on time even while the model stalls"""
+    coalescer = coalescer or FrameCoalescer()
+    iterator = aiter(items)
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(iterator))
+            deadline = coalescer.deadline()
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                for frame in coalescer.flush():
+                    yield frame
+                continue
+            try:
+                item = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            for frame in coalescer.add(item):
+                yield frame
+        for frame in coalescer.flush():
+            yield frame
+    finally:
+        if pending is not None:
+            # Cancel the generator where it is waiting, then let it unwind before closing it
+            pending.cancel()
+            await asyncio.wait({pending})
+        await iterator.aclose()
+
+
+def accepts_gzip(request):
+    """Whether to gzip the stream: enabled by SSE_COMPRESSION and offered by the client"""
+    if not settings.SSE_COMPRESSION:
+        return False
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.partition(';')
+        if coding.strip().lower() in ('gzip', '*'):
+            quality = params.replace(' ', '').removeprefix('q=')
+            try:
+                return not quality or float(quality) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def _compressor():
+    return zlib.compressobj(settings.SSE_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+
+
+def gzip_frames(frames):
+    """Gzip a frame stream, flushing after every frame so nothing waits in the compressor"""
+    compressor = _compressor()
+    for frame in frames:
+        yield compressor.compress(frame.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def agzip_frames(frames):
+    compressor = _compressor()
+    async for frame in frames:
+        yield compressor.compress(frame.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def sse_headers(response, compressed):
+    """Headers that keep proxies from buffering or caching the stream"""
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    if compressed:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
+    return response
@@ -1,3 +1,1268 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from langchain_core.documents import Document
+
+from benchmarks.fake_ollama import FakeOllamaConfig, start_in_thread
+from . import kb_version, streaming, utils, views
+from .backends import BackendPool, PooledEmbeddings, PooledOllamaLLM
+from .cache import RetrievalCache, RetrievalEntry, answer_cache, retrieval_cache
+from .chatlog import ChatLogWriter
+from .coalesce import FlightAborted, SingleFlight
+from .embedding import CachedEmbeddings
+from .ingest import IngestError, ingest_upload, iter_json_array
+from .jobs import claim_next_job, create_ingest_job, requeue_stale_jobs, run_ingest_job
+from .models import ChatMessage, IngestJob, KnowledgeBase, KnowledgeBaseVersion, UploadRecord, VectorSyncOutbox
+from .retrieval_service import (RemoteVectorStore, RetrievalRequestHandler, RetrievalServer,
+                                RetrievalServiceError)
+from .scheduler import Cancellation, GenerationScheduler, QueueFull, generation_scheduler
+from .utils import StreamEvent
+from .vector_index import NumpyVectorIndex
+from user.models import User
+
+
+def start_stub_ollama(first_token_delay=0.0):
+    """A fake Ollama node on a free port that counts the requests it serves"""
+    config = FakeOllamaConfig(token_rate=0, first_token_delay=first_token_delay, tokens=5, embed_delay=0, dim=8)
+    server = start_in_thread(config)
+    server.hits = []
+    handler = server.RequestHandlerClass
+
+    def do_POST(self):
+        server.hits.append(self.path)
+        handler.do_POST(self)
+
+    server.RequestHandlerClass = type('CountingHandler', (handler,), {'do_POST': do_POST})
+    return server
+
+
+def dead_url():
+    """A local URL nothing is listening on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f'http://127.0.0.1:{port}'
+
+
+class BackendPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def stub(self, **kwargs):
+        server = start_stub_ollama(**kwargs)
+        self.servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}', server
+
+    def test_concurrent_generations_spread_over_endpoints(self):
+        url_a, server_a = self.stub(first_token_delay=0.3)
+        url_b, server_b = self.stub(first_token_delay=0.3)
+        pool = BackendPool('llm', [url_a, url_b], probe_interval=0)
+        llm = PooledOllamaLLM(pool=pool, model='fake')
+
+        replies = []
+        threads = [threading.Thread(target=lambda: replies.append(llm.invoke('admission fee'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(replies), 4)
+        self.assertTrue(all(replies))
+        self.assertEqual(server_a.hits.count('/api/generate'), 2)
+        self.assertEqual(server_b.hits.count('/api/generate'), 2)
+        self.assertEqual([e['in_flight'] for e in pool.status()], [0, 0])
+
+    def test_generation_fails_over_to_a_live_endpoint(self):
+        url, server = self.stub()
+        pool = BackendPool('llm', [dead_url(), url], probe_interval=0, failure_threshold=1)
+        llm = PooledOllamaLLM(pool=pool, model='fake')
+
+        self.assertTrue(llm.invoke('admission fee'))
+        self.assertEqual(server.hits, ['/api/generate'])
+        dead, live = pool.status()
+        self.assertFalse(dead['healthy'])
+        self.assertTrue(live['healthy'])
+
+        # The ejected node is no longer tried while a healthy one is left
+        llm.invoke('semester schedule')
+        self.assertEqual(pool.endpoints[0].failures, 1)
+
+    def test_embeddings_fail_over_to_a_live_endpoint(self):
+        url, server = self.stub()
+        pool = BackendPool('embedding', [dead_url(), url], probe_interval=0, failure_threshold=1)
+        embeddings = PooledEmbeddings(pool, 'fake')
+
+        self.assertEqual(len(embeddings.embed_query('library hours')), 8)
+        self.assertEqual(len(embeddings.embed_documents(['hostel', 'transport'])), 2)
+        self.assertEqual(server.hits, ['/api/embed', '/api/embed'])
+        self.assertFalse(pool.endpoints[0].healthy)
+
+    def test_all_endpoints_down_raises(self):
+        pool = BackendPool('llm', [dead_url(), dead_url()], probe_interval=0)
+        llm = PooledOllamaLLM(pool=pool, model='fake')
+
+        with self.assertRaises((ConnectionError, httpx.TransportError)):
+            llm.invoke('admission fee')
+        self.assertEqual([e['failures'] for e in pool.status()], [1, 1])
+
+    def test_probe_ejects_and_readmits(self):
+        url, server = self.stub()
+        pool = BackendPool('llm', [url, dead_url()], probe_interval=0)
+        pool.endpoints[0].healthy = False
+
+        self.assertEqual(pool.probe_all(), {url: True, pool.endpoints[1].url: False})
+        self.assertTrue(pool.endpoints[0].healthy)
+        self.assertFalse(pool.endpoints[1].healthy)
+
+    def test_ollama_host_is_the_default_backend(self):
+        env = {k: v for k, v in os.environ.items()
+               if k not in ('OLLAMA_BASE_URL', 'OLLAMA_LLM_URLS', 'OLLAMA_EMBED_URLS')}
+        env.update(OLLAMA_HOST='http://gpu-box:11434', DJANGO_SETTINGS_MODULE='Chatbot.settings',
+                   SECRET_KEY=env.get('SECRET_KEY') or 'test')
+        script = ("import django; django.setup(); from django.conf import settings; "
+                  "print(settings.OLLAMA_BASE_URL, settings.OLLAMA_LLM_URLS[0], settings.OLLAMA_EMBED_URLS[0])")
+
+        def read(extra=None):
+            result = subprocess.run([sys.executable, '-c', script], env={**env, **(extra or {})},
+                                    cwd=settings.BASE_DIR, capture_output=True, text=True, check=True)
+            return result.stdout.split()
+
+        self.assertEqual(read(), ['http://gpu-box:11434'] * 3)
+        # An explicit OLLAMA_BASE_URL still wins
+        self.assertEqual(read({'OLLAMA_BASE_URL': 'http://other:11434'}), ['http://other:11434'] * 3)
+
+
+def per_row_ingest(items):
+    """The upload loop ingest_upload replaced: one iexact lookup and one insert per pair"""
+    inserted = 0
+    skipped = 0
+    for item in items:
+        question = item.get('question','').strip()
+        answer = item.get('answer','').strip()
+        if not question and not answer:
+            continue
+        if KnowledgeBase.objects.filter(question__iexact=question, answer__iexact=answer).exists():
+            skipped += 1
+        else:
+            KnowledgeBase.objects.create(question=question, answer=answer)
+            inserted += 1
+    return inserted, skipped
+
+
+class IngestParityTests(TestCase):
+    ITEMS = [
+        {'question': 'What is the admission fee?', 'answer': 'Rs. 5000'},
+        {'question': 'what is the ADMISSION fee?', 'answer': 'rs. 5000'},      # in-file repeat, other case
+        {'question': '  What is the admission fee?  ', 'answer': 'Rs. 5000 '},  # in-file repeat, padded
+        {'question': 'Where is the library?', 'answer': 'Near the main gate'},   # already stored
+        {'question': 'WHERE IS THE LIBRARY?', 'answer': 'near the main gate'},   # already stored, other case
+        {'question': 'When do classes start?', 'answer': 'In January'},
+        {'question': 'When do classes start?', 'answer': 'In February'},         # same question, new answer
+        {'question': '', 'answer': ''},                                          # blank, not counted
+        {'question': '   ', 'answer': ' '},                                      # blank after strip
+        {'question': 'Only a question', 'answer': ''},
+        {'question': 'only a QUESTION', 'answer': ''},
+        {'question': 'Hostel rules?', 'answer': 'See the notice board'},
+        {'question': 'When do classes start?', 'answer': 'in january'},          # repeat across batches
+    ]
+    EXISTING = [('Where is the library?', 'Near the main gate'), ('Transport routes?', 'Ask the office')]
+
+    def setUp(self):
+        for question, answer in self.EXISTING:
+            KnowledgeBase.objects.create(question=question, answer=answer)
+        VectorSyncOutbox.objects.all().delete()
+
+    def stored(self):
+        return sorted(KnowledgeBase.objects.values_list('question', 'answer'))
+
+    def reference(self):
+        """Counts and rows the old loop produces, rolled back afterwards"""
+        with transaction.atomic():
+            counts = per_row_ingest(self.ITEMS)
+            rows = self.stored()
+            transaction.set_rollback(True)
+        return counts, rows
+
+    def upload(self, ndjson=False):
+        if ndjson:
+            content = '\n'.join(json.dumps(item) for item in self.ITEMS)
+            return SimpleUploadedFile('kb.jsonl', content.encode('utf-8'), content_type='application/x-ndjson')
+        return SimpleUploadedFile('kb.json', json.dumps(self.ITEMS).encode('utf-8'), content_type='application/json')
+
+    def test_bulk_counts_match_per_row_loop(self):
+        expected_counts, expected_rows = self.reference()
+        self.assertEqual(expected_counts, (5, 6))
+
+        for ndjson in (False, True):
+            for batch_size in (1, 2, 1000):
+                for atomic in (True, False):
+                    with self.subTest(ndjson=ndjson, batch_size=batch_size, atomic=atomic), transaction.atomic():
+                        counts = ingest_upload(self.upload(ndjson), batch_size=batch_size, atomic=atomic)
+                        self.assertEqual(counts, expected_counts)
+                        self.assertEqual(self.stored(), expected_rows)
+                        self.assertEqual(VectorSyncOutbox.objects.filter(action='upsert').count(), counts[0])
+                        transaction.set_rollback(True)
+
+    def test_second_upload_skips_everything(self):
+        inserted, skipped = ingest_upload(self.upload())
+        self.assertEqual(ingest_upload(self.upload()), (0, inserted + skipped))
+
+
+class AsgiStreamingTests(TransactionTestCase):
+    """runserver serves ASGI (daphne); sync streams must still reach the client token by token"""
+
+    TOKEN_SECONDS = 0.5
+
+    def setUp(self):
+        user = User.objects.create_user(email='student@example.com')
+        user.is_admin = True
+        user.save()
+        self.headers = {'Authorization': 'Bearer ' + User.generated_token(user)['access']}
+
+    def slow_reply(self, user, question, ticket, conversation=None, cancellation=None):
+        for token in ['Admission ', 'opens ', 'in ', 'January.']:
+            yield token
+            time.sleep(self.TOKEN_SECONDS)
+
+    async def first_and_last(self, response, marker):
+        """Seconds until `marker` was received and until the stream ended"""
+        # ASGIHandler reads a sync streaming body to the end before sending any of it
+        self.assertTrue(response.is_async, 'sync stream would be buffered under ASGI')
+        started = time.monotonic()
+        first = None
+        async for chunk in response.streaming_content:
+            if first is None and marker in chunk:
+                first = time.monotonic() - started
+        return first, time.monotonic() - started
+
+    async def test_chat_streams_before_generation_finishes(self):
+        with mock.patch.object(views, 'chatbot_response', self.slow_reply):
+            response = await AsyncClient().post('/api/chat/', {'prompt': 'When does admission open?'},
+                                                content_type='application/json', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            first, last = await self.first_and_last(response, b'Admission')
+
+        self.assertIsNotNone(first)
+        self.assertLess(first, self.TOKEN_SECONDS)
+        self.assertGreaterEqual(last, 3 * self.TOKEN_SECONDS)
+
+    async def test_batch_streams_results_as_they_finish(self):
+        def answer(user, prompt, relevant):
+            time.sleep(float(prompt))
+            return prompt, 'llm'
+
+        with mock.patch.object(views, 'batch_relevant_documents', lambda prompts: [[] for _ in prompts]), \
+                mock.patch.object(views, 'generate_batch_answer', answer):
+            response = await AsyncClient().post('/api/chat/batch/', {'prompts': ['0.1', '1.5']},
+                                                content_type='application/json', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            first, last = await self.first_and_last(response, b'"0.1"')
+
+        self.assertLess(first, 1.0)
+        self.assertGreaterEqual(last, 1.5)
+
+
+class ChatAdmissionTests(TestCase):
+    """A full generation queue is refused with 429 before any stream starts"""
+
+    def setUp(self):
+        user = User.objects.create_user(email='student@example.com')
+        self.headers = {'Authorization': 'Bearer ' + User.generated_token(user)['access']}
+        limits = mock.patch.multiple(generation_scheduler, max_concurrent=1, max_waiting=1)
+        limits.start()
+        self.addCleanup(limits.stop)
+
+    def fill_queue(self):
+        tickets = [generation_scheduler.enqueue(0), generation_scheduler.enqueue(0)]
+        for ticket in tickets:
+            self.addCleanup(generation_scheduler.release, ticket)
+
+    def test_full_queue_is_429_with_retry_after(self):
+        self.fill_queue()
+        response = Client().post('/api/chat/', {'prompt': 'When does admission open?'},
+                                 content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(settings.LLM_QUEUE_RETRY_AFTER))
+        self.assertNotIn('text/event-stream', response['Content-Type'])
+
+    async def test_full_queue_is_429_on_async_endpoint(self):
+        self.fill_queue()
+        response = await AsyncClient().post('/api/chat/async/', {'prompt': 'When does admission open?'},
+                                            content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(settings.LLM_QUEUE_RETRY_AFTER))
+
+    def test_unread_stream_gives_its_slot_back(self):
+        with mock.patch.object(views, 'chatbot_response', lambda *args: iter(())):
+            response = Client().post('/api/chat/', {'prompt': 'When does admission open?'},
+                                     content_type='application/json', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(generation_scheduler._active, 1)
+            response.close()
+        self.assertEqual(generation_scheduler._active, 0)
+
+
+class SlowChain:
+    """Stands in for the prompt | LLM chain, producing a fixed reply token by token"""
+
+    def __init__(self, tokens, delay=0.05):
+        self.tokens = tokens
+        self.delay = delay
+        self.streams = 0
+        self.produced = 0
+        self.closed = threading.Event()
+
+    def stream(self, inputs):
+        self.streams += 1
+        try:
+            for token in self.tokens:
+                time.sleep(self.delay)
+                self.produced += 1
+                yield token
+        finally:
+            self.closed.set()
+
+    async def astream(self, inputs):
+        self.streams += 1
+        try:
+            for token in self.tokens:
+                await asyncio.sleep(self.delay)
+                self.produced += 1
+                yield token
+        finally:
+            self.closed.set()
+
+
+def take(stream, count):
+    tokens = []
+    for item in stream:
+        if isinstance(item, str):
+            tokens.append(item)
+            if len(tokens) == count:
+                break
+    return tokens
+
+
+@override_settings(ANSWER_CACHE_ENABLED=False, COALESCE_ENABLED=True, CHAT_SUMMARY_ENABLED=False)
+class GenerationOwnershipTests(SimpleTestCase):
+    """A generation belongs to everyone reading it, not to the request that started it"""
+
+    QUESTION = 'What is the admission fee?'
+    REPLY = ['The ', 'fee ', 'is ', 'Rs. ', '5000.']
+
+    def setUp(self):
+        self.chain = SlowChain(self.REPLY)
+        self.saved = []
+
+        async def asave(user, question, reply, conversation=None, truncated=False):
+            self.saved.append((user.pk, reply, truncated))
+
+        async def acurrent():
+            return 0
+
+        async def aretrieve(*args):
+            return RetrievalEntry(self.QUESTION, 0, [1.0], [])
+
+        patches = [
+            mock.patch.object(utils, 'initialize_vector_store', lambda: None),
+            mock.patch.object(kb_version, 'current', lambda: 0),
+            mock.patch.object(kb_version, 'acurrent', acurrent),
+            mock.patch.object(utils, 'retrieve', lambda *args: RetrievalEntry(self.QUESTION, 0, [1.0], [])),
+            mock.patch.object(utils, 'aretrieve', aretrieve),
+            mock.patch.object(utils, 'build_chain', lambda context, memory: self.chain),
+            mock.patch.object(utils, 'save_exchange', lambda user, question, reply, conversation=None, truncated=False:
+                              self.saved.append((user.pk, reply, truncated))),
+            mock.patch.object(utils, 'asave_exchange', asave),
+            mock.patch.multiple(generation_scheduler, max_concurrent=2, max_waiting=2),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def ticket(self, user_id):
+        return generation_scheduler.enqueue(user_id)
+
+    def assert_slots_released(self):
+        deadline = time.monotonic() + 2
+        while generation_scheduler._active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(generation_scheduler._active, 0)
+
+    def test_follower_finishes_after_leader_disconnects(self):
+        leader = utils.chatbot_response(SimpleNamespace(pk=1), self.QUESTION, self.ticket(1))
+        self.assertEqual(take(leader, 2), self.REPLY[:2])
+        follower = utils.chatbot_response(SimpleNamespace(pk=2), self.QUESTION, self.ticket(2))
+        received = take(follower, 3)
+
+        leader.close()   # the leader's client went away
+        received += [item for item in follower if isinstance(item, str)]
+
+        self.assertEqual(''.join(received), ''.join(self.REPLY))
+        self.assertIn((2, ''.join(self.REPLY), False), self.saved)
+        self.assertEqual(self.chain.streams, 1)
+        self.assertEqual(self.chain.produced, len(self.REPLY))
+        self.assert_slots_released()
+
+    def test_generation_stops_when_its_only_reader_leaves(self):
+        leader = utils.chatbot_response(SimpleNamespace(pk=1), self.QUESTION, self.ticket(1))
+        self.assertEqual(take(leader, 2), self.REPLY[:2])
+        leader.close()
+
+        self.assertTrue(self.chain.closed.wait(2))
+        self.assertLess(self.chain.produced, len(self.REPLY))
+        self.assert_slots_released()
+
+    def read_in_thread(self, user_id):
+        tokens = []
+        stream = utils.chatbot_response(SimpleNamespace(pk=user_id), self.QUESTION, self.ticket(user_id))
+        reader = threading.Thread(target=lambda: tokens.extend(item for item in stream if isinstance(item, str)))
+        reader.start()
+        self.addCleanup(reader.join, 5)
+        return reader, tokens
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_concurrent_identical_questions_share_one_generation(self):
+        generation_scheduler.max_concurrent, generation_scheduler.max_waiting = 1, 4
+        blocker = self.ticket(0)   # keeps every request queued until all of them have joined
+        readers = [self.read_in_thread(user_id) for user_id in (1, 2, 3)]
+        self.wait_until(lambda: any(f.subscribers == 2 for f in list(utils.single_flight._flights.values())))
+
+        generation_scheduler.release(blocker)
+        for reader, tokens in readers:
+            reader.join(5)
+            self.assertEqual(''.join(tokens), ''.join(self.REPLY))
+        self.assertEqual(self.chain.streams, 1)
+        self.assertEqual(sorted(user for user, _, _ in self.saved), [1, 2, 3])
+        self.assert_slots_released()
+
+    def test_follower_generates_itself_when_the_leader_aborts(self):
+        generation_scheduler.max_concurrent = 1
+        blocker = self.ticket(0)
+        leader = utils.chatbot_response(SimpleNamespace(pk=1), self.QUESTION, self.ticket(1))
+        self.assertEqual(next(leader).event, 'queue')
+        reader, tokens = self.read_in_thread(2)
+        self.wait_until(lambda: any(f.subscribers for f in list(utils.single_flight._flights.values())))
+
+        leader.close()   # gives up before its first token, aborting the flight
+        self.wait_until(lambda: not utils.single_flight._flights and generation_scheduler._waiting == 1)
+        generation_scheduler.release(blocker)
+        reader.join(5)
+
+        self.assertEqual(''.join(tokens), ''.join(self.REPLY))
+        self.assertIn((2, ''.join(self.REPLY), False), self.saved)
+        self.assertEqual(self.chain.streams, 1)
+        self.assert_slots_released()
+
+    async def test_async_follower_finishes_after_leader_is_cancelled(self):
+        async def read(stream, tokens):
+            async for item in stream:
+                if isinstance(item, str):
+                    tokens.append(item)
+
+        async def until(condition):
+            while not condition():
+                await asyncio.sleep(0.01)
+
+        leader_tokens, follower_tokens = [], []
+        leader = asyncio.create_task(read(
+            utils.achatbot_response(SimpleNamespace(pk=1), self.QUESTION, self.ticket(1)), leader_tokens))
+        await asyncio.wait_for(until(lambda: leader_tokens), 2)
+        follower = asyncio.create_task(read(
+            utils.achatbot_response(SimpleNamespace(pk=2), self.QUESTION, self.ticket(2)), follower_tokens))
+        await asyncio.wait_for(until(lambda: len(follower_tokens) >= 2), 2)
+
+        leader.cancel()
+        await asyncio.wait_for(follower, 5)
+
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(''.join(follower_tokens), ''.join(self.REPLY))
+        self.assertIn((2, ''.join(self.REPLY), False), self.saved)
+        self.assertEqual(self.chain.streams, 1)
+        await asyncio.wait_for(until(lambda: not generation_scheduler._active), 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), INGEST_JOB_STALE_SECONDS=60, INGEST_JOB_MAX_ATTEMPTS=2)
+class IngestJobRecoveryTests(TestCase):
+    ITEMS = [
+        {'question': 'What is the admission fee?', 'answer': 'Rs. 5000'},
+        {'question': 'Where is the library?', 'answer': 'Near the main gate'},
+        {'question': 'When do classes start?', 'answer': 'In January'},
+        {'question': 'Hostel rules?', 'answer': 'See the notice board'},
+        {'question': 'what is the admission fee?', 'answer': 'rs. 5000'},
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='admin@example.com')
+        patch = mock.patch('chatapi.jobs.sync_new_entries_to_vector_store', return_value=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def queue_job(self, items=None, content=None):
+        content = content if content is not None else json.dumps(items or self.ITEMS).encode('utf-8')
+        return create_ingest_job(SimpleUploadedFile('kb.json', content, content_type='application/json'), self.user)
+
+    def go_quiet(self, job, seconds=120):
+        """Make the job look like its worker stopped reporting `seconds` ago"""
+        IngestJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=seconds))
+
+    def test_long_running_job_with_recent_heartbeat_is_left_alone(self):
+        self.queue_job()
+        job = claim_next_job()
+        IngestJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=5))
+
+        self.assertEqual(requeue_stale_jobs(), (0, 0))
+        self.assertEqual(IngestJob.objects.get(pk=job.pk).status, 'running')
+
+    def test_rerun_keeps_counts_from_the_dead_attempt(self):
+        self.queue_job()
+        job = claim_next_job()
+        # The first worker stored two rows and reported them before dying
+        for item in self.ITEMS[:2]:
+            KnowledgeBase.objects.create(**item)
+        IngestJob.objects.filter(pk=job.pk).update(inserted=2, skipped=0)
+        self.go_quiet(job)
+
+        self.assertEqual(requeue_stale_jobs(), (1, 0))
+        rerun = claim_next_job()
+        self.assertEqual((rerun.pk, rerun.attempts, rerun.inserted), (job.pk, 2, 2))
+        run_ingest_job(rerun)
+
+        job = IngestJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.inserted, job.skipped), ('done', 4, 1))
+        record = UploadRecord.objects.get(job=job)
+        self.assertEqual((record.inserted, record.skipped), (4, 1))
+        self.assertFalse(job.file.storage.exists(job.file.name))
+
+    def test_superseded_worker_cannot_overwrite_the_new_run(self):
+        self.queue_job()
+        first = claim_next_job()
+        self.go_quiet(first)
+        requeue_stale_jobs()
+        second = claim_next_job()
+
+        run_ingest_job(first)   # the stalled first worker wakes up
+
+        self.assertEqual(KnowledgeBase.objects.count(), 0)
+        job = IngestJob.objects.get(pk=second.pk)
+        self.assertEqual((job.status, job.attempts, job.inserted, job.skipped), ('running', 2, 0, 0))
+        self.assertTrue(job.file.storage.exists(job.file.name))
+
+    def test_rejected_upload_deletes_its_file(self):
+        job = self.queue_job(content=b'[{"question": "a", "answer": "b"}, {"question": ')
+        run_ingest_job(claim_next_job())
+
+        job = IngestJob.objects.get(pk=job.pk)
+        self.assertEqual(job.status, 'failed')
+        self.assertFalse(job.file.storage.exists(job.file.name))
+
+    def test_out_of_attempts_fails_and_deletes_the_file(self):
+        self.queue_job()
+        for _ in range(2):
+            job = claim_next_job()
+            self.go_quiet(job)
+            requeue_stale_jobs()
+
+        job = IngestJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertFalse(job.file.storage.exists(job.file.name))
+
+
+class KnowledgeBaseAdminTests(TestCase):
+    """Pairs that only differ by case or spaces are refused with a form error, not a 500"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(email='admin@example.com'))
+        self.original = KnowledgeBase.objects.create(question='Where is the library?', answer='Near the main gate')
+
+    def test_adding_a_case_variant_shows_a_form_error(self):
+        response = self.client.post('/admin/chatapi/knowledgebase/add/',
+                                    {'question': '  WHERE is the library?', 'answer': 'near the main gate '})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('already in the knowledge base', response.context['adminform'].form.errors['question'][0])
+        self.assertEqual(KnowledgeBase.objects.count(), 1)
+
+    def test_editing_a_legacy_duplicate_shows_a_form_error(self):
+        # Migration 0007 left later duplicates with no key
+        legacy = KnowledgeBase.objects.create(question='Library timings?', answer='9 to 5')
+        KnowledgeBase.objects.filter(pk=legacy.pk).update(question='where is the library?', answer='near the main gate',
+                                                          dedup_key=None)
+
+        url = f'/admin/chatapi/knowledgebase/{legacy.pk}/change/'
+        response = self.client.post(url, {'question': 'Where is the library? ', 'answer': 'Near the main gate'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['adminform'].form.errors)
+
+        response = self.client.post(url, {'question': 'Where is the old library?', 'answer': 'Near the main gate'})
+        self.assertEqual(response.status_code, 302)
+        legacy.refresh_from_db()
+        self.assertIsNotNone(legacy.dedup_key)
+
+    def test_editing_a_row_without_changing_it_is_allowed(self):
+        url = f'/admin/chatapi/knowledgebase/{self.original.pk}/change/'
+        response = self.client.post(url, {'question': 'Where is the library?', 'answer': 'Near the main gate, left'})
+        self.assertEqual(response.status_code, 302)
+
+
+class CachedEmbeddingsTests(SimpleTestCase):
+    """Both cache tiers hand back the float lists the model returned"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.underlying = mock.Mock()
+        self.underlying.embed_documents.side_effect = lambda texts: [[0.5, float(len(t))] for t in texts]
+        self.underlying.embed_query.side_effect = lambda text: [0.25, float(len(text))]
+        self.embeddings = CachedEmbeddings(self.underlying, 'test-model', os.path.join(directory.name, 'cache.sqlite3'))
+
+    def test_memory_tier_keeps_float32_arrays(self):
+        self.assertEqual(self.embeddings.embed_documents(['one', 'three']), [[0.5, 3.0], [0.5, 5.0]])
+        self.assertTrue(all(vector.dtype == np.float32 for vector in self.embeddings._memory.values()))
+
+        again = self.embeddings.embed_documents(['three', 'one'])
+        self.assertEqual(again, [[0.5, 5.0], [0.5, 3.0]])
+        self.assertIsInstance(again[0], list)
+        self.assertEqual(self.embeddings.embed_query('one'), [0.5, 3.0])
+        self.assertEqual(self.underlying.embed_documents.call_count, 1)
+        self.assertEqual(self.embeddings.memory_hits, 3)
+
+    def test_disk_tier_returns_lists(self):
+        self.embeddings.embed_query('hello')
+        self.embeddings._memory.clear()
+
+        vector = self.embeddings.embed_query('hello')
+        self.assertEqual(vector, [0.25, 5.0])
+        self.assertIsInstance(vector, list)
+        self.assertEqual(self.embeddings.disk_hits, 1)
+        self.assertEqual(self.underlying.embed_query.call_count, 1)
+
+
+class GenerationSchedulerTests(SimpleTestCase):
+    """Round-robin grants, queue positions and the waiting cap"""
+
+    def setUp(self):
+        self.scheduler = GenerationScheduler(max_concurrent=1, max_waiting=10)
+        self.running = self.scheduler.enqueue('a')
+        self.queued = {name: self.scheduler.enqueue(name[0]) for name in ('a1', 'a2', 'a3', 'b1', 'b2')}
+
+    def test_grants_alternate_between_users(self):
+        order = []
+        current = self.running
+        for _ in self.queued:
+            self.scheduler.release(current)
+            current = next(t for t in self.queued.values() if t.granted and not t.released)
+            order.append(next(name for name, t in self.queued.items() if t is current))
+        self.assertEqual(order, ['a1', 'b1', 'a2', 'b2', 'a3'])
+
+    def test_position_counts_the_dispatches_ahead(self):
+        positions = lambda: {name: self.scheduler.position(t) for name, t in self.queued.items()}
+        self.assertEqual(positions(), {'a1': 1, 'b1': 2, 'a2': 3, 'b2': 4, 'a3': 5})
+
+        self.scheduler.release(self.running)
+        self.assertEqual(positions(), {'a1': 0, 'b1': 1, 'a2': 2, 'b2': 3, 'a3': 4})
+
+        # b keeps its turn when its queued head leaves
+        self.scheduler.release(self.queued['b1'])
+        self.assertEqual(positions(), {'a1': 0, 'b1': 0, 'b2': 1, 'a2': 2, 'a3': 3})
+
+    def test_releasing_a_queued_ticket_wakes_its_waiter(self):
+        ticket = self.queued['b2']
+        woke = []
+        waiter = threading.Thread(target=lambda: woke.append(ticket.wait(5)))
+        waiter.start()
+
+        self.scheduler.release(ticket)
+        waiter.join(5)
+        self.assertEqual(woke, [True])
+        self.assertFalse(ticket.granted)
+        self.assertEqual(self.scheduler._waiting, 4)
+
+        # Its place is gone, so it is never granted later
+        for name in ('a1', 'b1', 'a2', 'a3'):
+            self.scheduler.release(self.running)
+            self.running = self.queued[name]
+            self.assertTrue(self.running.granted)
+        self.assertFalse(ticket.granted)
+
+    def test_queue_full_at_the_cap(self):
+        scheduler = GenerationScheduler(max_concurrent=1, max_waiting=2)
+        running = scheduler.enqueue('a')
+        first, second = scheduler.enqueue('b'), scheduler.enqueue('c')
+        self.assertTrue(running.granted)
+
+        with self.assertRaises(QueueFull):
+            scheduler.enqueue('d')
+        self.assertEqual(scheduler.rejected, 1)
+
+        scheduler.release(second)
+        self.assertFalse(scheduler.enqueue('d').granted)
+        scheduler.release(running)
+        self.assertTrue(first.granted)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = SingleFlight()
+
+    def test_follower_joining_mid_stream_gets_the_full_reply(self):
+        flight, leader = self.registry.join('key')
+        self.assertTrue(leader)
+        flight.publish('The ')
+        flight.publish('fee ')
+
+        same, leader = self.registry.join('key')
+        self.assertIs(same, flight)
+        self.assertFalse(leader)
+        follower = same.follow(poll_seconds=0.05)
+        self.assertEqual(next(follower), 'The ')
+
+        flight.publish('is ')
+        flight.finish('The fee is')
+        self.assertEqual(['The '] + list(follower), ['The ', 'fee ', 'is '])
+        self.assertEqual(flight.subscribers, 1)
+
+    def test_abort_raises_in_followers_and_frees_the_key(self):
+        flight, _ = self.registry.join('key')
+        follower = self.registry.join('key')[0].follow(poll_seconds=0.05)
+        flight.abort()
+        self.registry.leave(flight)
+
+        with self.assertRaises(FlightAborted):
+            next(follower)
+        self.assertEqual(len(self.registry), 0)
+        self.assertTrue(self.registry.join('key')[1])
+
+    def test_no_one_joins_a_flight_its_readers_left(self):
+        flight, _ = self.registry.join('key')
+        flight.detach()
+        self.assertTrue(flight.abandoned)
+        self.assertIsNot(self.registry.join('key')[0], flight)
+
+
+class FakeVectorStore:
+    """In-memory stand-in for the vector store: id -> document"""
+
+    def __init__(self):
+        self.documents = {}
+
+    def add_documents(self, documents, ids):
+        self.documents.update(zip(ids, documents))
+
+    def delete(self, ids):
+        for doc_id in ids:
+            self.documents.pop(doc_id, None)
+
+
+@override_settings(RETRIEVAL_SERVICE_SOCKET='')
+class VectorSyncOutboxTests(TestCase):
+    """KnowledgeBase changes reach the vector store through the outbox"""
+
+    def setUp(self):
+        self.store = FakeVectorStore()
+        for patch in (mock.patch.object(utils, 'get_vector_store', lambda: self.store),
+                      mock.patch.object(utils, 'schedule_vector_sync')):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def outbox(self):
+        return list(VectorSyncOutbox.objects.order_by('id').values_list('kb_id', 'action'))
+
+    def test_create_edit_and_delete_queue_outbox_rows(self):
+        entry = KnowledgeBase.objects.create(question='Where is the library?', answer='Near the main gate')
+        self.assertEqual(self.outbox(), [(entry.pk, 'upsert')])
+
+        entry.answer = 'Behind the arts faculty'
+        entry.save()
+        self.assertEqual(self.outbox(), [(entry.pk, 'upsert')] * 2)
+
+        entry_id = entry.pk
+        entry.delete()
+        self.assertEqual(self.outbox(), [(entry_id, 'upsert')] * 2 + [(entry_id, 'delete')])
+
+    def test_saving_a_synced_row_unchanged_queues_nothing(self):
+        entry = KnowledgeBase.objects.create(question='Where is the library?', answer='Near the main gate')
+        self.assertTrue(utils.sync_new_entries_to_vector_store())
+
+        entry.refresh_from_db()
+        entry.save()
+        self.assertEqual(self.outbox(), [])
+
+    def test_sync_upserts_and_deletes_in_batches(self):
+        kept = KnowledgeBase.objects.create(question='Where is the library?', answer='Near the main gate')
+        edited = KnowledgeBase.objects.create(question='When do classes start?', answer='In January')
+        removed = KnowledgeBase.objects.create(question='Hostel rules?', answer='See the notice board')
+        version = kb_version.current()
+        self.assertTrue(utils.sync_new_entries_to_vector_store(batch_size=2))
+        self.assertEqual(set(self.store.documents), {str(kept.pk), str(edited.pk), str(removed.pk)})
+
+        edited.answer = 'In February'
+        edited.save()
+        removed_id = removed.pk
+        removed.delete()
+        upserted = []
+        self.assertTrue(utils.sync_new_entries_to_vector_store(batch_size=2, on_batch=upserted.append))
+
+        self.assertEqual(set(self.store.documents), {str(kept.pk), str(edited.pk)})
+        self.assertNotIn(str(removed_id), self.store.documents)
+        self.assertEqual(self.store.documents[str(edited.pk)].metadata['answer'], 'In February')
+        self.assertEqual(sum(upserted), 1)
+        for entry in KnowledgeBase.objects.all():
+            self.assertEqual(entry.synced_hash, entry.content_hash)
+        self.assertEqual(self.outbox(), [])
+        self.assertGreater(kb_version.current(), version)
+
+
+class TableEmbeddings:
+    """Embeds each text as the vector listed for it"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def embed_documents(self, texts):
+        return [self.table[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.table[text]
+
+
+class NumpyVectorIndexTests(TestCase):
+    VECTORS = {
+        'Where is the library?': [1.0, 0.0, 0.0],
+        'Where is the hostel?': [0.8, 0.6, 0.0],
+        'What are the fees?': [0.0, 2.0, 0.0],   # stored normalized
+        'When are the exams?': [0.0, 0.0, 1.0],
+        'Library, moved': [0.0, 0.0, -1.0],
+    }
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.index = NumpyVectorIndex(self.directory, embedding=TableEmbeddings(self.VECTORS))
+        self.entries = [KnowledgeBase.objects.create(question=question, answer=f'Answer {n}')
+                        for n, question in enumerate(list(self.VECTORS)[:4])]
+        self.ids = [str(entry.pk) for entry in self.entries]
+        self.index.add_documents([utils.kb_document(entry) for entry in self.entries], ids=self.ids)
+
+    def top(self, vector, k):
+        return [(str(kb_id), round(score, 4)) for kb_id, score in self.index.search_by_vectors([vector], k)[0]]
+
+    def test_search_returns_the_best_rows_in_order(self):
+        self.assertEqual(self.top([1.0, 0.0, 0.0], 2), [(self.ids[0], 1.0), (self.ids[1], 0.8)])
+        self.assertEqual(self.top([0.0, 3.0, 0.0], 2), [(self.ids[2], 1.0), (self.ids[1], 0.6)])
+        self.assertEqual(len(self.top([1.0, 0.0, 0.0], 10)), 4)
+
+    def test_update_overwrites_the_row_in_place(self):
+        other_worker = NumpyVectorIndex(self.directory, embedding=None)
+        self.assertEqual(other_worker.count(), 4)
+
+        moved = Document(page_content='Library, moved', metadata={}, id=self.ids[0])
+        self.index.add_documents([moved], ids=[self.ids[0]])
+
+        self.assertEqual(self.index._read_meta()['rows'], 4)
+        self.assertEqual(other_worker.search_by_vectors([[0.0, 0.0, -1.0]], 1)[0], [(int(self.ids[0]), 1.0)])
+        self.assertEqual(self.top([1.0, 0.0, 0.0], 1), [(self.ids[1], 0.8)])
+
+    def test_delete_tombstones_the_row(self):
+        self.index.delete([self.ids[1]])
+        self.assertEqual(self.index.count(), 3)
+        self.assertEqual(sorted(self.index.get()['ids']), sorted(self.ids[:1] + self.ids[2:]))
+        self.assertEqual(self.top([0.8, 0.6, 0.0], 2), [(self.ids[0], 0.8), (self.ids[2], 0.6)])
+
+        # Adding it back appends a fresh row; the tombstone stays behind
+        self.index.add_documents([utils.kb_document(self.entries[1])], ids=[self.ids[1]])
+        self.assertEqual(self.index._read_meta()['rows'], 5)
+        self.assertEqual(self.index.count(), 4)
+        self.assertEqual(self.top([0.8, 0.6, 0.0], 2), [(self.ids[1], 1.0), (self.ids[0], 0.8)])
+
+    def test_top_k_matches_a_full_sort(self):
+        rng = np.random.default_rng(7)
+        vectors = rng.normal(size=(50, 8))
+        table = {f'q{n}': list(vector) for n, vector in enumerate(vectors)}
+        index = NumpyVectorIndex(os.path.join(self.directory, 'random'), embedding=TableEmbeddings(table))
+        index.add_documents([Document(page_content=text, metadata={}) for text in table], ids=range(50))
+
+        queries = rng.normal(size=(3, 8))
+        unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        for query, hits in zip(queries, index.search_by_vectors(queries, 5)):
+            expected = np.argsort(-(unit @ (query / np.linalg.norm(query))))[:5]
+            self.assertEqual([kb_id for kb_id, _ in hits], expected.tolist())
+
+    def test_distance_is_squared_l2_between_unit_vectors(self):
+        hits = self.index.similarity_search_by_vector_with_relevance_scores([0.8, 0.6, 0.0], k=3)
+        self.assertEqual([doc.id for doc, _ in hits], [self.ids[1], self.ids[0], self.ids[2]])
+        for (_, distance), cosine in zip(hits, (1.0, 0.8, 0.6)):
+            self.assertAlmostEqual(distance, 2 - 2 * cosine, places=5)
+        self.assertEqual(hits[1][0].metadata['answer'], 'Answer 0')
+
+
+class FrameCoalescerTests(SimpleTestCase):
+    """Tokens are batched into SSE frames by size and by time"""
+
+    def setUp(self):
+        self.now = 100.0
+        patch = mock.patch.object(streaming, 'time', SimpleNamespace(monotonic=lambda: self.now))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.coalescer = streaming.FrameCoalescer(window_ms=50, max_bytes=8)
+
+    def test_first_token_goes_out_at_once(self):
+        self.assertEqual(self.coalescer.add('Hi'), ['data: Hi\n\n'])
+        self.assertEqual(self.coalescer.add(' the'), [])
+        self.assertEqual(self.coalescer.deadline(), 100.05)
+
+    def test_flush_on_size(self):
+        self.coalescer.add('Hi')
+        self.assertEqual(self.coalescer.add(' the'), [])
+        self.assertEqual(self.coalescer.add(' fee'), ['data:  the fee\n\n'])
+        self.assertIsNone(self.coalescer.deadline())
+
+    def test_flush_on_time(self):
+        self.coalescer.add('Hi')
+        self.coalescer.add(' a')
+        self.now += 0.02
+        self.assertEqual(self.coalescer.add(' b'), [])
+        self.now += 0.04
+        self.assertEqual(self.coalescer.add(' c'), ['data:  a b c\n\n'])
+
+    def test_events_flush_buffered_text_first(self):
+        self.coalescer.add('Hi')
+        self.coalescer.add(' a')
+        frames = self.coalescer.add(StreamEvent('error', {'message': 'x'}))
+        self.assertEqual(frames, ['data:  a\n\n', 'event: error\ndata: {"message": "x"}\n\n'])
+
+    def test_multiline_text_keeps_its_line_breaks(self):
+        frames = list(streaming.sse_frames(['One\nTwo', '\r\nThree'], streaming.FrameCoalescer(0, 100)))
+        self.assertEqual(frames, ['data: One\ndata: Two\n\n', 'data: \ndata: Three\n\n'])
+
+
+class AsyncFrameTests(SimpleTestCase):
+
+    async def test_buffered_text_is_sent_while_the_model_stalls(self):
+        resume = asyncio.Event()
+
+        async def tokens():
+            yield 'Hi'
+            yield ' there'
+            await resume.wait()   # only set once ' there' has been sent on its own
+            yield '!'
+
+        frames = []
+        async for frame in streaming.asse_frames(tokens(), streaming.FrameCoalescer(window_ms=20, max_bytes=100)):
+            frames.append(frame)
+            if frame == 'data:  there\n\n':
+                resume.set()
+        self.assertEqual(frames, ['data: Hi\n\n', 'data:  there\n\n', 'data: !\n\n'])
+
+    async def test_gzip_decodes_to_the_same_frames(self):
+        frames = ['data: Hi\n\n', 'event: meta\ndata: {"source": "llm"}\n\n', 'data: ünï\ndata: code\n\n']
+
+        async def source():
+            for frame in frames:
+                yield frame
+
+        chunks = [chunk async for chunk in streaming.agzip_frames(source())]
+        self.assertEqual(zlib.decompress(b''.join(chunks), 31).decode('utf-8'), ''.join(frames))
+
+
+class GzipFrameTests(SimpleTestCase):
+
+    def test_every_frame_can_be_decoded_as_it_arrives(self):
+        frames = list(streaming.sse_frames(['Hi', ' the\nfee', StreamEvent('meta', {'source': 'llm'}), ' is'],
+                                           streaming.FrameCoalescer(0, 1)))
+        chunks = list(streaming.gzip_frames(iter(frames)))
+
+        decoder = zlib.decompressobj(31)
+        for frame, chunk in zip(frames, chunks):
+            self.assertEqual(decoder.decompress(chunk).decode('utf-8'), frame)
+        self.assertEqual(zlib.decompress(b''.join(chunks), 31).decode('utf-8'), ''.join(frames))
+
+
+@override_settings(CHAT_LOG_RETRIES=2, CHAT_LOG_RETRY_SECONDS=0)
+class ChatLogWriterTests(TransactionTestCase):
+    """A batch that keeps failing is stored exchange by exchange"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='student@example.com')
+        self.writer = ChatLogWriter()
+        self.release_first_write = threading.Event()
+        self.calls = []
+        bulk_create = ChatMessage.objects.bulk_create
+
+        def flaky_bulk_create(rows, *args, **kwargs):
+            self.calls.append(len(rows))
+            if len(self.calls) == 1:
+                self.release_first_write.wait(5)   # lets the test queue up a batch behind this write
+            elif len(rows) > 2:
+                raise DatabaseError('database is locked')
+            return bulk_create(rows, *args, **kwargs)
+
+        patch = mock.patch.object(ChatMessage.objects, 'bulk_create', flaky_bulk_create)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_fallback_stores_every_message(self):
+        self.writer.submit(self.user, 'Question 0', 'Answer 0')
+        while not self.calls:
+            time.sleep(0.01)
+        for n in (1, 2, 3):
+            self.writer.submit(self.user, f'Question {n}', f'Answer {n}', truncated=n == 3)
+
+        self.assertFalse(self.writer.wait_for(self.user.pk, timeout=0.05))
+        self.assertEqual(self.writer.pending(self.user.pk), 4)
+        self.release_first_write.set()
+        self.assertTrue(self.writer.wait_for(self.user.pk, timeout=5))
+
+        # Read right after wait_for returns: every row is already committed
+        stored = list(ChatMessage.objects.filter(user=self.user).order_by('id').values_list('role', 'content', 'truncated'))
+        expected = []
+        for n in range(4):
+            expected += [('user', f'Question {n}', False), ('assistant', f'Answer {n}', n == 3)]
+        self.assertEqual(stored, expected)
+        self.assertEqual(self.calls, [2, 6, 6, 2, 2, 2])
+        self.assertEqual(self.writer.pending(self.user.pk), 0)
+
+
+class RetrievalServiceTests(TransactionTestCase):
+    """Workers querying the service get what the service's own index returns"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.index = NumpyVectorIndex(os.path.join(self.directory, 'index'),
+                                      embedding=TableEmbeddings(NumpyVectorIndexTests.VECTORS))
+        entries = [KnowledgeBase.objects.create(question=question, answer=f'Answer {n}')
+                   for n, question in enumerate(list(NumpyVectorIndexTests.VECTORS)[:4])]
+        self.index.add_documents([utils.kb_document(entry) for entry in entries], ids=[str(e.pk) for e in entries])
+
+        patch = mock.patch.object(utils, 'get_vector_store', lambda: self.index)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        self.path = os.path.join(self.directory, 'retrieval.sock')
+        server = RetrievalServer(self.path, RetrievalRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def assert_same_results(self, remote, local):
+        self.assertEqual([(doc.id, doc.page_content, doc.metadata) for doc, _ in remote],
+                         [(doc.id, doc.page_content, doc.metadata) for doc, _ in local])
+        for (_, remote_score), (_, local_score) in zip(remote, local):
+            self.assertAlmostEqual(remote_score, local_score, places=6)
+
+    def test_results_match_the_local_index(self):
+        client = RemoteVectorStore(self.path, timeout=5)
+        queries = [[0.8, 0.6, 0.0], [0.0, 0.1, 1.0]]
+
+        self.assert_same_results(client.similarity_search_by_vector_with_relevance_scores(queries[0], k=3),
+                                 self.index.similarity_search_by_vector_with_relevance_scores(queries[0], k=3))
+        for remote, local in zip(client.similarity_search_by_vectors_with_score(queries, k=2),
+                                 self.index.similarity_search_by_vectors_with_score(queries, k=2)):
+            self.assertEqual(len(remote), 2)
+            self.assert_same_results(remote, local)
+        self.assertEqual(client.count(), 4)
+
+    def test_missing_socket_raises(self):
+        client = RemoteVectorStore(os.path.join(self.directory, 'missing.sock'), timeout=1)
+        with self.assertRaises(RetrievalServiceError):
+            client.ping()
+        with self.assertRaises(RetrievalServiceError):
+            client.similarity_search_by_vector_with_relevance_scores([1.0, 0.0, 0.0])
+
+
+@override_settings(KB_VERSION_CHECK_SECONDS=0.05)
+class KnowledgeBaseVersionTests(TestCase):
+    """A version bump made by another process drops this process's derived caches"""
+
+    def setUp(self):
+        for patch in (mock.patch.object(kb_version, '_version', None),
+                      mock.patch.object(kb_version, '_checked_at', 0.0),
+                      mock.patch.object(retrieval_cache, 'enabled', True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(retrieval_cache.clear)
+        self.addCleanup(answer_cache.clear)
+        KnowledgeBaseVersion.objects.get_or_create(pk=1)
+
+    def test_bump_in_another_process_invalidates_cached_results(self):
+        version = kb_version.current()
+        retrieval_cache.put('Where is the library?', [1.0, 0.0], [], version)
+        answer_cache.store([1.0, 0.0], 'Near the main gate', version)
+
+        # Another process applied a KB change; this one has not looked yet
+        KnowledgeBaseVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        self.assertEqual(kb_version.current(), version)
+        self.assertIsNotNone(retrieval_cache.get('where is the  library?', version))
+
+        time.sleep(0.06)
+        self.assertEqual(kb_version.current(), version + 1)
+        self.assertEqual(len(retrieval_cache), 0)
+        self.assertIsNone(retrieval_cache.get('Where is the library?', version + 1))
+        self.assertIsNone(answer_cache.lookup([1.0, 0.0], version + 1))
+
+    def test_entries_from_an_older_version_are_not_served(self):
+        retrieval_cache.put('Where is the library?', [1.0, 0.0], [], 3)
+        self.assertIsNone(retrieval_cache.get('Where is the library?', 4))
+        self.assertEqual((len(retrieval_cache), retrieval_cache.bytes), (0, 0))
+
+
+class RetrievalCacheTests(SimpleTestCase):
+
+    def test_lru_eviction_keeps_bytes_under_the_cap(self):
+        cache = RetrievalCache(max_bytes=40)   # each entry below is 16 bytes of vector
+        first = cache.put('first', [1.0, 0.0, 0.0, 0.0], [], 1)
+        cache.put('second', [0.0, 1.0, 0.0, 0.0], [], 1)
+        self.assertIs(cache.get('first', 1), first)   # now the most recently used
+
+        cache.put('third', [0.0, 0.0, 1.0, 0.0], [], 1)
+        self.assertIsNone(cache.get('second', 1))
+        self.assertEqual((len(cache), cache.bytes), (2, 32))
+
+        # A context assembled later counts too, and can push the oldest entry out
+        cache.add_context(first, 100, 'x' * 20)
+        self.assertEqual((len(cache), cache.bytes), (1, 16))
+        self.assertIsNotNone(cache.get('third', 1))
+
+
+class JsonArrayChunkTests(SimpleTestCase):
+    """iter_json_array gives the same items and errors wherever the chunks split the text"""
+
+    VALID = ('[{"question": "Tab\\there, \\"quoted\\" and \\u00e9 \\ud83d\\ude00", "answer": "Fee: Rs. 5000 — café"},'
+             ' 12345, -0.5e+10, 3.25, 0, true, false, null, "a \\\\ b", [1, [2, {}]], {"k": 1.25E-3}]  ')
+
+    MALFORMED = [
+        ('[1, 2, tru]', [1, 2], 2),
+        ('[{"question": "q", "answer": }]', [], 0),
+        ('[12, 34', [12, 34], 2),
+        ('[1 2]', [1], 1),
+        ('["abc', [], 0),
+        ('[12, 3.]', [12, 3], 2),
+        ('[true, nul]', [True], 1),
+        ('[1, 2] x', [1, 2], 2),
+    ]
+
+    def read(self, text, chunk_size):
+        items = []
+        try:
+            for index, item in iter_json_array(io.BytesIO(text.encode('utf-8')), chunk_size=chunk_size):
+                self.assertEqual(index, len(items))
+                items.append(item)
+        except IngestError as e:
+            return items, e.offset
+        return items, None
+
+    def test_items_do_not_depend_on_chunk_boundaries(self):
+        expected = json.loads(self.VALID)
+        for chunk_size in range(1, len(self.VALID.encode('utf-8')) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.read(self.VALID, chunk_size), (expected, None))
+
+    def test_errors_do_not_depend_on_chunk_boundaries(self):
+        for text, items, offset in self.MALFORMED:
+            for chunk_size in range(1, len(text) + 1):
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    self.assertEqual(self.read(text, chunk_size), (items, offset))
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_ALLOWED_IPS=['10.0.0.5'], METRICS_TOKEN='scrape-secret')
+class MetricsAccessTests(SimpleTestCase):
+
+    def get(self, remote_addr, **headers):
+        return self.client.get('/metrics', REMOTE_ADDR=remote_addr, **headers)
+
+    def test_allowed_address_is_served(self):
+        response = self.get('10.0.0.5')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE chatbot_chat_stage_seconds histogram', response.content)
+
+    def test_other_addresses_need_the_token(self):
+        self.assertEqual(self.get('203.0.113.7').status_code, 403)
+        self.assertEqual(self.get('203.0.113.7', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.get('203.0.113.7', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_no_token_configured_means_allowlist_only(self):
+        self.assertEqual(self.get('203.0.113.7', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class StreamExecutorTests(SimpleTestCase):
+    """Sync streams under ASGI share a bounded pool of threads"""
+
+    def setUp(self):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-stream')
+        self.addCleanup(executor.shutdown)
+        patch = mock.patch.object(views, 'stream_executor', executor)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.gate = threading.Event()
+        self.addCleanup(self.gate.set)
+        self.ran = []
+
+    def slow(self):
+        self.ran.append(threading.current_thread().name)
+        self.gate.wait(5)
+        yield 'slow'
+
+    def fast(self, name):
+        self.ran.append(name)
+        yield name
+
+    async def test_streams_past_the_pool_size_wait_for_a_thread(self):
+        first = asyncio.create_task(anext(views.threaded_stream(self.slow())))
+        second = asyncio.create_task(anext(views.threaded_stream(self.fast('fast'))))
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.ran, ['chat-stream_0'])
+
+        self.gate.set()
+        self.assertEqual(await asyncio.wait_for(asyncio.gather(first, second), 5), ['slow', 'fast'])
+        self.assertEqual(self.ran, ['chat-stream_0', 'fast'])
+
+    async def test_stream_cancelled_while_waiting_never_starts(self):
+        cancellation = Cancellation()
+        first = asyncio.create_task(anext(views.threaded_stream(self.slow())))
+        waiting = asyncio.create_task(anext(views.threaded_stream(self.fast('cancelled'), cancellation)))
+        await asyncio.sleep(0.1)
+
+        waiting.cancel()   # the client left before a thread was free
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertTrue(cancellation.cancelled)
+
+        self.gate.set()
+        await asyncio.wait_for(first, 5)
+        await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(views.stream_executor, lambda: None), 5)
+        self.assertEqual(self.ran, ['chat-stream_0'])
@@ -1,10 +1,15 @@
-from .views import ChatBotAPIView,UploadFileView,UploadedDataListView
+from .views import ChatBotAPIView,AsyncChatBotAPIView,BatchChatAPIView,UploadFileView,UploadedDataListView,IngestJobStatusView,ConversationListView,ConversationMessagesView
 from django.urls import path
 from rest_framework_simplejwt.views import TokenVerifyView
 
 urlpatterns = [
     path('chat/',ChatBotAPIView.as_view(), name = 'chatbotresponse'), 
+    path('chat/async/',AsyncChatBotAPIView.as_view(), name = 'chatbotresponse_async'),
+    path('chat/batch/',BatchChatAPIView.as_view(), name = 'chatbot_batch'),
     path('upload_file/',UploadFileView.as_view(), name = 'uploadfile'),
     path('file_records',UploadedDataListView.as_view(), name= 'record_list'), 
+    path('upload_jobs/<int:job_id>/',IngestJobStatusView.as_view(), name= 'upload_job_status'),
+    path('conversations/',ConversationListView.as_view(), name= 'conversation_list'),
+    path('conversations/<int:conversation_id>/messages/',ConversationMessagesView.as_view(), name= 'conversation_messages'),
     path('token/verify/', TokenVerifyView.as_view(), name='token_verify'),  
 ]
\ No newline at end of file
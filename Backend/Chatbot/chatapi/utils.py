@@ -1,16 +1,30 @@
 
-import time,re
+import re
+import asyncio
 import threading
+from asgiref.sync import sync_to_async
 from django.db import connections
-from .embedding import embeddings
-from langchain_chroma import Chroma
+from django.db.models import F
+from django.utils import timezone
+from django.conf import settings
+from .embedding import get_embeddings
+from .cache import answer_cache,retrieval_cache
+from .history import load_chat_history,aload_chat_history,schedule_summary_update
+from .scheduler import generation_scheduler,QueueFull
+from .vector_index import NumpyVectorIndex
+from .retrieval_service import RemoteVectorStore,RetrievalServiceError,client_mode
+from . import kb_version
+from .context import assemble_context,context_budget,truncate_to_tokens
+from .coalesce import Flight,single_flight,flight_key,FlightAborted
+from .chatlog import chat_log_writer
+from .metrics import CHAT_STAGE_SECONDS,CHAT_RESPONSES,CHAT_CANCELLATIONS,CHAT_CANCELLED_TOKENS_AVOIDED,INGEST_STAGE_SECONDS,VECTOR_SYNC_DOCUMENTS,GenerationTimer
 from langchain_core.documents import Document
-from langchain_ollama.llms import OllamaLLM
+from .backends import PooledOllamaLLM,llm_pool
 from langchain_core.prompts import ChatPromptTemplate
-from chatapi.models import KnowledgeBase,ChatMessage
+from chatapi.models import KnowledgeBase,ChatMessage,Conversation,VectorSyncOutbox
 import logging
 from langchain.memory import ConversationBufferMemory
-from langchain.schema import HumanMessage, AIMessage
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
 
 
 
@@ -19,16 +33,42 @@ logger = logging.getLogger(__name__)
 CHROMA_DB_DIR = "./chroma_langchain_db"
 COLLECTION_NAME = "knowledgebase_qna"
 
-# Initialize models
-llm = OllamaLLM(model="mistral-q4_k_m", model_kwargs={"num_predict": 150},keep_alive="-1")
-
-
-# Initialize Chroma vector store
-vector_store = Chroma(
-    collection_name=COLLECTION_NAME,
-    persist_directory=CHROMA_DB_DIR,
-    embedding_function=embeddings
-)
+# Models and the vector store are built on first use (or by `manage.py warmup`),
+# so management commands and fresh workers don't pay for them at import
+LLM_MODEL = "mistral-q4_k_m"
+LLM_NUM_PREDICT = 150
+
+_llm = None
+_vector_store = None
+_clients_lock = threading.Lock()
+
+def get_llm():
+    """Shared LLM client; requests are spread over OLLAMA_LLM_URLS"""
+    global _llm
+    if _llm is None:
+        with _clients_lock:
+            if _llm is None:
+                _llm = PooledOllamaLLM(pool=llm_pool, model=LLM_MODEL, model_kwargs={"num_predict": LLM_NUM_PREDICT},keep_alive="-1")
+    return _llm
+
+def get_vector_store():
+    """Retriever backend selected by RETRIEVER_BACKEND, or the shared retrieval service"""
+    global _vector_store
+    if _vector_store is None:
+        with _clients_lock:
+            if _vector_store is None:
+                if client_mode():
+                    _vector_store = RemoteVectorStore(settings.RETRIEVAL_SERVICE_SOCKET)
+                elif settings.RETRIEVER_BACKEND == 'numpy':
+                    _vector_store = NumpyVectorIndex(settings.NUMPY_INDEX_DIR, embedding=get_embeddings())
+                else:
+                    from langchain_chroma import Chroma
+                    _vector_store = Chroma(
+                        collection_name=COLLECTION_NAME,
+                        persist_directory=CHROMA_DB_DIR,
+                        embedding_function=get_embeddings()
+                    )
+    return _vector_store
 
 # Thread-safe initialization
 vector_store_initialized = False
@@ -53,46 +93,114 @@ Answer:"""
 prompt = ChatPromptTemplate.from_template(template)
 # chain = prompt | llm
 
+
+class StreamEvent:
+    """Named SSE event yielded by chatbot_response alongside plain tokens"""
+
+    def __init__(self, event, data):
+        self.event = event
+        self.data = data
+
 def ensure_database_connection():
-    """Ensure database connection is active"""
-    for conn in connections.all():
-        if not conn.is_usable():
-            conn.connect()
+    """
+    Drop connections that errored or outlived CONN_MAX_AGE; Django opens a new
+    one lazily on the next query. Unlike pinging every connection this costs
+    nothing for a healthy connection unless CONN_HEALTH_CHECKS asks for it.
+    """
+    for conn in connections.all(initialized_only=True):
+        conn.close_if_unusable_or_obsolete()
+
+def kb_document(entry):
+    entry_id = str(entry.id)
+    return Document(
+        page_content=entry.question,
+        metadata={"source": "kb",
+                  "answer":entry.answer,
+                  "id":entry_id},
+        id=entry_id
+    )
 
-def sync_new_entries_to_vector_store():
-    """Sync only new entries to vector store with proper DB connection handling"""
+def queue_unsynced_entries():
+    """Put rows whose content differs from what was last synced into the outbox"""
+    stale_ids = list(
+        KnowledgeBase.objects.exclude(synced_hash=F('content_hash')).values_list('id', flat=True)
+    )
+    # Duplicate outbox rows are harmless: rows already in sync are skipped when applied
+    VectorSyncOutbox.objects.bulk_create(
+        [VectorSyncOutbox(kb_id=kb_id, action='upsert') for kb_id in stale_ids],
+        batch_size=1000,
+    )
+    return len(stale_ids)
+
+def apply_outbox_batch(batch_size):
+    """Apply one batch of queued KnowledgeBase changes; return (outbox rows consumed, documents upserted)"""
+    changes = list(VectorSyncOutbox.objects.order_by('id')[:batch_size])
+    if not changes:
+        return 0, 0
+
+    # Last action per row wins
+    latest = {}
+    for change in changes:
+        latest[change.kb_id] = change.action
+
+    upsert_ids = [kb_id for kb_id, action in latest.items() if action == 'upsert']
+    entries = {entry.id: entry for entry in KnowledgeBase.objects.filter(id__in=upsert_ids)}
+
+    delete_ids = [str(kb_id) for kb_id, action in latest.items()
+                  if action == 'delete' or kb_id not in entries]
+    changed = [entry for entry in entries.values() if entry.synced_hash != entry.content_hash]
+
+    if delete_ids:
+        get_vector_store().delete(ids=delete_ids)
+        VECTOR_SYNC_DOCUMENTS.inc(len(delete_ids), action='delete')
+    if changed:
+        get_vector_store().add_documents(documents=[kb_document(entry) for entry in changed],
+                                   ids=[str(entry.id) for entry in changed])
+        now = timezone.now()
+        for entry in changed:
+            entry.synced_hash = entry.content_hash
+            entry.synced_at = now
+        KnowledgeBase.objects.bulk_update(changed, ['synced_hash', 'synced_at'])
+        VECTOR_SYNC_DOCUMENTS.inc(len(changed), action='upsert')
+
+    VectorSyncOutbox.objects.filter(id__in=[change.id for change in changes]).delete()
+    logger.info(f"[VECTOR SYNC] Upserted {len(changed)}, deleted {len(delete_ids)}")
+    return len(changes), len(changed)
+
+def sync_new_entries_to_vector_store(batch_size=None, on_batch=None):
+    """Apply queued KnowledgeBase adds, edits and deletes to the vector store in batches"""
     global vector_store_initialized
+    if client_mode():
+        # The retrieval service owns the index; it applies the changes and bumps the KB version
+        try:
+            upserted = get_vector_store().sync(batch_size)
+        except RetrievalServiceError as e:
+            logger.warning(f"[VECTOR SYNC ERROR] {str(e)}")
+            return False
+        kb_version.refresh()
+        if on_batch and upserted:
+            on_batch(upserted)
+        return True
+
     try:
         ensure_database_connection()
-        
-        # Handle empty vector store case
+
+        processed = 0
         try:
-            existing_ids = set(vector_store.get()['ids'])
-            logger.info(f"[VECTOR SYNC] Existing IDs: {existing_ids}")
-        except:
-            existing_ids = set()
-        
-        new_docs = []
-        new_ids = []
-        
-        # Access models only when needed
-        for entry in KnowledgeBase.objects.all().iterator():
-            entry_id = str(entry.id)
-            if entry_id not in existing_ids:
-                new_docs.append(Document(
-                    page_content=entry.question,
-                    metadata={"source": "kb",
-                              "answer":entry.answer,
-                              "id":entry_id},
-                    id=entry_id
-                ))
-                new_ids.append(entry_id)
-        
-        if new_docs:
-            logger.info(f"[VECTOR SYNC] Adding {len(new_docs)} new documents to vector store")
-            vector_store.add_documents(documents=new_docs, ids=new_ids)
-        else:
-            logger.info("[VECTOR SYNC] No new documents to add")
+            with INGEST_STAGE_SECONDS.time(stage="vector_sync"):
+                while True:
+                    consumed, upserted = apply_outbox_batch(batch_size or settings.VECTOR_SYNC_BATCH_SIZE)
+                    if not consumed:
+                        break
+                    processed += consumed
+                    if on_batch:
+                        on_batch(upserted)
+        finally:
+            if processed:
+                kb_version.bump()
+
+        if not processed:
+            logger.info("[VECTOR SYNC] No changes to apply")
         vector_store_initialized = True
         return True
     
@@ -100,21 +208,90 @@ def sync_new_entries_to_vector_store():
         logger.warning(f"[VECTOR SYNC ERROR] {str(e)}")
         return False
 
+_edit_sync_lock = threading.Lock()
+_edit_sync_state = {"running": False, "again": False}
+
+def schedule_vector_sync():
+    """
+    Apply single KnowledgeBase edits (admin, shell) on a background thread so
+    the KB version moves and derived caches are dropped without waiting for
+    the next upload. Edits arriving during a run are picked up by one more run.
+    """
+    with _edit_sync_lock:
+        if _edit_sync_state["running"]:
+            _edit_sync_state["again"] = True
+            return
+        _edit_sync_state["running"] = True
+
+    def run():
+        try:
+            while True:
+                sync_new_entries_to_vector_store()
+                with _edit_sync_lock:
+                    if not _edit_sync_state["again"]:
+                        _edit_sync_state["running"] = False
+                        return
+                    _edit_sync_state["again"] = False
+        except Exception:
+            with _edit_sync_lock:
+                _edit_sync_state["running"] = False
+            raise
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=run, name="kb-edit-sync", daemon=True).start()
+
+def reconcile_vector_store():
+    """
+    Full comparison of vector store IDs against the KnowledgeBase, for stores
+    that drifted before change tracking existed. Cost grows with the KB size,
+    so this is for maintenance only; the request path uses the outbox.
+    """
+    existing_ids = set(get_vector_store().get(include=[])['ids'])
+    kb_ids = {str(kb_id) for kb_id in KnowledgeBase.objects.values_list('id', flat=True)}
+
+    orphan_ids = list(existing_ids - kb_ids)
+    for start in range(0, len(orphan_ids), settings.VECTOR_SYNC_BATCH_SIZE):
+        get_vector_store().delete(ids=orphan_ids[start:start + settings.VECTOR_SYNC_BATCH_SIZE])
+
+    missing = [int(kb_id) for kb_id in kb_ids - existing_ids]
+    for start in range(0, len(missing), settings.VECTOR_SYNC_BATCH_SIZE):
+        KnowledgeBase.objects.filter(id__in=missing[start:start + settings.VECTOR_SYNC_BATCH_SIZE]).update(synced_hash='')
+    queue_unsynced_entries()
+    logger.info(f"[VECTOR SYNC] Reconcile removed {len(orphan_ids)} orphans, re-queued {len(missing)} missing")
+    return sync_new_entries_to_vector_store()
+
+def vector_store_count():
+    vector_store = get_vector_store()
+    if isinstance(vector_store, (NumpyVectorIndex, RemoteVectorStore)):
+        return vector_store.count()
+    return vector_store._collection.count()
+
 def initialize_vector_store():
     """Thread-safe vector store initialization"""
     global vector_store_initialized
     if not vector_store_initialized:
         with vector_store_lock:
+            if not vector_store_initialized and client_mode():
+                get_vector_store().ping()   # the service built its index when it started
+                vector_store_initialized = True
             if not vector_store_initialized:
+                ensure_database_connection()
+                if vector_store_count() == 0 and KnowledgeBase.objects.exists():
+                    # Fresh index directory or newly selected backend: rebuild it from the KB
+                    reconcile_vector_store()
+                    return
+                queue_unsynced_entries()
                 sync_new_entries_to_vector_store()
 
-def get_user_memory(user):
+def _build_memory(summary, messages):
     memory = ConversationBufferMemory(
         memory_key= 'chat_history',
         return_messages = True
     )
-    
-    messages = ChatMessage.objects.filter(user=user).order_by('timestemp')
+
+    if summary:
+        memory.chat_memory.add_message(SystemMessage(content=f"Summary of earlier conversation: {summary}"))
 
     for msg in messages:
         if msg.role =='user':
@@ -124,59 +301,476 @@ def get_user_memory(user):
 
     return memory
 
+def get_user_memory(user, conversation=None):
+    """
+    Build prompt memory from the conversation's rolling summary and its last
+    few turns only; a prompt outside any conversation gets no history.
+    """
+    if conversation is None:
+        return _build_memory('', [])
+    with CHAT_STAGE_SECONDS.time(stage="history"):
+        if chat_log_writer.pending(user.pk):
+            chat_log_writer.wait_for(user.pk, settings.CHAT_LOG_WAIT_SECONDS)
+        return _build_memory(*load_chat_history(conversation))
+
+async def aget_user_memory(user, conversation=None):
+    if conversation is None:
+        return _build_memory('', [])
+    with CHAT_STAGE_SECONDS.time(stage="history"):
+        if chat_log_writer.pending(user.pk):
+            await sync_to_async(chat_log_writer.wait_for, thread_sensitive=False)(user.pk, settings.CHAT_LOG_WAIT_SECONDS)
+        return _build_memory(*await aload_chat_history(conversation))
+
+def save_exchange(user, question, reply, conversation=None, truncated=False):
+    with CHAT_STAGE_SECONDS.time(stage="persist"):
+        if settings.CHAT_LOG_WRITER:
+            chat_log_writer.submit(user, question, reply, conversation, truncated)
+            return
+        ChatMessage.objects.create(user=user, conversation=conversation, role="user", content=question)
+        ChatMessage.objects.create(user=user, conversation=conversation, role="assistant", content=reply, truncated=truncated)
+        if conversation is not None:
+            Conversation.objects.filter(pk=conversation.pk).update(updated_at=timezone.now())
+
+async def asave_exchange(user, question, reply, conversation=None, truncated=False):
+    with CHAT_STAGE_SECONDS.time(stage="persist"):
+        if settings.CHAT_LOG_WRITER:
+            chat_log_writer.submit(user, question, reply, conversation, truncated)
+            return
+        await ChatMessage.objects.acreate(user=user, conversation=conversation, role="user", content=question)
+        await ChatMessage.objects.acreate(user=user, conversation=conversation, role="assistant", content=reply, truncated=truncated)
+        if conversation is not None:
+            await Conversation.objects.filter(pk=conversation.pk).aupdate(updated_at=timezone.now())
+
+def build_chain(context, memory):
+    return (
+        {
+            "context": lambda x: context,
+            "question": lambda x: x["question"],
+            "chat_history": lambda x: memory.load_memory_variables({})["chat_history"]
+        }
+        | prompt
+        | get_llm()
+    )
+
+
+def count_cancellation(stage, timer):
+    """
+    Record a stream the client walked away from. Returns True when the partial
+    reply should be stored (CHAT_SAVE_PARTIAL_REPLIES), False to discard it.
+    """
+    CHAT_CANCELLATIONS.inc(stage=stage)
+    generated = timer.tokens if timer is not None else 0
+    if stage in ('queued', 'generating'):
+        CHAT_CANCELLED_TOKENS_AVOIDED.inc(max(LLM_NUM_PREDICT - generated, 0))
+    logger.info(f"[CANCELLED] Client disconnected while {stage}, after {generated} tokens")
+    return stage == 'generating' and settings.CHAT_SAVE_PARTIAL_REPLIES
+
+
+def coalescing_eligible(memory):
+    """Only prompts with no chat history or summary are the same for every user"""
+    return settings.COALESCE_ENABLED and not memory.chat_memory.messages
+
+
+def wait_for_generation_slot(ticket):
+    """
+    Yield queue position events until the scheduler grants the ticket a slot,
+    or until the ticket is released because the client went away
+    """
+    last_position = None
+    while not ticket.granted and not ticket.released:
+        position = generation_scheduler.position(ticket)
+        if position and position != last_position:
+            yield StreamEvent('queue', {'position': position})
+            last_position = position
+        ticket.wait(settings.LLM_QUEUE_POLL_SECONDS)
+
+async def await_generation_slot(ticket):
+    last_position = None
+    while not ticket.granted and not ticket.released:
+        position = generation_scheduler.position(ticket)
+        if position and position != last_position:
+            yield StreamEvent('queue', {'position': position})
+            last_position = position
+        await ticket.await_grant(settings.LLM_QUEUE_POLL_SECONDS)
+
+
+def start_generation(flight, stream, ticket, timer):
+    """
+    Run an LLM stream on its own thread, publishing into `flight`. The
+    generation belongs to the flight rather than to the request that started
+    it: it goes on while anyone still reads the flight, so one client leaving
+    does not cut off the others, and is closed once the last reader has left.
+    Takes over `ticket`.
+    """
+    def run():
+        full_reply = ""
+        try:
+            for chunk in stream:
+                token = chunk.content if hasattr(chunk, "content") else str(chunk)
+                full_reply += token
+                timer.token()
+                flight.publish(token)
+                if flight.abandoned:
+                    logger.info(f"[GENERATION] Stopped after {timer.tokens} tokens, no one is reading")
+                    return
+            logger.info(f"[GENERATION] Took {timer.finish():.2f} seconds")
+            flight.finish(clean_response(full_reply))
+        except Exception as e:
+            logger.error(f"[STREAM ERROR] {str(e)}")
+        finally:
+            # Closing the chain closes the HTTP response, which makes Ollama stop generating
+            stream.close()
+            flight.abort()
+            single_flight.leave(flight)
+            generation_scheduler.release(ticket)
+
+    threading.Thread(target=run, name='generation', daemon=True).start()
+
+
+# Running async generations, kept referenced so they are not garbage collected
+_generations = set()
+
+def astart_generation(flight, stream, ticket, timer):
+    """start_generation for chain.astream, as a task on the running event loop"""
+    async def run():
+        full_reply = ""
+        try:
+            async for chunk in stream:
+                token = chunk.content if hasattr(chunk, "content") else str(chunk)
+                full_reply += token
+                timer.token()
+                flight.publish(token)
+                if flight.abandoned:
+                    logger.info(f"[GENERATION] Stopped after {timer.tokens} tokens, no one is reading")
+                    return
+            logger.info(f"[GENERATION] Took {timer.finish():.2f} seconds")
+            flight.finish(clean_response(full_reply))
+        except Exception as e:
+            logger.error(f"[STREAM ERROR] {str(e)}")
+        finally:
+            await stream.aclose()
+            flight.abort()
+            single_flight.leave(flight)
+            generation_scheduler.release(ticket)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _generations.add(task)
+    task.add_done_callback(_generations.discard)
+
 
-def chatbot_response(user,question):
+def chatbot_response(user,question,ticket,conversation=None,cancellation=None):
+    """
+    Stream the reply to `question`. `ticket` is the place in the generation
+    queue the view took before answering; cached, direct and coalesced
+    answers give it back at once, so they never wait for or hold a slot. The
+    exchange is stored under `conversation` when one is given. When the
+    generator runs on another thread than the one serving the client,
+    `cancellation` lets that side give the slot back.
+    """
     logger.info(f"[START] Processing prompt: {question}")
+    flight, leader, generating = None, False, False
+    stage, timer, full_reply = None, None, ""
+    if cancellation is not None:
+        cancellation.track(ticket)
     try:
-        
         initialize_vector_store()
-        
-        memory = get_user_memory(user)
-
-        chain = (
-            {
-                "context": lambda x: get_context(x["question"]),
-                "question": lambda x: x["question"],
-                "chat_history": lambda x: memory.load_memory_variables({})["chat_history"]
-            }
-            | prompt
-            | llm
-        )
-        full_reply = ""
 
+        version = kb_version.current()
+        retrieval = retrieval_cache.get(question, version)
+        memory = get_user_memory(user, conversation)
+        question_vector = None
+        # Cached answers are only shared between prompts without chat history
+        if settings.ANSWER_CACHE_ENABLED and not memory.chat_memory.messages:
+            if retrieval is not None:
+                question_vector = retrieval.vector
+            else:
+                with CHAT_STAGE_SECONDS.time(stage="embedding"):
+                    question_vector = get_embeddings().embed_query(question)
+            cached_reply = answer_cache.lookup(question_vector, version)
+            if cached_reply is not None:
+                generation_scheduler.release(ticket)
+                CHAT_RESPONSES.inc(source='answer_cache')
+                yield StreamEvent('meta', {'source': 'answer_cache'})
+                yield cached_reply
+                save_exchange(user, question, cached_reply, conversation)
+                return
+        
+        if retrieval is None:
+            retrieval = retrieve(question, question_vector, version)
+        relevant_docs = retrieval.docs
+
+        direct_reply = get_direct_answer(relevant_docs)
+        if direct_reply is not None:
+            generation_scheduler.release(ticket)
+            CHAT_RESPONSES.inc(source='direct_answer')
+            yield StreamEvent('meta', {'source': 'direct_answer', 'similarity': round(relevant_docs[0][1], 4)})
+            yield direct_reply
+            save_exchange(user, question, direct_reply, conversation)
+            return
 
+        prompt_question = truncate_to_tokens(question, settings.PROMPT_QUESTION_MAX_TOKENS)
+        context = retrieval_context(retrieval, context_budget(prompt_question, memory.chat_memory.messages))
+
+        if coalescing_eligible(memory):
+            flight, leader = single_flight.join(flight_key(question, context))
+            if not leader:
+                # Ride along on the identical generation already running
+                generation_scheduler.release(ticket)
+                delivered = 0
+                stage = 'coalesced'
+                try:
+                    yield StreamEvent('meta', {'source': 'coalesced'})
+                    for token in flight.follow(settings.LLM_QUEUE_POLL_SECONDS):
+                        delivered += 1
+                        yield token
+                except FlightAborted:
+                    if delivered:
+                        yield "I encountered an error processing your request."
+                        return
+                    # The leader gave up before its first token: generate on our own
+                    flight = None
+                    try:
+                        ticket = generation_scheduler.enqueue(user.pk)
+                    except QueueFull:
+                        # The response has started, so this can no longer be a 429
+                        yield StreamEvent('error', {'message': 'Too many questions in progress, please retry shortly',
+                                                    'retry_after': settings.LLM_QUEUE_RETRY_AFTER})
+                        return
+                    if cancellation is not None:
+                        cancellation.track(ticket)
+                else:
+                    CHAT_RESPONSES.inc(source='coalesced')
+                    save_exchange(user, question, flight.reply, conversation)
+                    return
+
+        if flight is None:
+            # Not shared with anyone, but generated the same way
+            flight, leader = Flight(None), True
+        chain = build_chain(context, memory)
+
+        stage = 'queued'
+        with CHAT_STAGE_SECONDS.time(stage="queue"):
+            yield from wait_for_generation_slot(ticket)
+        generation_ticket = generation_scheduler.hand_over(ticket)
+        if generation_ticket is None:
+            count_cancellation(stage, timer)
+            return
         
         # Generate response
-        start_gen = time.time()
+        stage = 'generating'
+        timer = GenerationTimer()
+        start_generation(flight, chain.stream({"question":prompt_question}), generation_ticket, timer)
+        generating = True
 
         try:
-            for chunk in chain.stream({"question":question}):
-                token = chunk.content if hasattr(chunk, "content") else str(chunk)
-
+            for token in flight.follow(settings.LLM_QUEUE_POLL_SECONDS):
                 full_reply += token
-
                 yield token
-        except Exception as e:
-            logger.error(f"[STREAM ERROR] {str(e)}")
+        except FlightAborted:
             yield "I encountered an error processing your request."
             return
-        
-        # result = chain.invoke({"question": question})
-        generation_time = time.time() - start_gen
-        
-        logger.info(f"[GENERATION] Took {generation_time:.2f} seconds")
-        # reply = result.content if hasattr(result, 'content') else str(result)
+        stage = None
+        CHAT_RESPONSES.inc(source='llm')
 
-        final_reply = clean_response(full_reply)   
+        final_reply = flight.reply
         memory.save_context({'input':question},{'output':final_reply})
+
+        if question_vector is not None:
+            answer_cache.store(question_vector, final_reply, version)
         
-        ChatMessage.objects.create(user=user, role="user", content=question)
-        ChatMessage.objects.create(user=user, role="assistant", content=final_reply)
+        save_exchange(user, question, final_reply, conversation)
+
+        schedule_summary_update(conversation, get_llm())
             
         
+    except GeneratorExit:
+        # The response was closed early: the client disconnected
+        if stage and count_cancellation(stage, timer) and full_reply.strip():
+            save_exchange(user, question, full_reply.strip(), conversation, truncated=True)
+        raise
     except Exception as e:
         logger.info(f"[ERROR] {str(e)}")
         return "I encountered an error processing your request."
+    finally:
+        if flight is not None:
+            flight.detach()
+            if leader and not generating:
+                # Nothing will publish into the flight: let waiting followers generate on their own
+                flight.abort()
+                single_flight.leave(flight)
+        generation_scheduler.release(ticket)
+
+
+async def achatbot_response(user, question, ticket, conversation=None):
+    """
+    Async twin of chatbot_response for the ASGI endpoint: async ORM for history
+    and persistence, and chain.astream so no thread is held while tokens arrive.
+    """
+    logger.info(f"[START] Processing prompt (async): {question}")
+    flight, leader, generating = None, False, False
+    stage, timer, full_reply = None, None, ""
+    try:
+        await sync_to_async(initialize_vector_store)()
+
+        version = await kb_version.acurrent()
+        retrieval = retrieval_cache.get(question, version)
+        memory = await aget_user_memory(user, conversation)
+        question_vector = None
+        # Cached answers are only shared between prompts without chat history
+        if settings.ANSWER_CACHE_ENABLED and not memory.chat_memory.messages:
+            if retrieval is not None:
+                question_vector = retrieval.vector
+            else:
+                with CHAT_STAGE_SECONDS.time(stage="embedding"):
+                    question_vector = await get_embeddings().aembed_query(question)
+            cached_reply = answer_cache.lookup(question_vector, version)
+            if cached_reply is not None:
+                generation_scheduler.release(ticket)
+                CHAT_RESPONSES.inc(source='answer_cache')
+                yield StreamEvent('meta', {'source': 'answer_cache'})
+                yield cached_reply
+                await asave_exchange(user, question, cached_reply, conversation)
+                return
+
+        if retrieval is None:
+            retrieval = await aretrieve(question, question_vector, version)
+        relevant_docs = retrieval.docs
+
+        direct_reply = get_direct_answer(relevant_docs)
+        if direct_reply is not None:
+            generation_scheduler.release(ticket)
+            CHAT_RESPONSES.inc(source='direct_answer')
+            yield StreamEvent('meta', {'source': 'direct_answer', 'similarity': round(relevant_docs[0][1], 4)})
+            yield direct_reply
+            await asave_exchange(user, question, direct_reply, conversation)
+            return
+
+        prompt_question = truncate_to_tokens(question, settings.PROMPT_QUESTION_MAX_TOKENS)
+        context = retrieval_context(retrieval, context_budget(prompt_question, memory.chat_memory.messages))
+
+        if coalescing_eligible(memory):
+            flight, leader = single_flight.join(flight_key(question, context))
+            if not leader:
+                generation_scheduler.release(ticket)
+                delivered = 0
+                stage = 'coalesced'
+                try:
+                    yield StreamEvent('meta', {'source': 'coalesced'})
+                    async for token in flight.afollow(settings.LLM_QUEUE_POLL_SECONDS):
+                        delivered += 1
+                        yield token
+                except FlightAborted:
+                    if delivered:
+                        yield "I encountered an error processing your request."
+                        return
+                    flight = None
+                    try:
+                        ticket = generation_scheduler.enqueue(user.pk)
+                    except QueueFull:
+                        # The response has started, so this can no longer be a 429
+                        yield StreamEvent('error', {'message': 'Too many questions in progress, please retry shortly',
+                                                    'retry_after': settings.LLM_QUEUE_RETRY_AFTER})
+                        return
+                else:
+                    CHAT_RESPONSES.inc(source='coalesced')
+                    await asave_exchange(user, question, flight.reply, conversation)
+                    return
+
+        if flight is None:
+            flight, leader = Flight(None), True
+        chain = build_chain(context, memory)
+        ticket.bind_loop()
+
+        stage = 'queued'
+        with CHAT_STAGE_SECONDS.time(stage="queue"):
+            async for event in await_generation_slot(ticket):
+                yield event
+        generation_ticket = generation_scheduler.hand_over(ticket)
+        if generation_ticket is None:
+            count_cancellation(stage, timer)
+            return
+
+        stage = 'generating'
+        timer = GenerationTimer()
+        astart_generation(flight, chain.astream({"question":prompt_question}), generation_ticket, timer)
+        generating = True
+
+        try:
+            async for token in flight.afollow(settings.LLM_QUEUE_POLL_SECONDS):
+                full_reply += token
+                yield token
+        except FlightAborted:
+            yield "I encountered an error processing your request."
+            return
+        stage = None
+        CHAT_RESPONSES.inc(source='llm')
+
+        final_reply = flight.reply
+
+        if question_vector is not None:
+            answer_cache.store(question_vector, final_reply, version)
+
+        await asave_exchange(user, question, final_reply, conversation)
+
+        schedule_summary_update(conversation, get_llm())
+
+    except (GeneratorExit, asyncio.CancelledError):
+        # Client disconnect: the server cancelled the response task or closed the stream
+        if stage and count_cancellation(stage, timer) and full_reply.strip():
+            await asave_exchange(user, question, full_reply.strip(), conversation, truncated=True)
+        raise
+    except Exception as e:
+        logger.info(f"[ERROR] {str(e)}")
+    finally:
+        if flight is not None:
+            flight.detach()
+            if leader and not generating:
+                flight.abort()
+                single_flight.leave(flight)
+        generation_scheduler.release(ticket)
+
+
+def batch_relevant_documents(questions):
+    """Embed all questions in one call and retrieve their relevant documents together"""
+    initialize_vector_store()
+    vectors = get_embeddings().embed_documents(questions)
+
+    vector_store = get_vector_store()
+    if isinstance(vector_store, (NumpyVectorIndex, RemoteVectorStore)):
+        results = vector_store.similarity_search_by_vectors_with_score(vectors, k=10)
+    else:
+        raw = vector_store._collection.query(
+            query_embeddings=vectors, n_results=10, include=["documents", "metadatas", "distances"]
+        )
+        results = [
+            [(Document(page_content=text, metadata=metadata, id=doc_id), distance)
+             for doc_id, text, metadata, distance in zip(ids, texts, metadatas, distances)]
+            for ids, texts, metadatas, distances in zip(
+                raw["ids"], raw["documents"], raw["metadatas"], raw["distances"])
+        ]
+
+    return [filter_relevant_documents(docs) for docs in results]
+
+
+def generate_batch_answer(user, question, relevant_docs):
+    """
+    Answer one batch question with the interactive prompt and context logic,
+    without chat history or persistence. Returns (answer, source).
+    """
+    direct_reply = get_direct_answer(relevant_docs)
+    if direct_reply is not None:
+        return direct_reply, "direct_answer"
+
+    prompt_question = truncate_to_tokens(question, settings.PROMPT_QUESTION_MAX_TOKENS)
+    chain = build_chain(build_context(relevant_docs, context_budget(prompt_question, [])), _build_memory('', []))
+    ticket = generation_scheduler.acquire(user.pk, settings.LLM_QUEUE_POLL_SECONDS)
+    try:
+        result = chain.invoke({"question": prompt_question})
+    finally:
+        generation_scheduler.release(ticket)
+
+    reply = result.content if hasattr(result, "content") else str(result)
+    return clean_response(reply), "llm"
 
 
 def clean_response(response):
@@ -199,10 +793,8 @@ def clean_response(response):
     
     return response
 
-def get_context(question):
-    """Retrieve relevant context from vector store"""
-    docs = vector_store.similarity_search_with_score(question, k=10)
-    
+def filter_relevant_documents(docs):
+    """Keep (document, similarity) pairs above the relevance threshold, best first"""
     relevant_docs = []
     for doc, score in docs:
         similarity = 1.0 - score
@@ -210,11 +802,76 @@ def get_context(question):
             relevant_docs.append((doc, similarity))
             logger.info(f"Relevant doc: similarity={similarity:.2f}, content={doc.page_content[:50]}...")
     
-    context = ""
-    if relevant_docs:
-        context = "\n".join([f"Content: {doc.page_content}\nAnswer: {doc.metadata.get('answer', '')}" 
-                             for doc, similarity in relevant_docs])
-    else:
+    if not relevant_docs:
         logger.info("[RETRIEVER] No relevant documents found")
-    
+
+    return relevant_docs
+
+def search_by_vector(question_vector, k=10):
+    """(document, distance) pairs for an already embedded question"""
+    with CHAT_STAGE_SECONDS.time(stage="search"):
+        return get_vector_store().similarity_search_by_vector_with_relevance_scores(question_vector, k=k)
+
+def get_relevant_documents(question, question_vector=None):
+    """Retrieve (document, similarity) pairs above the relevance threshold, best first"""
+    if question_vector is None:
+        with CHAT_STAGE_SECONDS.time(stage="embedding"):
+            question_vector = get_embeddings().embed_query(question)
+    return filter_relevant_documents(search_by_vector(question_vector))
+
+def retrieve(question, question_vector=None, version=None):
+    """
+    Embed (unless given) and search for `question`, caching the result under
+    `version`, the KB version read before the search (current if not given)
+    """
+    if version is None:
+        version = kb_version.current()
+    if question_vector is None:
+        with CHAT_STAGE_SECONDS.time(stage="embedding"):
+            question_vector = get_embeddings().embed_query(question)
+    docs = filter_relevant_documents(search_by_vector(question_vector))
+    return retrieval_cache.put(question, question_vector, docs, version)
+
+async def aretrieve(question, question_vector=None, version=None):
+    if version is None:
+        version = await kb_version.acurrent()
+    if question_vector is None:
+        with CHAT_STAGE_SECONDS.time(stage="embedding"):
+            question_vector = await get_embeddings().aembed_query(question)
+    docs = filter_relevant_documents(
+        await sync_to_async(search_by_vector, thread_sensitive=False)(question_vector)
+    )
+    return retrieval_cache.put(question, question_vector, docs, version)
+
+def retrieval_context(retrieval, budget):
+    """Context for a cached retrieval at this token budget, assembled once per budget"""
+    context = retrieval.contexts.get(budget)
+    if context is None:
+        context = build_context(retrieval.docs, budget)
+        retrieval_cache.add_context(retrieval, budget, context)
     return context
+
+def build_context(relevant_docs, budget=None):
+    """Format retrieved documents into the prompt context block within a token budget"""
+    if budget is None:
+        budget = context_budget('', [])
+    return assemble_context(relevant_docs, budget)
+
+def get_context(question):
+    """Retrieve relevant context from vector store"""
+    version = kb_version.current()
+    retrieval = retrieval_cache.get(question, version) or retrieve(question, version=version)
+    return retrieval_context(retrieval, context_budget('', []))
+
+def get_direct_answer(relevant_docs):
+    """Return the stored answer of a near-exact KnowledgeBase match, or None"""
+    if not settings.DIRECT_ANSWER_ENABLED or not relevant_docs:
+        return None
+
+    doc, similarity = relevant_docs[0]
+    answer = doc.metadata.get('answer', '').strip()
+    if similarity < settings.DIRECT_ANSWER_THRESHOLD or not answer:
+        return None
+
+    logger.info(f"[DIRECT ANSWER] similarity={similarity:.2f}, kb_id={doc.metadata.get('id')}")
+    return answer
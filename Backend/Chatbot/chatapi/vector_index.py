@@ -0,0 +1,224 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from langchain_core.documents import Document
+from .models import KnowledgeBase
+
+
+logger = logging.getLogger(__name__)
+
+
+class NumpyVectorIndex:
+    """
+    Brute-force cosine index over KnowledgeBase question embeddings.
+
+    Vectors live in one contiguous float32 file that every worker memory-maps
+    read-only, so the OS page cache holds a single copy. Writers take an
+    exclusive file lock, update rows in place or append, then publish a new
+    version in meta.json; readers remap when the version changes. Deleted rows
+    are tombstoned with id -1.
+
+    Exposes the subset of the Chroma vector store API that utils.py uses.
+    """
+
+    def __init__(self, directory, embedding):
+        self.directory = str(directory)
+        self.embedding = embedding
+        os.makedirs(self.directory, exist_ok=True)
+        self._vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self._ids_path = os.path.join(self.directory, 'ids.i64')
+        self._meta_path = os.path.join(self.directory, 'meta.json')
+        self._lock_path = os.path.join(self.directory, '.lock')
+        self._version = None
+        self._mapped = (np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64))
+        self._refresh_lock = threading.Lock()
+
+    # --- storage -------------------------------------------------------
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"dim": 0, "rows": 0, "version": 0}
+
+    def _write_meta(self, meta):
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    @contextmanager
+    def _write_lock(self):
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Remap the files if another process published a new version"""
+        meta = self._read_meta()
+        if meta["version"] == self._version:
+            return
+        with self._refresh_lock:
+            if meta["rows"]:
+                vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r',
+                                    shape=(meta["rows"], meta["dim"]))
+                ids = np.memmap(self._ids_path, dtype=np.int64, mode='r', shape=(meta["rows"],))
+            else:
+                vectors = np.empty((0, meta["dim"]), dtype=np.float32)
+                ids = np.empty(0, dtype=np.int64)
+            # Swap both arrays at once so concurrent searches never see a mismatched pair
+            self._mapped = (vectors, ids)
+            self._version = meta["version"]
+
+    @staticmethod
+    def _normalize(matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _row_index(self, meta):
+        if not meta["rows"]:
+            return {}
+        ids = np.fromfile(self._ids_path, dtype=np.int64, count=meta["rows"])
+        return {int(kb_id): row for row, kb_id in enumerate(ids) if kb_id >= 0}
+
+    # --- vector store API ------------------------------------------------
+
+    def add_documents(self, documents, ids):
+        """Insert or overwrite the vectors for the given KnowledgeBase ids"""
+        if not documents:
+            return []
+        vectors = self._normalize(self.embedding.embed_documents([doc.page_content for doc in documents]))
+
+        with self._write_lock():
+            meta = self._read_meta()
+            if meta["rows"] and meta["dim"] != vectors.shape[1]:
+                raise ValueError(f"Embedding size {vectors.shape[1]} does not match index size {meta['dim']}")
+            rows = self._row_index(meta)
+
+            appended_ids = []
+            appended_vectors = []
+            updates = []
+            for kb_id, vector in zip(ids, vectors):
+                row = rows.get(int(kb_id))
+                if row is None:
+                    appended_ids.append(int(kb_id))
+                    appended_vectors.append(vector)
+                else:
+                    updates.append((row, vector))
+
+            if updates:
+                stored = np.memmap(self._vectors_path, dtype=np.float32, mode='r+',
+                                   shape=(meta["rows"], meta["dim"]))
+                for row, vector in updates:
+                    stored[row] = vector
+                stored.flush()
+                del stored
+
+            if appended_ids:
+                # Drop any tail left by a writer that died before publishing meta
+                if meta["rows"]:
+                    os.truncate(self._vectors_path, meta["rows"] * meta["dim"] * 4)
+                    os.truncate(self._ids_path, meta["rows"] * 8)
+                else:
+                    open(self._vectors_path, 'wb').close()
+                    open(self._ids_path, 'wb').close()
+                with open(self._vectors_path, 'ab') as f:
+                    f.write(np.asarray(appended_vectors, dtype=np.float32).tobytes())
+                with open(self._ids_path, 'ab') as f:
+                    f.write(np.asarray(appended_ids, dtype=np.int64).tobytes())
+
+            self._write_meta({
+                "dim": int(vectors.shape[1]),
+                "rows": meta["rows"] + len(appended_ids),
+                "version": meta["version"] + 1,
+            })
+        return list(ids)
+
+    def delete(self, ids):
+        with self._write_lock():
+            meta = self._read_meta()
+            rows = self._row_index(meta)
+            doomed = [rows[int(kb_id)] for kb_id in ids if int(kb_id) in rows]
+            if not doomed:
+                return
+
+            stored_ids = np.memmap(self._ids_path, dtype=np.int64, mode='r+', shape=(meta["rows"],))
+            stored_ids[doomed] = -1
+            stored_ids.flush()
+            del stored_ids
+            self._write_meta({**meta, "version": meta["version"] + 1})
+
+    def get(self, include=None):
+        self._refresh()
+        return {"ids": [str(kb_id) for kb_id in self._mapped[1] if kb_id >= 0]}
+
+    def count(self):
+        self._refresh()
+        return int(np.count_nonzero(np.asarray(self._mapped[1]) >= 0))
+
+    def search_by_vectors(self, query_vectors, k):
+        """Return, per query, [(kb_id, cosine similarity)] for the top k rows, best first"""
+        self._refresh()
+        vectors, ids = self._mapped
+        if not len(ids):
+            return [[] for _ in query_vectors]
+
+        scores = self._normalize(query_vectors) @ vectors.T
+        scores[:, np.asarray(ids) < 0] = -np.inf
+
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_scores, query_top in zip(scores, top):
+            query_top = query_top[np.argsort(-query_scores[query_top])]
+            results.append([(int(ids[row]), float(query_scores[row]))
+                            for row in query_top if np.isfinite(query_scores[row])])
+        return results
+
+    def similarity_search_by_vectors_with_score(self, query_vectors, k=4):
+        """
+        Batched search returning (Document, distance) per query. The distance is
+        squared L2 between unit vectors (2 - 2 * cosine), which is what Chroma's
+        default collection space reports, so score thresholds mean the same on
+        both backends.
+        """
+        all_hits = self.search_by_vectors(query_vectors, k)
+        entries = KnowledgeBase.objects.in_bulk({kb_id for hits in all_hits for kb_id, _ in hits})
+
+        results = []
+        for hits in all_hits:
+            docs = []
+            for kb_id, similarity in hits:
+                entry = entries.get(kb_id)
+                if entry is None:
+                    continue
+                docs.append((Document(
+                    page_content=entry.question,
+                    metadata={"source": "kb", "answer": entry.answer, "id": str(kb_id)},
+                    id=str(kb_id),
+                ), 2.0 - 2.0 * similarity))
+            results.append(docs)
+        return results
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4):
+        """Same shape as Chroma: (Document, distance) for an already embedded query"""
+        return self.similarity_search_by_vectors_with_score([embedding], k)[0]
+
+    def similarity_search_with_score(self, query, k=4):
+        """Same shape as Chroma: (Document, squared L2 distance)"""
+        return self.similarity_search_by_vector_with_relevance_scores(self.embedding.embed_query(query), k)
+
+    async def asimilarity_search_with_score(self, query, k=4):
+        return await sync_to_async(self.similarity_search_with_score)(query, k)
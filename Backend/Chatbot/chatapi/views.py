@@ -1,15 +1,129 @@
+import hmac
 import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor,as_completed
 from rest_framework.views import APIView
 from rest_framework import status,permissions
 from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from .models import KnowledgeBase,UploadRecord
-from .utils import chatbot_response,sync_new_entries_to_vector_store
-from django.http import StreamingHttpResponse
+from .models import UploadRecord,IngestJob,Conversation
+from .utils import chatbot_response,achatbot_response,sync_new_entries_to_vector_store,StreamEvent,batch_relevant_documents,generate_batch_answer
+from .scheduler import Cancellation,generation_scheduler,QueueFull
+from .ingest import ingest_upload,IngestError
+from .jobs import create_ingest_job,job_progress
+from .warmup import readiness,start_background_warmup
+from .metrics import registry
+from .chatlog import chat_log_writer
+from .streaming import sse_frames,asse_frames,gzip_frames,agzip_frames,accepts_gzip,sse_headers
+from .conversations import resolve_conversation,aresolve_conversation,message_page,conversation_page,page_size
+from django.conf import settings
+from django.db import connections
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse,JsonResponse,HttpResponse,HttpResponseForbidden,Http404
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
 
+logger = logging.getLogger(__name__)
+
 # Create your views here.
 
+def queue_full_response(response_class):
+    response = response_class({'error':'Too many questions in progress, please retry shortly'},
+                              status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(settings.LLM_QUEUE_RETRY_AFTER)
+    return response
+
+
+class TicketStream:
+    """
+    Streaming body that always hands the generation queue place back when
+    Django closes the response, even if the client left before the stream
+    started and the generator that owns the ticket never ran.
+    """
+
+    def __init__(self, stream, ticket):
+        self.stream = stream
+        self.ticket = ticket
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def close(self):
+        generation_scheduler.release(self.ticket)
+
+
+class AsyncTicketStream(TicketStream):
+    def __aiter__(self):
+        return aiter(self.stream)
+
+
+# Threads running sync chat streams under ASGI. Every stream that can be open
+# at once either generates or waits in the generation queue, so the scheduler's
+# limits bound the pool too; streams past that wait here for a thread.
+stream_executor = ThreadPoolExecutor(
+    max_workers=settings.LLM_MAX_CONCURRENT_GENERATIONS + settings.LLM_MAX_QUEUED_GENERATIONS,
+    thread_name_prefix='chat-stream',
+)
+
+
+async def threaded_stream(iterator, cancellation=None):
+    """
+    Serve a sync generator to an ASGI server without buffering it. Django
+    would otherwise collect the whole sync stream with list() before sending
+    anything; here a thread from the stream pool runs it and hands each item
+    to the event loop as it is produced. When the client disconnects the
+    response task is cancelled and `cancellation` is set, which releases any
+    queue ticket the generator tracks on it; the worker closes the generator
+    after its next item, or without starting it if it has not run yet.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancellation = cancellation or Cancellation()
+    finished = object()
+    done = False
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            cancellation.cancel()   # event loop already gone
+
+    def produce():
+        try:
+            if not cancellation.cancelled:
+                for item in iterator:
+                    if cancellation.cancelled:
+                        break
+                    put(item)
+        except Exception as e:
+            put(e)
+        finally:
+            iterator.close()
+            connections.close_all()
+            put(finished)
+
+    stream_executor.submit(produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                done = True
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if not done:
+            cancellation.cancel()
+
+
+
 
 class ChatBotAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -19,69 +133,151 @@ class ChatBotAPIView(APIView):
         if not prompt:
             return Response({'error':'prompt is required'},status=status.HTTP_400_BAD_REQUEST)
         
-       
+        try:
+            conversation = resolve_conversation(request.user, request.data.get('conversation_id'), prompt)
+        except (Conversation.DoesNotExist, ValueError):
+            return Response({'error':'conversation not found'},status=status.HTTP_404_NOT_FOUND)
         
+        # Admission is decided before the response starts, so a full queue is a real 429
+        try:
+            ticket = generation_scheduler.enqueue(request.user.pk)
+        except QueueFull:
+            return queue_full_response(Response)
+
+        cancellation = Cancellation()
+
         def event_stream():
-            for token in chatbot_response(request.user, prompt):
-                yield f"data: {token}\n\n"
-            
-        return StreamingHttpResponse(event_stream(),content_type = "text/event-stream")
+            yield StreamEvent('conversation', {'id': conversation.pk})
+            yield from chatbot_response(request.user, prompt, ticket, conversation, cancellation)
 
+        compressed = accepts_gzip(request)
+        if isinstance(request._request, ASGIRequest):
+            frames = asse_frames(threaded_stream(event_stream(), cancellation))
+            body = AsyncTicketStream(agzip_frames(frames) if compressed else frames, ticket)
+        else:
+            frames = sse_frames(event_stream())
+            body = TicketStream(gzip_frames(frames) if compressed else frames, ticket)
+        return sse_headers(StreamingHttpResponse(body,content_type = "text/event-stream"), compressed)
 
-class UploadFileView(APIView):
+
+class BatchChatAPIView(APIView):
+    """
+    Answer a list of prompts for regression checks and FAQ pre-fill. Retrieval
+    runs for all prompts at once; generations run with bounded parallelism and
+    results stream back as NDJSON in completion order.
+    """
     permission_classes = [permissions.IsAdminUser]
-    parser_classes =[ MultiPartParser]
 
-    def post(self,request):
-        file = request.FILES.get('file')
+    def post(self, request):
+        prompts = request.data.get('prompts')
 
-        if not file:
-            return Response({'error':'no file uploaded'},status=status.HTTP_400_BAD_REQUEST)
-        
+        if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p.strip() for p in prompts):
+            return Response({'error':'prompts must be a non-empty list of strings'},status=status.HTTP_400_BAD_REQUEST)
+
+        if len(prompts) > settings.BATCH_CHAT_MAX_PROMPTS:
+            return Response({'error':f'at most {settings.BATCH_CHAT_MAX_PROMPTS} prompts per batch'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        relevant = batch_relevant_documents(prompts)
+
+        def answer(index):
+            try:
+                reply, source = generate_batch_answer(user, prompts[index], relevant[index])
+                return {"index": index, "prompt": prompts[index], "answer": reply, "source": source,
+                        "kb_ids": [doc.metadata.get('id') for doc, _ in relevant[index]], "error": None}
+            except Exception as e:
+                return {"index": index, "prompt": prompts[index], "answer": None, "source": None,
+                        "kb_ids": [], "error": str(e)}
+            finally:
+                connections.close_all()
+
+        def result_stream():
+            executor = ThreadPoolExecutor(max_workers=settings.BATCH_CHAT_CONCURRENCY)
+            try:
+                futures = [executor.submit(answer, index) for index in range(len(prompts))]
+                for future in as_completed(futures):
+                    yield json.dumps(future.result()) + "\n"
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        # Under ASGI a sync generator would be buffered whole, so run it on a thread
+        body = threaded_stream(result_stream()) if isinstance(request._request, ASGIRequest) else result_stream()
+        return StreamingHttpResponse(body, content_type="application/x-ndjson")
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncChatBotAPIView(View):
+    """
+    Native async chat endpoint for ASGI servers. DRF views are sync-only, so
+    JWT authentication is done by hand; the stream is an async generator.
+    """
+
+    async def post(self, request):
         try:
-            data = json.load(file)
-            
-            if not isinstance(data, list):
-                return Response({'error':'Json must be a list of objects'}, status=status.HTTP_400_BAD_REQUEST)
-            
+            auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
 
-            for i, item in enumerate(data):
-                if not isinstance(item, dict):
-                    return Response({'error':'Invalid not a JSON object.'},status=status.HTTP_400_BAD_REQUEST)
+        if auth is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        user = auth[0]
 
-                if 'question' not in item or 'answer' not in item:
-                    return Response({"error":"Missing 'question' or 'answer' in some items."},status=status.HTTP_400_BAD_REQUEST)
+        try:
+            body = json.loads(request.body or b'{}')
+            prompt = body.get('prompt')
+        except (json.JSONDecodeError, AttributeError):
+            body, prompt = {}, None
 
-        except json.JSONDecodeError:
-            return Response({'error':'provided file is not json format'},status=status.HTTP_400_BAD_REQUEST)
+        if not prompt:
+            return JsonResponse({'error':'prompt is required'},status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            conversation = await aresolve_conversation(user, body.get('conversation_id'), prompt)
+        except (Conversation.DoesNotExist, ValueError):
+            return JsonResponse({'error':'conversation not found'},status=status.HTTP_404_NOT_FOUND)
 
-       
-      
         try:
-            inserted_count = 0
-            skipped_count = 0
-            for item in data:
+            ticket = generation_scheduler.enqueue(user.pk)
+        except QueueFull:
+            return queue_full_response(JsonResponse)
 
-                question = item.get('question','').strip()
-                answer =item.get('answer','').strip()
-                
-                if not question and not answer:
-                    continue
-                
-                
-                exists = KnowledgeBase.objects.filter(
-                    question__iexact=question,
-                    answer__iexact = answer
-                    ).exists()
-                
+        async def event_stream():
+            yield StreamEvent('conversation', {'id': conversation.pk})
+            async for token in achatbot_response(user, prompt, ticket, conversation):
+                yield token
+
+        compressed = accepts_gzip(request)
+        frames = asse_frames(event_stream())
+        body = AsyncTicketStream(agzip_frames(frames) if compressed else frames, ticket)
+        return sse_headers(StreamingHttpResponse(body,content_type = "text/event-stream"), compressed)
+
+
+class UploadFileView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes =[ MultiPartParser]
+
+    def post(self,request):
+        file = request.FILES.get('file')
+
+        if not file:
+            return Response({'error':'no file uploaded'},status=status.HTTP_400_BAD_REQUEST)
+
+        if settings.INGEST_ASYNC_JOBS:
+            job = create_ingest_job(file, request.user)
+            return Response({'message':"Upload queued for processing",
+                            "job_id":job.pk},
+                            status=status.HTTP_202_ACCEPTED)
         
-                if not exists:
-                    KnowledgeBase.objects.create(question=question, answer=answer)
-                    inserted_count += 1
-                else:
-                    skipped_count += 1
+        try:
+            inserted_count, skipped_count = ingest_upload(file)
+        except IngestError as e:
+            return Response({'error':e.message,'offset':e.offset},status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error':str(e)},status=status.HTTP_400_BAD_REQUEST)
 
+        try:
             UploadRecord.objects.create(
                     file_name=file.name,
                     uploaded_by=request.user,
@@ -90,8 +286,8 @@ class UploadFileView(APIView):
                 )
 
             if inserted_count:
-                sync_new_entries_to_vector_store()
-                print("vector db recreated")
+                sync_new_entries_to_vector_store(batch_size=settings.INGEST_EMBED_BATCH_SIZE)
+                logger.info(f"[UPLOAD] Vector store synced after {inserted_count} new entries")
                 
 
             return Response({'message':"Data upload successfully and vector store rebuilt successfully",
@@ -107,19 +303,106 @@ class UploadedDataListView(APIView):
     permission_classes = [permissions.IsAdminUser]
     def get(self, request):
         
-        records = UploadRecord.objects.all().order_by('-uploaded_at')
+        records = UploadRecord.objects.select_related('uploaded_by','job').order_by('-uploaded_at')
 
         data = [{
             "file_name": r.file_name,
             "uploaded_by": r.uploaded_by.username ,
             "uploaded_at": r.uploaded_at,
             "inserted_count": r.inserted,
-            "skipped_count": r.skipped 
+            "skipped_count": r.skipped,
+            "job": job_progress(r.job) if r.job else None
         }for r in records]
 
         if not data:
             return Response({"message":[]}, status=status.HTTP_200_OK)
 
         return Response({'message':data}, status=status.HTTP_200_OK)
-     
 
+
+class IngestJobStatusView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    def get(self, request, job_id):
+        job = IngestJob.objects.filter(pk=job_id).first()
+
+        if job is None:
+            return Response({'error':'job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({'message':job_progress(job)}, status=status.HTTP_200_OK)
+
+
+class ConversationListView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    def get(self, request):
+        try:
+            limit = page_size(request.query_params.get('limit'))
+            conversations, next_cursor = conversation_page(request.user, request.query_params.get('cursor'), limit)
+        except ValueError:
+            return Response({'error':'invalid cursor or limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = [{
+            "id": c.pk,
+            "title": c.title,
+            "created_at": c.created_at,
+            "updated_at": c.updated_at,
+        } for c in conversations]
+        return Response({'message':data, 'next_cursor':next_cursor}, status=status.HTTP_200_OK)
+
+
+class ConversationMessagesView(APIView):
+    """One page of a conversation, newest first; pass next_cursor back to get older messages"""
+    permission_classes = [permissions.IsAuthenticated]
+    def get(self, request, conversation_id):
+        conversation = Conversation.objects.filter(pk=conversation_id, user=request.user).first()
+        if conversation is None:
+            return Response({'error':'conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        chat_log_writer.wait_for(request.user.pk, settings.CHAT_LOG_WAIT_SECONDS)
+        try:
+            limit = page_size(request.query_params.get('limit'))
+            messages, next_cursor = message_page(conversation, request.query_params.get('cursor'), limit)
+        except ValueError:
+            return Response({'error':'invalid cursor or limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = [{
+            "id": m.pk,
+            "role": m.role,
+            "content": m.content,
+            "truncated": m.truncated,
+            "timestemp": m.timestemp,
+        } for m in messages]
+        return Response({'message':data, 'next_cursor':next_cursor}, status=status.HTTP_200_OK)
+
+
+class ReadyView(View):
+    """
+    Readiness probe for load balancers: 503 until this worker has warmed up.
+    The first probe starts warmup in the background if it is not running yet.
+    """
+
+    def get(self, request):
+        state = readiness()
+        if not state["ready"]:
+            start_background_warmup()
+            return JsonResponse(state, status=503)
+        return JsonResponse(state)
+
+
+def metrics_allowed(request):
+    """From an allowed address, or carrying the scrape token when one is configured"""
+    if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+        return True
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' and \
+        hmac.compare_digest(token.strip().encode('utf-8'), settings.METRICS_TOKEN.encode('utf-8'))
+
+
+class MetricsView(View):
+    """Prometheus scrape endpoint; counters are per worker process"""
+
+    def get(self, request):
+        if not settings.METRICS_ENABLED:
+            raise Http404
+        if not metrics_allowed(request):
+            return HttpResponseForbidden()
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
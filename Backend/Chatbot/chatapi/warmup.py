@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from .backends import llm_pool, embedding_pool
+from .embedding import get_embeddings
+from . import utils
+
+
+logger = logging.getLogger(__name__)
+
+# Per-process readiness: each worker must build its own clients and sync state
+_state = {"ready": False, "stage": "cold", "error": None, "took": None}
+_lock = threading.Lock()
+_thread = None
+
+
+def _warm_vector_store():
+    utils.get_vector_store()
+    utils.initialize_vector_store()
+    if not utils.vector_store_initialized:
+        raise RuntimeError("Vector store sync failed, see logs")
+
+
+def warmup():
+    """
+    Build the lazy clients, load the models on every Ollama node and bring the
+    vector store up to date. Marks this process ready when everything succeeds.
+    Returns {stage: seconds}.
+    """
+    timings = {}
+    started = time.time()
+
+    def stage(name, fn):
+        _state["stage"] = name
+        t0 = time.time()
+        fn()
+        timings[name] = round(time.time() - t0, 3)
+        logger.info(f"[WARMUP] {name} took {timings[name]:.2f}s")
+
+    try:
+        # Go past the embedding cache so every node actually loads the model
+        stage("embeddings", lambda: getattr(get_embeddings(), 'underlying', get_embeddings()).preload())
+        stage("llm", lambda: utils.get_llm().preload())
+        stage("vector_store", _warm_vector_store)
+    except Exception as e:
+        _state.update(stage="failed", error=str(e))
+        logger.exception("[WARMUP] Failed")
+        raise
+
+    _state.update(ready=True, stage="ready", error=None, took=round(time.time() - started, 3))
+    return timings
+
+
+def start_background_warmup():
+    """Run warmup once in a daemon thread; a failed run can be started again"""
+    global _thread
+    with _lock:
+        if _state["ready"] or (_thread is not None and _thread.is_alive()):
+            return
+
+        def run():
+            try:
+                warmup()
+            except Exception:
+                pass
+
+        _thread = threading.Thread(target=run, name="warmup", daemon=True)
+        _thread.start()
+
+
+def readiness():
+    return {
+        "ready": _state["ready"],
+        "stage": _state["stage"],
+        "error": _state["error"],
+        "took": _state["took"],
+        "llm_backends": llm_pool.status(),
+        "embedding_backends": embedding_pool.status(),
+    }